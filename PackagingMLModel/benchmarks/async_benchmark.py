@@ -0,0 +1,87 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from pathlib import Path
+import numpy as np
+
+PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
+sys.path.append(str(PACKAGE_ROOT))
+
+from prediction_model.config import config
+from prediction_model.processing.data_handling import load_dataset, separate_data
+from prediction_model.batch_prediction import predict_batch, get_model_parameters
+from prediction_model.async_predictor import AsyncPredictor
+
+#throughput of n concurrent coroutines each awaiting one prediction, against the synchronous path an asyncio service
+#would otherwise call inline (predict_batch on one application per request, blocking the event loop meanwhile).
+#Latency is counted from the moment all coroutines were started, as for a burst of requests arriving together.
+#A ticker coroutine measures the event loop lag, i.e. how long other coroutines of the service are kept waiting
+
+def _sample_records(n: int) -> list:
+    X, _ = separate_data(load_dataset(config.DATA_FILE_NAME))
+    return X.sample(n=n, replace=True, random_state=42).to_dict('records')
+
+async def _ticker(lags: list, stop: asyncio.Event, interval: float = 0.001):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+def _summary(n: int, seconds: float, latencies: list, lags: list) -> dict:
+    summary = {'predictions_per_s': round(n / seconds), 'seconds': round(seconds, 4)}
+    if latencies:
+        p50, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 99])
+        summary.update({'latency_p50_ms': round(float(p50), 3), 'latency_p99_ms': round(float(p99), 3)})
+    summary['max_loop_lag_ms'] = round(max(lags, default=0.0) * 1000, 3)
+    return summary
+
+async def bench_sync(records: list) -> dict:
+    async def handle(record):
+        predict_batch([record], return_proba=True)
+        latencies.append(time.perf_counter() - start)
+    latencies, lags, stop = [], [], asyncio.Event()
+    ticker = asyncio.create_task(_ticker(lags, stop))
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    await asyncio.gather(*(handle(record) for record in records))
+    seconds = time.perf_counter() - start
+    stop.set()
+    await ticker
+    return _summary(len(records), seconds, latencies, lags)
+
+async def bench_async(records: list, **predictor_options) -> dict:
+    async def handle(record):
+        await predictor.predict(record)
+        latencies.append(time.perf_counter() - start)
+    latencies, lags, stop = [], [], asyncio.Event()
+    async with AsyncPredictor(**predictor_options) as predictor:
+        ticker = asyncio.create_task(_ticker(lags, stop))
+        await asyncio.sleep(0)
+        start = time.perf_counter()
+        await asyncio.gather(*(handle(record) for record in records))
+        seconds = time.perf_counter() - start
+        stop.set()
+        await ticker
+        summary = _summary(len(records), seconds, latencies, lags)
+        summary['mean_batch_size'] = round(predictor.stats()['mean_batch_size'], 1)
+    return summary
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="AsyncPredictor throughput against inline synchronous scoring")
+    parser.add_argument('--coroutines', type=int, default=10_000)
+    parser.add_argument('--max-batch-size', type=int, default=config.ASYNC_MAX_BATCH_SIZE)
+    parser.add_argument('--max-queue-depth', type=int, default=config.ASYNC_MAX_QUEUE_DEPTH)
+    parser.add_argument('--workers', type=int, default=config.ASYNC_EXECUTOR_WORKERS)
+    args = parser.parse_args()
+    records = _sample_records(args.coroutines)
+    get_model_parameters()
+    results = {
+        'sync_inline': asyncio.run(bench_sync(records)),
+        'async_predictor': asyncio.run(bench_async(records, max_batch_size=args.max_batch_size,
+                                                   max_queue_depth=args.max_queue_depth, executor_workers=args.workers)),
+    }
+    results['speedup'] = round(results['async_predictor']['predictions_per_s'] / results['sync_inline']['predictions_per_s'], 2)
+    print(json.dumps(results, indent=2))
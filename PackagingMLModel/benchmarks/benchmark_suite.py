@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+
+PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
+sys.path.append(str(PACKAGE_ROOT))
+
+from prediction_model import __version__
+from prediction_model.config import config
+from prediction_model.processing.data_handling import load_dataset, separate_data
+import prediction_model.processing.data_preprocessing as dp
+from prediction_model.synthetic_data import fit_profile, write_synthetic_dataset
+
+#reproducible performance benchmarks on synthetic data (prediction_model.synthetic_data, fixed seed)
+#for every size: csv loading, each data_preprocessing function, fitting the classification pipeline as the training
+#pipeline does, and batch and single-row prediction. Every benchmark runs `repeat` times, the minimum is the figure
+#compared between runs (the least disturbed by other load on the machine), the median is reported as well.
+#Results are written as JSON, with --baseline a previous results file is compared and slower benchmarks are flagged
+
+RESULTS_DIR = os.path.join(PACKAGE_ROOT, 'benchmarks', 'results')
+SINGLE_ROW_SAMPLE = 1000 #applications scored one by one in the single-row benchmarks
+
+def _measure(fn, repeat: int, setup=None) -> dict:
+    #setup() runs before every repetition and is not timed, fn receives what it returns
+    times = []
+    for _ in range(repeat):
+        argument = setup() if setup is not None else None
+        start = time.perf_counter()
+        fn(argument) if setup is not None else fn()
+        times.append(time.perf_counter() - start)
+    return {'min_seconds': min(times), 'median_seconds': statistics.median(times)}
+
+def run_size(file_path: str, rows: int, repeat: int) -> dict:
+    from sklearn.base import clone
+    import prediction_model.pipeline as pipe
+    from prediction_model.batch_prediction import predict_batch, extract_model_parameters
+    from prediction_model.scoring_engine import CompiledScorer
+    results = {}
+
+    def record(name: str, measurement: dict, n: int = rows):
+        measurement['rows'] = n
+        measurement['rows_per_s'] = round(n / measurement['min_seconds'], 1) if measurement['min_seconds'] else None
+        results[name] = measurement
+
+    record('load_dataset', _measure(lambda: load_dataset(file_path), repeat))
+    df = load_dataset(file_path)
+    X, y = separate_data(df)
+    record('EncodingTargetVariable', _measure(lambda: dp.EncodingTargetVariable(y), repeat))
+    #the preprocessing functions modify their input, every repetition gets a fresh copy
+    record('CreateCustomColumns', _measure(dp.CreateCustomColumns, repeat, setup=lambda: X.copy()))
+    with_custom = dp.CreateCustomColumns(X.copy())
+    record('ColumnsToDrop', _measure(dp.ColumnsToDrop, repeat, setup=lambda: with_custom.copy()))
+    dropped = dp.ColumnsToDrop(with_custom.copy())
+    record('TransformingNumericFeatures', _measure(dp.TransformingNumericFeatures, repeat, setup=lambda: dropped.copy()))
+    del with_custom, dropped
+
+    y_encoded = dp.EncodingTargetVariable(y)
+    record('fit_pipeline', _measure(lambda: clone(pipe.classification_pipeline).fit(X, y_encoded), repeat))
+    fitted = clone(pipe.classification_pipeline).fit(X, y_encoded)
+    model_parameters = extract_model_parameters(fitted)
+    record('pipeline_predict', _measure(lambda: fitted.predict(X), repeat))
+    record('predict_batch', _measure(lambda: predict_batch(X, model_parameters=model_parameters), repeat))
+
+    records = X.head(SINGLE_ROW_SAMPLE).to_dict('records')
+    scorer = CompiledScorer(model_parameters)
+    def score_one_by_one(score):
+        for application in records:
+            score(application)
+    record('single_row_compiled_scorer', _measure(lambda: score_one_by_one(lambda r: scorer.predict_one(r, raw=True)), repeat), len(records))
+    record('single_row_predict_batch', _measure(lambda: score_one_by_one(lambda r: predict_batch([r], model_parameters=model_parameters)), repeat), len(records))
+    return results
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PACKAGE_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def environment() -> dict:
+    import pandas as pd
+    import sklearn
+    return {'package_version': __version__, 'git_commit': _git_commit(), 'python': platform.python_version(),
+            'numpy': np.__version__, 'pandas': pd.__version__, 'sklearn': sklearn.__version__,
+            'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'timestamp': datetime.now().isoformat(timespec='seconds')}
+
+def run_suite(sizes: list, repeat: int = 3, data_dir: str = None, seed: int = 42) -> dict:
+    """
+    Runs every benchmark on a synthetic csv of each size. Files are written to data_dir and reused when they
+    already exist there (they only depend on the size and the seed), a temporary directory is used otherwise.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = data_dir or tmp_dir
+        profile = None
+        results = {}
+        for rows in sizes:
+            file_path = os.path.join(data_dir, f"synthetic_{rows}_seed{seed}.csv")
+            if not os.path.exists(file_path):
+                profile = profile or fit_profile()
+                write_synthetic_dataset(file_path, rows, profile, seed)
+            results[str(rows)] = run_size(file_path, rows, repeat)
+            print(f"{rows} rows done", file=sys.stderr)
+    return {'environment': environment(), 'repeat': repeat, 'seed': seed, 'results': results}
+
+def compare(current: dict, baseline: dict, tolerance: float = 0.2) -> list:
+    #benchmarks whose minimum time grew by more than tolerance (0.2 = 20%) over the baseline, for the sizes both ran
+    regressions = []
+    for size, benchmarks in current['results'].items():
+        for name, measurement in benchmarks.items():
+            previous = baseline['results'].get(size, {}).get(name)
+            if previous is None or not previous['min_seconds']:
+                continue
+            ratio = measurement['min_seconds'] / previous['min_seconds']
+            if ratio > 1 + tolerance:
+                regressions.append({'size': int(size), 'benchmark': name, 'baseline_seconds': previous['min_seconds'],
+                                    'seconds': measurement['min_seconds'], 'slowdown': round(ratio, 2)})
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Performance benchmarks on synthetic loan data")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000], help="rows of the synthetic datasets, up to 100M")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--data-dir', help="keep the synthetic files here and reuse them in later runs")
+    parser.add_argument('--output', help=f"results JSON, by default a timestamped file in {RESULTS_DIR}")
+    parser.add_argument('--baseline', help="results JSON of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="slowdown over the baseline flagged as a regression")
+    args = parser.parse_args()
+    suite = run_suite(args.sizes, args.repeat, args.data_dir, args.seed)
+    if args.baseline:
+        with open(args.baseline) as f:
+            suite['regressions'] = compare(suite, json.load(f), args.tolerance)
+    output_path = args.output or os.path.join(RESULTS_DIR, f"benchmark_{datetime.now().strftime('%Y_%m_%d_%H_%M_%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(suite, f, indent=2)
+    for size, benchmarks in suite['results'].items():
+        print(size)
+        for name, measurement in benchmarks.items():
+            print(f"  {name:<30}{measurement['min_seconds']:>10.4f}s  {measurement['rows_per_s'] or 0:>14,.0f} rows/s")
+    print(f"Results written to {output_path}")
+    for regression in suite.get('regressions', []):
+        print(f"REGRESSION {regression['benchmark']} at {regression['size']} rows: {regression['slowdown']}x slower")
+    sys.exit(1 if suite.get('regressions') else 0)
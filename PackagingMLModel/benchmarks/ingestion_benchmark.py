@@ -0,0 +1,73 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
+sys.path.append(str(PACKAGE_ROOT))
+
+from prediction_model.config import config
+from prediction_model.processing.data_handling import load_dataset
+from prediction_model.processing.data_preprocessing import EncodingTarget, EncodingTargetVariable
+
+#before/after benchmark of csv ingestion + target encoding
+#before: pd.read_csv with inferred object dtypes and y.map(EncodingTarget), one python call per row
+#after: load_dataset with the config.DATA_DTYPES schema and the vectorized EncodingTargetVariable
+
+def write_synthetic_file(file_path: str, rows: int, chunk_size: int = 1_000_000, seed: int = 42):
+    #resamples rows of the shipped dataset, keeping its raw layout (leading spaces in headers and values)
+    source = pd.read_csv(os.path.join(config.DATASET_DIR, config.DATA_FILE_NAME))
+    rng = np.random.default_rng(seed)
+    written = 0
+    while written < rows:
+        n = min(chunk_size, rows - written)
+        chunk = source.iloc[rng.integers(0, len(source), n)].copy()
+        chunk['loan_id'] = np.arange(written + 1, written + n + 1)
+        chunk.to_csv(file_path, mode='a' if written else 'w', header=not written, index=False)
+        written += n
+
+def _time(fn) -> tuple:
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+def run_benchmark(file_path: str) -> dict:
+    def before():
+        df = pd.read_csv(file_path)
+        df.columns = [col.strip() for col in df.columns]
+        return df, df[config.TARGET].map(EncodingTarget)
+
+    def after():
+        df = load_dataset(file_path)
+        return df, EncodingTargetVariable(df[config.TARGET])
+
+    results = {}
+    for name, fn in (('before', before), ('after', after)):
+        (df, y), load_and_encode_s = _time(fn)
+        results[name] = {
+            'rows': len(df),
+            'seconds': round(load_and_encode_s, 3),
+            'memory_mb': round(df.memory_usage(deep=True).sum() / 2**20, 1),
+            'positive_rate': round(float(y.mean()), 4),
+        }
+        del df, y
+    results['speedup'] = round(results['before']['seconds'] / results['after']['seconds'], 2)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Ingestion and target encoding benchmark")
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--file', help="existing raw csv to benchmark, a synthetic one is generated otherwise")
+    args = parser.parse_args()
+    if args.file:
+        print(json.dumps(run_benchmark(os.path.abspath(args.file)), indent=2))
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'synthetic_loans.csv')
+            write_synthetic_file(file_path, args.rows)
+            print(json.dumps(run_benchmark(file_path), indent=2))
@@ -0,0 +1,63 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import urllib.request
+from pathlib import Path
+import numpy as np
+
+PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
+sys.path.append(str(PACKAGE_ROOT))
+
+from prediction_model.config import config
+from prediction_model.processing.data_handling import load_dataset, separate_data
+
+#load test for a locally running prediction server (python -m prediction_model.serve)
+#fires single-application /predict requests from concurrent client threads and reports requests/s and latency percentiles
+
+def _sample_payloads(n: int) -> list:
+    X, _ = separate_data(load_dataset(config.DATA_FILE_NAME))
+    X = X.sample(n=n, replace=True, random_state=42)
+    return [json.dumps(record).encode() for record in X.to_dict('records')]
+
+def _client(url: str, payloads: list, latencies: list, errors: list):
+    for payload in payloads:
+        req = urllib.request.Request(url, data=payload, headers={"Content-Type": "application/json"})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req) as response:
+                response.read()
+            latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            errors.append(str(e))
+
+def run_load_test(url: str, requests: int, concurrency: int) -> dict:
+    payloads = _sample_payloads(requests)
+    latencies, errors = [], []
+    threads = [threading.Thread(target=_client, args=(url, payloads[i::concurrency], latencies, errors)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "requests_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 2) if len(latencies) else None,
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 2) if len(latencies) else None,
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 2) if len(latencies) else None,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test for the prediction server")
+    parser.add_argument("--url", default=f"http://{config.SERVE_HOST}:{config.SERVE_PORT}/predict")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+    print(json.dumps(run_load_test(args.url, args.requests, args.concurrency), indent=2))
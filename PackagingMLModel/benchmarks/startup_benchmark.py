@@ -0,0 +1,56 @@
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
+
+#cold start benchmark: every scenario runs in a fresh interpreter and measures the time from the first import
+#to the first prediction, which is what an autoscaled worker or a short-lived CLI pays before doing useful work
+
+RECORD = {'no_of_dependents': 2, 'education': ' Graduate', 'self_employed': ' No', 'income_annum': 9600000,
+          'loan_amount': 29900000, 'loan_term': 12, 'cibil_score': 778, 'residential_assets_value': 2400000,
+          'commercial_assets_value': 17600000, 'luxury_assets_value': 22700000, 'bank_asset_value': 8000000}
+
+SCENARIOS = {
+    'predict_batch': ("from prediction_model import predict_batch", "predict_batch([record])"),
+    'compiled_scorer': ("from prediction_model import CompiledScorer", "CompiledScorer.from_saved_model().predict_one(record, raw=True)"),
+    'prediction_pipeline': ("from prediction_model import prediction_pipeline",
+                            "prediction_pipeline.get_classification_pipeline()"),
+}
+
+_CHILD = """
+import time, json, sys
+start = time.perf_counter()
+{import_stmt}
+imported = time.perf_counter()
+record = json.loads(sys.argv[1])
+{predict_stmt}
+predicted = time.perf_counter()
+print(json.dumps({{'import_s': imported - start, 'first_prediction_s': predicted - start}}))
+"""
+
+def run_scenario(name: str, repeat: int) -> dict:
+    import_stmt, predict_stmt = SCENARIOS[name]
+    code = _CHILD.format(import_stmt=import_stmt, predict_stmt=predict_stmt)
+    env = dict(os.environ, PYTHONPATH=str(PACKAGE_ROOT) + os.pathsep + os.environ.get('PYTHONPATH', ''), PYTHONWARNINGS='ignore')
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', code, json.dumps(RECORD)], cwd=PACKAGE_ROOT, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        result['process_s'] = time.perf_counter() - start
+        runs.append(result)
+    return {key: round(statistics.median(run[key] for run in runs), 4) for key in runs[0]}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import-to-first-prediction benchmark")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    args = parser.parse_args()
+    print(json.dumps({name: run_scenario(name, args.repeat) for name in args.scenarios}, indent=2))
@@ -14,7 +14,8 @@ logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s:%(levelname)s:%(lineno)d:%(message)s',
     handlers=[
-        logging.FileHandler(config.LOG_FILE_PATH),
+        #delay=True: the timestamped log file is only created once something is actually logged
+        logging.FileHandler(config.LOG_FILE_PATH, delay=True),
         logging.StreamHandler()
     ]
 )
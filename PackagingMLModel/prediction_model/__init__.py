@@ -4,4 +4,24 @@ from prediction_model.config import config
 # Read the version from the VERSION file
 version_file_path = os.path.join(os.path.dirname(__file__), 'VERSION')
 with open(version_file_path) as version_file:
-    __version__ = version_file.read().strip()
\ No newline at end of file
+    __version__ = version_file.read().strip()
+
+#the scoring API is imported lazily, so importing prediction_model (or its config) does not pull in pandas/sklearn
+_LAZY_EXPORTS = {
+    'predict_batch': 'prediction_model.batch_prediction',
+    'CompiledScorer': 'prediction_model.scoring_engine',
+    'AsyncPredictor': 'prediction_model.async_predictor',
+    'validate_batch': 'prediction_model.validation',
+    'predict_with_reasons': 'prediction_model.reason_codes',
+    'max_approvable': 'prediction_model.what_if',
+    'score_grid': 'prediction_model.what_if',
+    'DriftMonitor': 'prediction_model.drift_monitor',
+}
+
+def __getattr__(name):
+    if name in _LAZY_EXPORTS:
+        import importlib
+        value = getattr(importlib.import_module(_LAZY_EXPORTS[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,183 @@
+import os
+import sys
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+
+PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
+sys.path.append(str(PACKAGE_ROOT))
+
+from prediction_model.config import config
+from logger import logging
+from exception import CustomException
+from prediction_model.batch_prediction import predict_batch
+
+#asyncio interface to the batch scorer, for services running on an event loop
+#concurrent `await predict(record)` calls are queued and gathered into batches scored with one vectorized call, the
+#scoring runs on a small thread pool so the event loop is never blocked. At most executor_workers batches are scored
+#at a time; while they run the queue fills up, and once max_queue_depth applications are waiting a new predict()
+#waits for room (or fails with asyncio.QueueFull when reject_when_full is set), which pushes back on the callers
+
+_STOP = object() #queued by aclose(), the batcher scores what it collected before it and returns
+
+def _predict_proba(records: list) -> tuple:
+    return predict_batch(records, return_proba=True)
+
+class AsyncPredictor:
+    """
+    Awaitable, batching scorer of raw loan applications. Use it from one event loop, as
+    `async with AsyncPredictor() as predictor: prediction, probability = await predictor.predict(record)`.
+    score takes a list of application dicts and returns (predictions, probabilities), e.g. ModelRegistry.predict.
+    """
+    def __init__(self, max_batch_size: int = config.ASYNC_MAX_BATCH_SIZE, max_wait_ms: float = config.MAX_WAIT_MS,
+                 max_queue_depth: int = config.ASYNC_MAX_QUEUE_DEPTH, executor_workers: int = config.ASYNC_EXECUTOR_WORKERS,
+                 reject_when_full: bool = False, score=_predict_proba):
+        self.score = score
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue_depth = max_queue_depth
+        self.executor_workers = max(1, executor_workers)
+        self.reject_when_full = reject_when_full
+        self._executor = ThreadPoolExecutor(max_workers=self.executor_workers, thread_name_prefix="async-scorer")
+        #created on first use, they belong to the event loop that is running then
+        self._loop = None
+        self._queue = None
+        self._slots = None
+        self._batcher = None
+        self._batches = set()
+        self.batches = self.rows = self.rejected = 0
+
+    def _start(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is None:
+            self._loop = loop
+            self._queue = asyncio.Queue(maxsize=self.max_queue_depth)
+            self._slots = asyncio.Semaphore(self.executor_workers)
+            self._batcher = loop.create_task(self._run(), name="async-predictor-batcher")
+        elif self._loop is not loop:
+            raise RuntimeError("AsyncPredictor is bound to another event loop")
+
+    async def predict(self, record: dict) -> tuple:
+        #returns (prediction, probability) of one application
+        self._start()
+        future = self._loop.create_future()
+        if self.reject_when_full:
+            try:
+                self._queue.put_nowait((record, future))
+            except asyncio.QueueFull:
+                self.rejected += 1
+                raise
+        else:
+            await self._queue.put((record, future))
+        return await future
+
+    async def predict_many(self, records) -> tuple:
+        #a list the caller already has is scored as one batch, without going through the queue
+        self._start()
+        async with self._slots:
+            return await self._loop.run_in_executor(self._executor, self._score_batch, records)
+
+    def _score_batch(self, records) -> tuple:
+        try:
+            return self.score(records)
+        except Exception as e:
+            raise CustomException(e,sys)
+
+    async def _collect(self) -> tuple:
+        #waits for the first application, then at most max_wait for the batch to fill up
+        #returns (batch, stop), stop is set once the aclose() sentinel was taken from the queue
+        batch = []
+        deadline = None
+        while len(batch) < self.max_batch_size:
+            if deadline is None:
+                item = await self._queue.get()
+                deadline = time.perf_counter() + self.max_wait
+            else:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), remaining)
+                    except TimeoutError:
+                        break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _run(self):
+        while True:
+            batch, stop = await self._collect()
+            if batch:
+                #no more batches than executor threads are in flight, so the queue (and its bound) absorbs the backlog
+                await self._slots.acquire()
+                task = self._loop.create_task(self._run_batch(batch))
+                self._batches.add(task)
+                task.add_done_callback(self._batches.discard)
+            if stop:
+                await asyncio.gather(*self._batches, return_exceptions=True)
+                return
+
+    async def _run_batch(self, batch: list):
+        try:
+            records = [record for record, _ in batch]
+            try:
+                y_pred, y_proba = await self._loop.run_in_executor(self._executor, self.score, records)
+                results = [(pred, proba, None) for pred, proba in zip(y_pred.tolist(), y_proba.tolist())]
+            except Exception:
+                #one malformed record must not fail the applications it was batched with
+                results = await self._loop.run_in_executor(self._executor, self._score_one_by_one, records)
+            for (_, future), (pred, proba, error) in zip(batch, results):
+                if future.done():
+                    continue #the caller was cancelled
+                if error is None:
+                    future.set_result((pred, proba))
+                else:
+                    future.set_exception(error)
+            self.batches += 1
+            self.rows += len(batch)
+        finally:
+            self._slots.release()
+
+    def _score_one_by_one(self, records: list) -> list:
+        results = []
+        for record in records:
+            try:
+                y_pred, y_proba = self.score([record])
+                results.append((y_pred.tolist()[0], y_proba.tolist()[0], None))
+            except Exception as e:
+                results.append((None, None, CustomException(e,sys)))
+        return results
+
+    def stats(self) -> dict:
+        return {'batches': self.batches, 'rows': self.rows, 'mean_batch_size': self.rows / self.batches if self.batches else None,
+                'queue_depth': self._queue.qsize() if self._queue is not None else 0, 'rejected': self.rejected}
+
+    async def aclose(self):
+        #scores what is already queued, then stops the batcher and the executor
+        if self._batcher is not None:
+            try:
+                if not self._batcher.done():
+                    await self._queue.put(_STOP)
+                    await self._batcher
+            finally:
+                #applications queued after the sentinel (or left by a failed batcher) are never scored
+                while not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if item is not _STOP and not item[1].done():
+                        item[1].set_exception(RuntimeError("AsyncPredictor was closed before the application was scored"))
+                self._loop = self._queue = self._slots = self._batcher = None
+        self._executor.shutdown(wait=True)
+        logging.info(f"AsyncPredictor closed after {self.rows} applications in {self.batches} batches")
+
+    async def __aenter__(self):
+        self._start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
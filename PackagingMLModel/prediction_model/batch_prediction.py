@@ -0,0 +1,161 @@
+import os
+import sys
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
+sys.path.append(str(PACKAGE_ROOT))
+
+from prediction_model.config import config
+from logger import logging
+from exception import CustomException
+from prediction_model.processing.data_handling import load_pipeline, load_model_artifact, strip_categorical_values
+
+#fused, vectorized scoring of raw loan applications
+#CreateCustomColumns -> ColumnsToDrop -> TransformingNumericFeatures -> classification_pipeline.predict is replaced
+#by a single NumPy pass that reads the fitted encoder categories and logistic regression weights out of the saved pipeline
+
+_model_parameters = None #(model version, model parameters)
+
+def extract_model_parameters(pipeline) -> dict:
+    """
+    Reads the fitted ColumnTransformer + LogisticRegression out of the classification pipeline and returns
+    a plain description of the model input: one entry per output column, in the order the model sees them.
+    """
+    try:
+        preprocessor = pipeline.named_steps['preprocessor']
+        model = pipeline.named_steps['model']
+        feature_names_in = list(preprocessor.feature_names_in_)
+        columns = [] #list of (feature, category) for one-hot columns and (feature, None) for passthrough columns
+        for name, transformer, transformer_columns in preprocessor.transformers_:
+            if isinstance(transformer, str) and transformer == 'drop':
+                continue
+            transformer_columns = [feature_names_in[col] if isinstance(col, (int, np.integer)) else col for col in transformer_columns]
+            if hasattr(transformer, 'steps'):
+                transformer = transformer.steps[-1][1]
+            if hasattr(transformer, 'categories_'):
+                #OneHotEncoder: keep every category except the dropped one, unknown values encode to all zeros
+                for i, feature in enumerate(transformer_columns):
+                    drop_idx = None if transformer.drop_idx_ is None else transformer.drop_idx_[i]
+                    for j, category in enumerate(transformer.categories_[i]):
+                        if drop_idx is not None and j == drop_idx:
+                            continue
+                        columns.append((feature, category))
+            elif transformer == 'passthrough' or getattr(transformer, 'func', 'unsupported') is None:
+                #'passthrough' is stored as an identity FunctionTransformer once the ColumnTransformer is fitted
+                columns.extend((feature, None) for feature in transformer_columns)
+            else:
+                raise ValueError(f"Unsupported transformer '{name}' in preprocessor: {transformer}")
+        return {
+            'columns': columns,
+            'coef': np.asarray(model.coef_, dtype=np.float64).ravel(),
+            'intercept': float(model.intercept_[0]),
+            'classes': np.asarray(model.classes_),
+        }
+    except Exception as e:
+        raise CustomException(e,sys)
+
+def load_model_parameters(model_name: str = config.MODEL_NAME) -> dict:
+    #the compact artifact is preferred, the pickle (and sklearn) is only loaded when the artifact is missing or stale
+    try:
+        model_parameters = load_model_artifact(model_name)
+        if model_parameters is not None:
+            logging.info(f"Model parameters loaded from the compact artifact of {model_name}")
+            return model_parameters
+        model_parameters = extract_model_parameters(load_pipeline(model_name))
+        logging.info(f"Model parameters extracted from {model_name}")
+        return model_parameters
+    except Exception as e:
+        raise CustomException(e,sys)
+
+def get_model_parameters() -> dict:
+    #the saved model is loaded again when a new one was saved or promoted (checking costs one os.stat), so long running
+    #processes do not keep scoring the model they started with
+    global _model_parameters
+    #imported here to avoid a circular import, prediction_cache imports this module
+    from prediction_model.prediction_cache import model_version
+    version = model_version(config.MODEL_NAME)
+    if _model_parameters is None or _model_parameters[0] != version:
+        _model_parameters = (version, load_model_parameters(config.MODEL_NAME))
+    return _model_parameters[1]
+
+def raw_features_needed(model_parameters: dict) -> list:
+    #raw columns needed to build the model input, total_assets_value is built from the asset columns
+    needed = []
+    for feature, _ in model_parameters['columns']:
+        raw = config.COLUMNS_TO_MERGE if feature == config.CUSTOM_COLUMN_NAME else [feature]
+        needed.extend(col for col in raw if col not in needed)
+    return needed
+
+def records_to_columns(records, needed: list) -> dict:
+    #list of dicts, DataFrame or NumPy structured array -> {raw column name: 1-d array or Series}
+    if isinstance(records, pd.DataFrame):
+        #columns are kept as Series, converting string columns to object arrays costs more than the scoring itself
+        names = {str(col).strip(): col for col in records.columns}
+        return {col: records[names[col]] for col in needed}
+    if isinstance(records, np.ndarray) and records.dtype.names is not None:
+        names = {name.strip(): name for name in records.dtype.names}
+        return {col: records[names[col]] for col in needed}
+    if isinstance(records, dict):
+        records = [records]
+    records = list(records)
+    if not records:
+        return {col: np.empty(0, dtype=object) for col in needed}
+    #records are expected to share the same keys, raw csv headers carry a leading space
+    names = {str(key).strip(): key for key in records[0]}
+    return {col: np.array([record[names[col]] for record in records], dtype=object) for col in needed}
+
+def build_feature_matrix(raw_columns: dict, model_parameters: dict, out: np.ndarray = None) -> np.ndarray:
+    """
+    Builds the model input matrix straight from raw columns: asset summing, log1p and one-hot encoding
+    are applied only to the columns the fitted model actually uses. The matrix is written into out when given.
+    """
+    n_rows = len(next(iter(raw_columns.values()))) if raw_columns else 0
+    X = np.empty((n_rows, len(model_parameters['columns'])), dtype=np.float64) if out is None else out
+    stripped = {}
+    for i, (feature, category) in enumerate(model_parameters['columns']):
+        if category is not None:
+            if feature not in stripped:
+                stripped[feature] = strip_categorical_values(raw_columns[feature])
+            X[:, i] = np.asarray(stripped[feature] == category)
+            continue
+        if feature == config.CUSTOM_COLUMN_NAME:
+            values = np.asarray(raw_columns[config.COLUMNS_TO_MERGE[0]], dtype=np.float64)
+            for col in config.COLUMNS_TO_MERGE[1:]:
+                values = values + np.asarray(raw_columns[col], dtype=np.float64)
+        else:
+            values = np.asarray(raw_columns[feature], dtype=np.float64)
+        X[:, i] = np.log1p(values) if feature in config.LOG_TRANSFORMATION else values
+    return X
+
+def check_feature_matrix(X: np.ndarray):
+    #missing or invalid numbers (None, NaN, inf, log1p of values below -1) would score as NaN and fall on the rejected
+    #side of the threshold, the sklearn pipeline raises on them as well
+    if np.isfinite(X.sum()):
+        return
+    finite = np.isfinite(X).all(axis=1) #the sum also overflows on huge finite values
+    if not finite.all():
+        rows = np.flatnonzero(~finite)
+        raise ValueError(f"{len(rows)} applications have missing or invalid numeric values (rows {rows[:10].tolist()}), "
+                         f"they cannot be scored")
+
+def predict_batch(records, return_proba: bool = False, model_parameters: dict = None):
+    """
+    Scores raw loan applications (list of dicts, DataFrame or NumPy structured array) in one vectorized pass.
+    Returns the predicted classes, and the approval probabilities as well when return_proba is True.
+    Raises when a numeric value the model reads is missing or invalid, like the pipeline does.
+    """
+    try:
+        if model_parameters is None:
+            model_parameters = get_model_parameters()
+        raw_columns = records_to_columns(records, raw_features_needed(model_parameters))
+        X = build_feature_matrix(raw_columns, model_parameters)
+        check_feature_matrix(X)
+        scores = X @ model_parameters['coef'] + model_parameters['intercept']
+        y_pred = model_parameters['classes'][(scores > 0).astype(np.intp)]
+        if return_proba:
+            return y_pred, 1.0 / (1.0 + np.exp(-scores))
+        return y_pred
+    except Exception as e:
+        raise CustomException(e,sys)
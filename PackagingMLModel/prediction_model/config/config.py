@@ -7,6 +7,7 @@ DATASET_DIR = os.path.join(SUB_PACKAGE,"datasets")
 DATA_FILE_NAME = "loan_approval_dataset.csv"
 TRAIN_FILE_NAME = "train.csv"
 TEST_FILE_NAME = "test.csv"
+DATASET_CACHE_DIR = os.path.join(DATASET_DIR,"cache") #arrow copies of the raw data and of the train/test splits
 
 #dataset columns to be used for model training and prediction, the target column is 'loan_status'
 #dropping columns 'residential_assets_value', 'commercial_assets_value', 'luxury_assets_value', 'bank_asset_value' as they are already in 'total_assets_value'
@@ -14,8 +15,44 @@ TEST_FILE_NAME = "test.csv"
 FEATURES = ['no_of_dependents', 'education', 'self_employed','income_annum', 'loan_amount', 'loan_term', 'cibil_score',
             'total_assets_value', 'loan_status']
 TARGET = 'loan_status'
+TARGET_POSITIVE_CLASS = 'Approved' #label encoded as 1, compared after stripping whitespace
+
+#DATA SCHEMA
+#dtypes used by load_dataset, matched on the stripped column names. Categorical values are stripped of the
+#leading space the raw csv carries (' Graduate' -> 'Graduate'). The target is only read as a category when it
+#holds labels, train.csv/test.csv store it already encoded as 0/1
+DATA_DTYPES = {
+    'loan_id': 'int32',
+    'no_of_dependents': 'int32',
+    'education': 'category',
+    'self_employed': 'category',
+    'income_annum': 'int32',
+    'loan_amount': 'int32',
+    'loan_term': 'int32',
+    'cibil_score': 'int32',
+    'residential_assets_value': 'int32',
+    'commercial_assets_value': 'int32',
+    'luxury_assets_value': 'int32',
+    'bank_asset_value': 'int32',
+}
+#values accepted by the batch validator (validation.py), matched after stripping whitespace
+VALID_CATEGORIES = {
+    'education': ['Graduate', 'Not Graduate'],
+    'self_employed': ['No', 'Yes'],
+}
+#inclusive (min, max) of numeric columns, None leaves a side open. Log transformed features must not be negative,
+#single asset values may be (the dataset has negative residential assets) as long as their total is not
+VALID_RANGES = {
+    'no_of_dependents': (0, None),
+    'income_annum': (0, None),
+    'loan_amount': (0, None),
+    'loan_term': (1, None),
+    'cibil_score': (300, 900),
+    'total_assets_value': (0, None),
+}
 
 MODEL_NAME = 'loan_approval_model.pkl'
+MODEL_ARTIFACT_SUFFIX = '.bin' #compact, sklearn-free copy of the model saved next to the pickle
 SAVE_MODEL_PATH = os.path.join(SUB_PACKAGE, 'trained_models')
 
 ROOT_DIR = os.path.dirname(SUB_PACKAGE)
@@ -23,7 +60,17 @@ LOG_DIR = os.path.join(ROOT_DIR, 'Logs')
 LOG_FILE_NAME = f"{datetime.now().strftime("%Y_%m_%d_%H_%M_%S")}.log"
 LOG_FILE_PATH = os.path.join(LOG_DIR, LOG_FILE_NAME)
 
+#MLFLOW
+MLFLOW_TRACKING_URI = "http://localhost:5000" #default path to mlartifact
+MLFLOW_EXPERIMENT_NAME = "END-TO-END-LOAN-APPROVAL-PRediction" #experiment name
+MLFLOW_OFFLINE_DIR = os.path.join(SUB_PACKAGE.parent,"mlruns_offline") #local sqlite store used when the tracking server is unreachable
+TRACKING_FLUSH_INTERVAL_S = 2.0 #how often buffered params, metrics and tags are sent in bulk
+TRACKING_CONNECT_TIMEOUT_S = 1.0 #timeout of the tracking server health check
+TRACKING_CLOSE_TIMEOUT_S = 120.0 #how long ending a run waits for pending uploads
+
 TEST_SIZE = 0.2
+CHUNK_SIZE = 100_000 #rows per chunk when streaming large files
+SCORING_WORKERS = os.cpu_count() or 1 #worker processes for parallel batch scoring
     
 #CUSTOM COLUMN
 CUSTOM_COLUMN_NAME = 'total_assets_value'
@@ -34,5 +81,72 @@ LOG_TRANSFORMATION = ['income_annum', 'loan_amount', 'cibil_score', CUSTOM_COLUM
 
 COLUMNS_TO_DROP = ['loan_id','residential_assets_value', 'commercial_assets_value', 'luxury_assets_value', 'bank_asset_value']
 
+#REASON CODES
+REASON_CODES_TOP_K = 3 #fields reported per prediction by predict_with_reasons
+
+#EVALUATION
+DECISION_THRESHOLD = 0.5 #probability above which an application is predicted as approved
+BOOTSTRAP_SAMPLES = 1000 #resamples used for the metric confidence intervals
+CONFIDENCE_LEVEL = 0.95
+
+#INCREMENTAL TRAINING
+INCREMENTAL_EPOCHS = 10 #passes over the data when training from scratch, a warm start makes one pass over the new data
+INCREMENTAL_ALPHA = 1e-4 #L2 regularization of the SGDClassifier
+INCREMENTAL_LEARNING_RATE = 1e-3 #constant SGD step size, the features are not scaled so larger steps diverge
+WARM_START_LEARNING_RATE = 2e-4 #smaller steps when updating the saved model, so new data adjusts rather than replaces it
+
+#PORTFOLIO RESCORING
+PORTFOLIO_INDEX_DIR = os.path.join(SUB_PACKAGE.parent,"portfolio_index") #loan_id -> content hash and last score of the last rescoring run
+
+#SYNTHETIC DATA
+SYNTHETIC_QUANTILES = 201 #points of the quantile table fitted for every numeric column
+SYNTHETIC_CHUNK_SIZE = 1_000_000 #rows generated and written at a time
+
+#TUNING
+TUNING_WORKERS = os.cpu_count() or 1 #worker processes for the hyperparameter search
+TUNING_VALIDATION_SIZE = 0.25 #share of the training split held out to rank the candidates
+TUNING_MIN_ROWS = 200 #training rows given to every candidate in the first successive halving round
+TUNING_HALVING_FACTOR = 3 #each round keeps 1/factor of the candidates and gives them factor times more rows
+
 TRAIN_CONFUSION_MATRIX_PATH = os.path.join("PackagingMLModel",SUB_PACKAGE, 'trained_models', 'confusion_matrix_Train.png')
-TEST_CONFUSION_MATRIX_PATH = os.path.join("PackagingMLModel",SUB_PACKAGE, 'trained_models', 'confusion_matrix_Test.png')
\ No newline at end of file
+TEST_CONFUSION_MATRIX_PATH = os.path.join("PackagingMLModel",SUB_PACKAGE, 'trained_models', 'confusion_matrix_Test.png')
+
+#SERVING
+SERVE_HOST = '127.0.0.1'
+SERVE_PORT = 8000
+SERVE_WORKERS = 2 #number of worker processes, each one loads the model once
+MAX_BATCH_SIZE = 64 #maximum number of single /predict requests scored together
+MAX_WAIT_MS = 2 #how long the first request of a micro-batch waits for others to join
+
+#ASYNC SCORING
+ASYNC_MAX_BATCH_SIZE = 256 #maximum number of awaited predictions scored together, they wait at most MAX_WAIT_MS
+ASYNC_MAX_QUEUE_DEPTH = 10_000 #applications waiting to be scored, beyond it awaiting predict() waits for room
+ASYNC_EXECUTOR_WORKERS = 2 #threads scoring batches off the event loop, NumPy releases the GIL in the heavy steps
+
+#INSTRUMENTATION
+INSTRUMENTATION_ENABLED = os.environ.get('PREDICTION_MODEL_INSTRUMENTATION', '0') == '1' #per-stage timing, see instrumentation.py
+INSTRUMENTATION_DIR = os.path.join(SUB_PACKAGE.parent,"metrics") #JSON stage summaries of training and prediction runs
+INSTRUMENTATION_BUCKETS_S = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0) #duration histogram bounds
+INSTRUMENTATION_METRIC_PREFIX = 'loan_model' #prefix of the exported Prometheus metric names
+
+#MODEL REGISTRY
+MODEL_REGISTRY_DIR = 'registry' #versioned copies of the saved model, under SAVE_MODEL_PATH
+MODEL_REGISTRY_KEEP = 5 #registered versions kept, the oldest ones that are not promoted are removed first
+MODEL_RELOAD_INTERVAL_S = 5.0 #how often a running server checks whether a new model was saved, 0 disables hot reload
+SHADOW_SAMPLE_RATE = 1.0 #share of the live batches also scored by a shadow model
+SHADOW_MAX_PENDING = 100 #shadow batches waiting at most, more are dropped so shadowing never slows down requests
+
+#DRIFT MONITORING
+DRIFT_MONITOR_ENABLED = True #the server compares the scored applications with the training data, see drift_monitor.py
+DRIFT_PROFILE_SUFFIX = '.profile.json' #reference profile of the training data saved next to the pickle
+DRIFT_HISTOGRAM_BINS = 20 #quantile bins of the training values, live values are counted in the same bins
+DRIFT_MAX_CATEGORIES = 50 #distinct live categories counted per feature, further ones are counted together
+DRIFT_PSI_EPSILON = 1e-4 #floor of the bin shares in the PSI, so empty bins stay finite
+DRIFT_PSI_ALERT = 0.2 #PSI above which a feature is reported as drifted
+DRIFT_MAX_PENDING = 100 #batches waiting to be counted at most, more are dropped so monitoring never slows down requests
+
+#PREDICTION CACHE
+PREDICTION_CACHE_ENABLED = True #cache predictions of repeated applications in the server
+PREDICTION_CACHE_SIZE = 100_000 #entries kept per process, the least recently used ones are evicted first
+PREDICTION_CACHE_TTL_S = 3600.0 #seconds a cached prediction stays valid
+PREDICTION_CACHE_PATH = None #sqlite file shared by the server worker processes, e.g. os.path.join(SUB_PACKAGE.parent,"prediction_cache.db")
@@ -0,0 +1,304 @@
+import os
+import sys
+import json
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
+sys.path.append(str(PACKAGE_ROOT))
+
+from prediction_model.config import config
+from logger import logging
+from exception import CustomException
+from prediction_model.processing.data_handling import _file_sha256
+from prediction_model.batch_prediction import records_to_columns
+
+#feature and score drift of live traffic against the training data
+#training saves a reference profile next to the model: for every feature of config.FEATURES (total_assets_value summed
+#from the asset columns) and for the predicted probability, the inner edges of config.DRIFT_HISTOGRAM_BINS quantile bins
+#of the training values with the share of the training rows in each bin, and for categorical features the category
+#shares. A DriftMonitor counts live values in the same bins (plus min/max, missing values and a capped category count),
+#so its memory does not grow with the traffic. PSI and KS (the largest CDF difference at the bin edges) are computed from
+#the counts when a report is asked for; the counts are copied under a lock held only for that copy
+
+PROBABILITY = 'probability' #name of the predicted probability in profiles and reports
+OTHER_CATEGORY = '__other__' #live categories beyond config.DRIFT_MAX_CATEGORIES
+
+def monitored_features() -> tuple:
+    #(numeric features, categorical features) of config.FEATURES, the target is not known at prediction time
+    features = [feature for feature in config.FEATURES if feature != config.TARGET]
+    categorical = [feature for feature in features if feature in config.CATEGORICAL_FEATURES_TO_ENCODE]
+    return [feature for feature in features if feature not in categorical], categorical
+
+def _raw_columns_needed() -> list:
+    numeric, categorical = monitored_features()
+    needed = []
+    for feature in numeric + categorical:
+        needed.extend(config.COLUMNS_TO_MERGE if feature == config.CUSTOM_COLUMN_NAME else [feature])
+    return needed
+
+def _as_numbers(values) -> np.ndarray:
+    #object arrays of numbers (and None) convert directly, pandas is only needed for strings and other values
+    if isinstance(values, np.ndarray):
+        try:
+            return values.astype(np.float64, copy=False)
+        except (TypeError, ValueError):
+            pass
+    return pd.to_numeric(pd.Series(values, copy=False), errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+
+def feature_values(records) -> dict:
+    #{feature: float64 array} for the numeric features, {feature: values} for the categorical ones
+    numeric, categorical = monitored_features()
+    raw_columns = records_to_columns(records, _raw_columns_needed())
+    values = {}
+    for feature in numeric:
+        if feature == config.CUSTOM_COLUMN_NAME:
+            values[feature] = sum(_as_numbers(raw_columns[col]) for col in config.COLUMNS_TO_MERGE)
+        else:
+            values[feature] = _as_numbers(raw_columns[feature])
+    for feature in categorical:
+        values[feature] = raw_columns[feature]
+    return values
+
+def _category_counts(values) -> dict:
+    #stripped category -> count, missing values are left out. Only the distinct values are stripped: columns are
+    #factorized, the object arrays built from lists of dicts (small live batches) are counted directly
+    if isinstance(values, pd.Series):
+        codes, uniques = pd.factorize(values)
+        distinct = zip(uniques, np.bincount(codes[codes >= 0], minlength=len(uniques)).tolist())
+    else:
+        distinct = Counter(value for value in values.tolist() if value is not None and value == value).items()
+    merged = {}
+    for value, count in distinct:
+        key = str(value).strip()
+        merged[key] = merged.get(key, 0) + count
+    return merged
+
+def _numeric_reference(values: np.ndarray, bins: int) -> dict:
+    values = values[~np.isnan(values)]
+    edges = np.unique(np.quantile(values, np.linspace(0.0, 1.0, bins + 1)[1:-1]))
+    counts = np.bincount(np.searchsorted(edges, values, side='right'), minlength=len(edges) + 1)
+    return {'edges': edges.tolist(), 'shares': (counts / len(values)).tolist()}
+
+#REFERENCE PROFILE
+def reference_profile_name(model_name: str = config.MODEL_NAME) -> str:
+    return os.path.splitext(model_name)[0] + config.DRIFT_PROFILE_SUFFIX
+
+def build_reference_profile(X, probabilities, bins: int = config.DRIFT_HISTOGRAM_BINS) -> dict:
+    """
+    Reference profile of the raw training applications X (DataFrame or list of dicts) and of the probabilities the
+    model predicts for them.
+    """
+    try:
+        numeric, categorical = monitored_features()
+        values = feature_values(X)
+        profile = {'rows': len(values[numeric[0]]) if numeric else len(X), 'numeric': {}, 'categorical': {}}
+        for feature in numeric:
+            profile['numeric'][feature] = _numeric_reference(values[feature], bins)
+        profile['numeric'][PROBABILITY] = _numeric_reference(np.asarray(probabilities, dtype=np.float64), bins)
+        for feature in categorical:
+            counts = _category_counts(values[feature])
+            total = sum(counts.values())
+            profile['categorical'][feature] = {category: count / total for category, count in sorted(counts.items())}
+        return profile
+    except Exception as e:
+        raise CustomException(e,sys)
+
+def save_reference_profile(profile: dict, model_name: str = config.MODEL_NAME) -> str:
+    #saved after the pickle, the pickle's hash marks which model the profile belongs to
+    try:
+        model_path = os.path.join(PACKAGE_ROOT,config.SAVE_MODEL_PATH,model_name)
+        profile_path = os.path.join(PACKAGE_ROOT,config.SAVE_MODEL_PATH,reference_profile_name(model_name))
+        profile = {**profile, 'source_sha256': _file_sha256(model_path) if os.path.exists(model_path) else None}
+        #written to a temporary file first, so a server reloading the model never reads a half written profile
+        tmp_path = f"{profile_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(profile, f)
+        os.replace(tmp_path, profile_path)
+        logging.info(f"Reference profile of {model_name} saved to {profile_path}")
+        return profile_path
+    except Exception as e:
+        raise CustomException(e,sys)
+
+def load_reference_profile(model_name: str = config.MODEL_NAME) -> dict:
+    #None when the model has no profile or the profile was saved for another pickle
+    profile_path = os.path.join(PACKAGE_ROOT,config.SAVE_MODEL_PATH,reference_profile_name(model_name))
+    model_path = os.path.join(PACKAGE_ROOT,config.SAVE_MODEL_PATH,model_name)
+    try:
+        with open(profile_path) as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if profile.get('source_sha256') != _file_sha256(model_path):
+        logging.warning(f"Reference profile {profile_path} belongs to another model, drift is not monitored against it")
+        return None
+    return profile
+
+#DRIFT STATISTICS
+def psi(reference_shares, live_counts, epsilon: float = config.DRIFT_PSI_EPSILON) -> float:
+    #population stability index, shares are floored at epsilon so empty bins stay finite
+    live_counts = np.asarray(live_counts, dtype=np.float64)
+    if live_counts.sum() == 0:
+        return None
+    expected = np.maximum(np.asarray(reference_shares, dtype=np.float64), epsilon)
+    actual = np.maximum(live_counts / live_counts.sum(), epsilon)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+def ks_statistic(reference_shares, live_counts) -> float:
+    #largest difference of the two CDFs at the bin edges, a lower bound of the exact KS statistic
+    live_counts = np.asarray(live_counts, dtype=np.float64)
+    if live_counts.sum() == 0:
+        return None
+    return float(np.max(np.abs(np.cumsum(live_counts / live_counts.sum()) - np.cumsum(reference_shares)), initial=0.0))
+
+def _histogram_quantiles(edges: np.ndarray, counts: np.ndarray, low: float, high: float, probabilities) -> dict:
+    #quantiles interpolated linearly inside the bins, the outer bins end at the live min and max
+    total = counts.sum()
+    if total == 0:
+        return None
+    bounds = np.concatenate([[min(low, edges[0]) if len(edges) else low], edges, [max(high, edges[-1]) if len(edges) else high]])
+    cumulative = np.concatenate([[0.0], np.cumsum(counts) / total])
+    return {f"p{round(p * 100):02d}": float(np.interp(p, cumulative, bounds)) for p in probabilities}
+
+class DriftMonitor:
+    """
+    Fixed-memory sketches of live applications and predicted probabilities, compared with a reference profile.
+    observe() counts a batch in the calling thread, submit() hands it to a background thread and drops it when
+    config.DRIFT_MAX_PENDING batches are already waiting, so scoring never waits for the monitor.
+    """
+    def __init__(self, profile: dict, version: str = None):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = threading.Semaphore(config.DRIFT_MAX_PENDING)
+        self.set_reference(profile, version)
+
+    def set_reference(self, profile: dict, version: str = None):
+        #starts counting from zero against another profile, e.g. after a new model was loaded
+        numeric = {feature: np.asarray(reference['edges'], dtype=np.float64) for feature, reference in (profile or {}).get('numeric', {}).items()}
+        with self._lock:
+            self.profile = profile
+            self.version = version
+            self._edges = numeric
+            self._counts = {feature: np.zeros(len(edges) + 1, dtype=np.int64) for feature, edges in numeric.items()}
+            self._range = {feature: [np.inf, -np.inf] for feature in numeric}
+            self._categories = {feature: {} for feature in (profile or {}).get('categorical', {})}
+            self._missing = dict.fromkeys(list(numeric) + list(self._categories), 0)
+            self.batches = self.rows = self.dropped = self.errors = 0
+
+    def observe(self, records, probabilities):
+        """
+        Counts one scored batch: the raw applications (list of dicts, DataFrame or structured array) and the
+        probabilities predicted for them. Counting is done outside the lock, only adding the counts holds it.
+        """
+        reference_edges = self._edges
+        if self.profile is None:
+            return
+        try:
+            values = feature_values(records)
+            values[PROBABILITY] = np.asarray(probabilities, dtype=np.float64)
+            updates = {}
+            for feature, edges in reference_edges.items():
+                numbers = values[feature]
+                present = numbers[~np.isnan(numbers)]
+                counts = np.bincount(np.searchsorted(edges, present, side='right'), minlength=len(edges) + 1)
+                bounds = (present.min(), present.max()) if len(present) else (np.inf, -np.inf)
+                updates[feature] = (counts, bounds, len(numbers) - len(present))
+            categories = {}
+            for feature in self._categories:
+                counts = _category_counts(values[feature])
+                categories[feature] = (counts, len(values[feature]) - sum(counts.values()))
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            logging.warning(f"Drift monitor failed to count a batch: {e}")
+            return
+        with self._lock:
+            if self._edges is not reference_edges:
+                return #the reference changed while the batch was counted
+            for feature, (counts, (low, high), missing) in updates.items():
+                self._counts[feature] += counts
+                self._range[feature] = [min(self._range[feature][0], low), max(self._range[feature][1], high)]
+                self._missing[feature] += missing
+            for feature, (counts, missing) in categories.items():
+                seen = self._categories[feature]
+                for category, count in counts.items():
+                    if category not in seen and len(seen) >= config.DRIFT_MAX_CATEGORIES:
+                        category = OTHER_CATEGORY
+                    seen[category] = seen.get(category, 0) + count
+                self._missing[feature] += missing
+            self.batches += 1
+            self.rows += len(values[PROBABILITY])
+
+    def submit(self, records, probabilities):
+        if self.profile is None:
+            return
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.dropped += 1
+            return
+        try:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="drift-monitor")
+            self._executor.submit(self._observe_and_release, records, probabilities)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _observe_and_release(self, records, probabilities):
+        try:
+            self.observe(records, probabilities)
+        finally:
+            self._slots.release()
+
+    def snapshot(self) -> dict:
+        #copies of the counts, the lock is held only while copying. The profile and the bin edges are replaced as a
+        #whole by set_reference, so the references taken under the lock always match the counts
+        with self._lock:
+            return {'profile': self.profile, 'version': self.version, 'edges': self._edges, 'batches': self.batches, 'rows': self.rows,
+                    'dropped_batches': self.dropped, 'errors': self.errors,
+                    'counts': {feature: counts.copy() for feature, counts in self._counts.items()},
+                    'range': {feature: tuple(bounds) for feature, bounds in self._range.items()},
+                    'categories': {feature: dict(counts) for feature, counts in self._categories.items()},
+                    'missing': dict(self._missing)}
+
+    def report(self, quantiles: tuple = (0.05, 0.5, 0.95)) -> dict:
+        """
+        PSI and KS of every monitored feature and of the predicted probability against the reference profile,
+        computed from a snapshot. A feature is flagged as drifted when its PSI exceeds config.DRIFT_PSI_ALERT.
+        """
+        snapshot = self.snapshot()
+        profile = snapshot.pop('profile')
+        edges = snapshot.pop('edges')
+        if profile is None:
+            return {'monitoring': False, 'reason': "No reference profile saved with the model"}
+        features = {}
+        for feature, counts in snapshot['counts'].items():
+            reference = profile['numeric'][feature]
+            value = psi(reference['shares'], counts)
+            low, high = snapshot['range'][feature]
+            features[feature] = {'count': int(counts.sum()), 'missing': snapshot['missing'][feature], 'psi': value,
+                                 'ks': ks_statistic(reference['shares'], counts),
+                                 'drifted': value is not None and value > config.DRIFT_PSI_ALERT,
+                                 'quantiles': _histogram_quantiles(edges[feature], counts, low, high, quantiles)}
+        for feature, counts in snapshot['categories'].items():
+            reference = profile['categorical'][feature]
+            #categories the training data did not have are compared as one bin
+            live = [counts.get(category, 0) for category in reference] + [sum(count for category, count in counts.items() if category not in reference)]
+            value = psi(list(reference.values()) + [0.0], live)
+            total = sum(live)
+            features[feature] = {'count': total, 'missing': snapshot['missing'][feature], 'psi': value,
+                                 'drifted': value is not None and value > config.DRIFT_PSI_ALERT,
+                                 'shares': {category: count / total for category, count in counts.items()} if total else {}}
+        drifted = sorted(feature for feature, stats in features.items() if stats['drifted'])
+        prediction = features.pop(PROBABILITY, None)
+        return {'monitoring': True, 'version': snapshot['version'], 'batches': snapshot['batches'], 'rows': snapshot['rows'],
+                'dropped_batches': snapshot['dropped_batches'], 'errors': snapshot['errors'],
+                'features': features, 'prediction': prediction, 'drifted': drifted}
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
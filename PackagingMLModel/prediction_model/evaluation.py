@@ -0,0 +1,216 @@
+import os
+import sys
+import argparse
+from pathlib import Path
+import numpy as np
+
+PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
+sys.path.append(str(PACKAGE_ROOT))
+
+from prediction_model.config import config
+from logger import logging
+from exception import CustomException
+
+#single-pass evaluation of the binary loan approval model
+#the confusion matrix is built with one np.bincount over 2*y_true + y_pred and every threshold metric is derived from it.
+#ROC-AUC, the threshold sweep and the bootstrap confidence intervals work on the predict_proba output, the bootstrap
+#draws a whole batch of resamples as a multinomial weight matrix, so every statistic is a matrix operation
+
+METRIC_NAMES = ('accuracy', 'precision', 'recall', 'specificity', 'f1')
+
+def _labels(y) -> np.ndarray:
+    y = np.asarray(y, dtype=np.int64).ravel()
+    if y.size and (y.min() < 0 or y.max() > 1):
+        raise ValueError("Labels must be encoded as 0 (rejected) and 1 (approved)")
+    return y
+
+#2x2 confusion matrix [[tn, fp], [fn, tp]], laid out like sklearn.metrics.confusion_matrix
+def confusion_counts(y_true, y_pred) -> np.ndarray:
+    try:
+        y_true, y_pred = _labels(y_true), _labels(y_pred)
+        if len(y_true) != len(y_pred):
+            raise ValueError(f"y_true has {len(y_true)} rows, y_pred has {len(y_pred)}")
+        return np.bincount(2 * y_true + y_pred, minlength=4).reshape(2, 2)
+    except Exception as e:
+        raise CustomException(e,sys)
+
+def _divide(numerator, denominator):
+    #0 where the denominator is 0, like sklearn's zero_division default (without the warning)
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    return np.divide(numerator, denominator, out=np.zeros(np.broadcast(numerator, denominator).shape), where=denominator != 0)
+
+def _metrics_from_counts(tn, fp, fn, tp) -> dict:
+    #works on scalars and on arrays of counts (bootstrap resamples, thresholds)
+    precision = _divide(tp, tp + fp)
+    recall = _divide(tp, tp + fn)
+    return {
+        'accuracy': _divide(tp + tn, tn + fp + fn + tp),
+        'precision': precision,
+        'recall': recall,
+        'specificity': _divide(tn, tn + fp),
+        'f1': _divide(2 * tp, 2 * tp + fp + fn),
+    }
+
+def metrics_from_confusion(cm: np.ndarray) -> dict:
+    (tn, fp), (fn, tp) = np.asarray(cm)
+    return {name: float(value) for name, value in _metrics_from_counts(tn, fp, fn, tp).items()}
+
+def _weighted_auc(weights: np.ndarray, y_true: np.ndarray, y_score: np.ndarray) -> np.ndarray:
+    #ROC-AUC of each row of sample weights (the bootstrap multiplicities), ties between scores count one half:
+    #samples are grouped by distinct score, and each positive group beats the negatives of all lower groups
+    order = np.argsort(y_score, kind='stable')
+    sorted_scores = y_score[order]
+    starts = np.flatnonzero(np.r_[True, sorted_scores[1:] != sorted_scores[:-1]])
+    sorted_weights = weights[:, order]
+    positive = y_true[order].astype(bool)
+    positive_weights = np.add.reduceat(np.where(positive, sorted_weights, 0), starts, axis=1)
+    negative_weights = np.add.reduceat(np.where(positive, 0, sorted_weights), starts, axis=1)
+    negatives_below = np.cumsum(negative_weights, axis=1) - negative_weights
+    wins = (positive_weights * (negatives_below + 0.5 * negative_weights)).sum(axis=1)
+    pairs = positive_weights.sum(axis=1) * negative_weights.sum(axis=1)
+    return np.divide(wins, pairs, out=np.full(len(wins), np.nan), where=pairs != 0)
+
+def roc_auc(y_true, y_score) -> float:
+    try:
+        y_true = _labels(y_true)
+        y_score = np.asarray(y_score, dtype=np.float64).ravel()
+        return float(_weighted_auc(np.ones((1, len(y_true))), y_true, y_score)[0])
+    except Exception as e:
+        raise CustomException(e,sys)
+
+#metrics at every threshold at once, an application is predicted approved when its probability is >= the threshold.
+#The counts come from np.searchsorted on the sorted scores of each class, so the cost is O(n log n + t log n)
+def threshold_sweep(y_true, y_score, thresholds=None) -> dict:
+    try:
+        y_true = _labels(y_true)
+        y_score = np.asarray(y_score, dtype=np.float64).ravel()
+        thresholds = np.linspace(0.0, 1.0, 101) if thresholds is None else np.asarray(thresholds, dtype=np.float64)
+        positive_scores = np.sort(y_score[y_true == 1])
+        negative_scores = np.sort(y_score[y_true == 0])
+        tp = len(positive_scores) - np.searchsorted(positive_scores, thresholds, side='left')
+        fp = len(negative_scores) - np.searchsorted(negative_scores, thresholds, side='left')
+        fn = len(positive_scores) - tp
+        tn = len(negative_scores) - fp
+        sweep = {'threshold': thresholds, 'tn': tn, 'fp': fp, 'fn': fn, 'tp': tp}
+        sweep.update(_metrics_from_counts(tn, fp, fn, tp))
+        sweep['fpr'] = 1.0 - sweep['specificity']
+        return sweep
+    except Exception as e:
+        raise CustomException(e,sys)
+
+def bootstrap_confidence_intervals(y_true, y_score, threshold: float = config.DECISION_THRESHOLD,
+                                   n_bootstrap: int = config.BOOTSTRAP_SAMPLES, confidence: float = config.CONFIDENCE_LEVEL,
+                                   seed: int = 42, max_batch_cells: int = 4_000_000) -> dict:
+    """
+    Percentile bootstrap intervals of the threshold metrics and of ROC-AUC. Resamples are drawn in batches as
+    multinomial weight matrices (resamples x rows) of at most max_batch_cells entries, so memory stays bounded.
+    """
+    try:
+        y_true = _labels(y_true)
+        y_score = np.asarray(y_score, dtype=np.float64).ravel()
+        n = len(y_true)
+        rng = np.random.default_rng(seed)
+        #one-hot of the confusion cell of every row, weights @ cells gives the counts of each resample
+        cells = np.zeros((n, 4))
+        cells[np.arange(n), 2 * y_true + (y_score >= threshold)] = 1.0
+        batch_size = max(1, max_batch_cells // max(n, 1))
+        samples = {name: [] for name in METRIC_NAMES + ('roc_auc',)}
+        for start in range(0, n_bootstrap, batch_size):
+            weights = rng.multinomial(n, np.full(n, 1.0 / n), size=min(batch_size, n_bootstrap - start)).astype(np.float64)
+            tn, fp, fn, tp = (weights @ cells).T
+            for name, values in _metrics_from_counts(tn, fp, fn, tp).items():
+                samples[name].append(values)
+            samples['roc_auc'].append(_weighted_auc(weights, y_true, y_score))
+        tail = 100 * (1 - confidence) / 2
+        intervals = {}
+        for name, values in samples.items():
+            low, high = np.nanpercentile(np.concatenate(values), [tail, 100 - tail])
+            intervals[name] = (float(low), float(high))
+        return intervals
+    except Exception as e:
+        raise CustomException(e,sys)
+
+def evaluate(y_true, y_score, threshold: float = config.DECISION_THRESHOLD, n_bootstrap: int = config.BOOTSTRAP_SAMPLES,
+             thresholds=None) -> dict:
+    """
+    Evaluates approval probabilities against 0/1 labels: confusion matrix and metrics at threshold, ROC-AUC,
+    a threshold sweep and (with n_bootstrap > 0) bootstrap confidence intervals.
+    """
+    try:
+        y_true = _labels(y_true)
+        y_score = np.asarray(y_score, dtype=np.float64).ravel()
+        cm = confusion_counts(y_true, y_score >= threshold)
+        results = {
+            'confusion_matrix': cm,
+            'metrics': {**metrics_from_confusion(cm), 'roc_auc': roc_auc(y_true, y_score)},
+            'threshold_sweep': threshold_sweep(y_true, y_score, thresholds),
+        }
+        if n_bootstrap:
+            results['confidence_intervals'] = bootstrap_confidence_intervals(y_true, y_score, threshold, n_bootstrap)
+        return results
+    except Exception as e:
+        raise CustomException(e,sys)
+
+#rendering is kept out of evaluate(), it draws on its own figure instead of the shared pyplot one
+def plot_confusion_matrix(cm: np.ndarray, subset: str, output_path: str = None) -> str:
+    try:
+        import seaborn as sns
+        from matplotlib.figure import Figure
+        output_path = output_path or os.path.join(PACKAGE_ROOT, config.SAVE_MODEL_PATH, f"confusion_matrix_{subset}.png")
+        fig = Figure()
+        ax = fig.subplots()
+        sns.heatmap(cm, annot=True, fmt='d', ax=ax)
+        ax.set_xlabel('Predicted')
+        ax.set_ylabel('True')
+        ax.set_title(f'Confusion Matrix_{subset}')
+        fig.savefig(output_path)
+        return output_path
+    except Exception as e:
+        raise CustomException(e,sys)
+
+def evaluate_model(model_name: str = config.MODEL_NAME, n_bootstrap: int = config.BOOTSTRAP_SAMPLES, plot: bool = False,
+                   log: bool = True) -> dict:
+    """
+    Evaluates the saved pipeline on the train and test splits, loading the model and the splits once.
+    Returns the evaluate() results per subset, and logs metrics (and plots when plot=True) to one tracking run.
+    """
+    try:
+        from prediction_model.processing.data_handling import load_pipeline, load_cached_splits
+        classification_pipeline = load_pipeline(model_name)
+        X_train, X_test, y_train, y_test, _ = load_cached_splits(config.DATA_FILE_NAME)
+        results = {}
+        for subset, X, y in (('Train', X_train, y_train), ('Test', X_test, y_test)):
+            y_score = classification_pipeline.predict_proba(X)[:, 1]
+            results[subset] = evaluate(y, y_score, n_bootstrap=n_bootstrap)
+            logging.info(f"{subset} confusion matrix:{results[subset]['confusion_matrix'].tolist()}")
+            logging.info(f"{subset} metrics:{results[subset]['metrics']}")
+        if plot:
+            for subset, result in results.items():
+                result['confusion_matrix_path'] = plot_confusion_matrix(result['confusion_matrix'], subset)
+        if log:
+            from prediction_model.tracking import get_tracker
+            tracker = get_tracker()
+            with tracker.start_run(run_name='Evaluation-Loan_prediction'):
+                tracker.set_tag("model_name", model_name)
+                for subset, result in results.items():
+                    tracker.log_metrics({f"{subset}_{name}": value for name, value in result['metrics'].items()})
+                    for name, (low, high) in result.get('confidence_intervals', {}).items():
+                        tracker.log_metrics({f"{subset}_{name}_ci_low": low, f"{subset}_{name}_ci_high": high})
+                    if 'confusion_matrix_path' in result:
+                        tracker.log_artifact(result['confusion_matrix_path'])
+        return results
+    except Exception as e:
+        raise CustomException(e,sys)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Evaluate the saved model on the train and test splits")
+    parser.add_argument('--bootstrap', type=int, default=config.BOOTSTRAP_SAMPLES, help="bootstrap resamples, 0 to skip the intervals")
+    parser.add_argument('--plots', action='store_true', help="save the confusion matrix plots")
+    parser.add_argument('--no-log', action='store_true', help="do not log the results to mlflow")
+    args = parser.parse_args()
+    for subset, result in evaluate_model(n_bootstrap=args.bootstrap, plot=args.plots, log=not args.no_log).items():
+        print(subset)
+        for name, value in result['metrics'].items():
+            low, high = result.get('confidence_intervals', {}).get(name, (np.nan, np.nan))
+            print(f"  {name:<12}{value:.4f}  [{low:.4f}, {high:.4f}]")
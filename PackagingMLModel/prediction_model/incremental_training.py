@@ -0,0 +1,157 @@
+import os
+import sys
+import time
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
+sys.path.append(str(PACKAGE_ROOT))
+
+from prediction_model.config import config
+from logger import logging
+from exception import CustomException
+from prediction_model.processing.data_handling import load_dataset_in_chunks, separate_data, strip_categorical_values
+
+#out-of-core training of the classification pipeline
+#the raw file is streamed chunk by chunk (load_dataset_in_chunks), so memory use depends on the chunk size only:
+#1. a first pass reads just the categorical columns and collects the one-hot categories
+#2. the preprocessing stages are fitted on the first chunk with those categories fixed (they are otherwise stateless)
+#3. every chunk is transformed and fed to SGDClassifier(loss='log_loss').partial_fit, a logistic regression trained
+#   by stochastic gradient descent
+#With warm_start=True the saved pipeline is updated with the new data instead, keeping its fitted preprocessing
+
+ONE_HOT_STEP = 'preprocessor__categorical__Encoding_categorical_features'
+
+def collect_categories(file_name: str, chunk_size: int = config.CHUNK_SIZE) -> dict:
+    #first pass: only the categorical columns are parsed
+    try:
+        categories = {feature: set() for feature in config.CATEGORICAL_FEATURES_TO_ENCODE}
+        for chunk in load_dataset_in_chunks(file_name, chunk_size, usecols=config.CATEGORICAL_FEATURES_TO_ENCODE):
+            for feature in categories:
+                categories[feature].update(strip_categorical_values(chunk[feature]).dropna().unique())
+        return {feature: sorted(values) for feature, values in categories.items()}
+    except Exception as e:
+        raise CustomException(e,sys)
+
+def _shuffled_chunks(file_name: str, chunk_size: int, rng):
+    #rows are shuffled within each chunk, SGD converges poorly on files sorted by date or by outcome
+    from prediction_model.processing.data_preprocessing import EncodingTargetVariable
+    for chunk in load_dataset_in_chunks(file_name, chunk_size):
+        chunk = chunk.iloc[rng.permutation(len(chunk))].reset_index(drop=True)
+        X, y = separate_data(chunk)
+        #raw files carry ' Approved'/' Rejected', the exported train.csv and test.csv are already encoded as 0/1
+        if pd.api.types.is_numeric_dtype(y.dtype):
+            yield X, y.to_numpy(dtype=np.int64)
+        else:
+            yield X, EncodingTargetVariable(y).to_numpy()
+
+def _sgd_from_linear_model(model, alpha: float, learning_rate: float = config.WARM_START_LEARNING_RATE):
+    #an SGDClassifier that continues from the weights of a fitted linear model (e.g. the saved LogisticRegression),
+    #partial_fit keeps coef_ and intercept_ when they are already set and classes_ matches
+    from sklearn.linear_model import SGDClassifier
+    if isinstance(model, SGDClassifier):
+        return model.set_params(learning_rate='constant', eta0=learning_rate)
+    sgd = SGDClassifier(loss='log_loss', alpha=alpha, learning_rate='constant', eta0=learning_rate, random_state=42)
+    sgd.coef_ = np.array(model.coef_, dtype=np.float64, copy=True)
+    sgd.intercept_ = np.array(model.intercept_, dtype=np.float64, copy=True)
+    sgd.classes_ = np.asarray(model.classes_)
+    sgd.n_features_in_ = model.coef_.shape[1]
+    return sgd
+
+def _log_loss(y, proba) -> float:
+    proba = np.clip(proba, 1e-15, 1 - 1e-15)
+    return float(-np.mean(y * np.log(proba) + (1 - y) * np.log(1 - proba)))
+
+def run_incremental_training(file_name: str = config.DATA_FILE_NAME, chunk_size: int = config.CHUNK_SIZE, epochs: int = None,
+                             warm_start: bool = False, alpha: float = config.INCREMENTAL_ALPHA, save: bool = True,
+                             log: bool = True, seed: int = 42):
+    """
+    Trains (or with warm_start=True updates the saved) classification pipeline from a raw file, chunk by chunk.
+    Returns the fitted pipeline and a summary with the progressive validation log loss of each epoch: every chunk
+    is scored before the model learns from it, so this is an out-of-sample estimate that costs no extra pass.
+    """
+    try:
+        from sklearn.base import clone
+        from sklearn.linear_model import SGDClassifier
+        import prediction_model.pipeline as pipe
+        from prediction_model.processing.data_handling import load_pipeline, save_pipeline, save_model_artifact
+        from prediction_model.batch_prediction import extract_model_parameters
+        from prediction_model.model_registry import register_model
+        start = time.perf_counter()
+        epochs = epochs or (1 if warm_start else config.INCREMENTAL_EPOCHS)
+        rng = np.random.default_rng(seed)
+        categories = collect_categories(file_name, chunk_size)
+        logging.info(f"Categories found in {file_name}: {categories}")
+
+        if warm_start:
+            pipeline = load_pipeline(config.MODEL_NAME)
+            model = _sgd_from_linear_model(pipeline.named_steps['model'], alpha)
+            pipeline.steps[-1] = ('model', model)
+            preprocessing = pipeline[:-1]
+            fitted = dict(zip(config.CATEGORICAL_FEATURES_TO_ENCODE, pipeline.named_steps['preprocessor'].named_transformers_['categorical'][-1].categories_))
+            for feature, values in categories.items():
+                unseen = sorted(set(values) - set(fitted[feature]))
+                if unseen:
+                    #the encoder keeps its categories so the weights stay aligned, unseen values encode to all zeros
+                    logging.warning(f"{feature} values {unseen} are not known to the saved model and are ignored")
+        else:
+            model = SGDClassifier(loss='log_loss', alpha=alpha, learning_rate='constant', eta0=config.INCREMENTAL_LEARNING_RATE, random_state=seed)
+            pipeline = clone(pipe.classification_pipeline).set_params(
+                model=model, **{f"{ONE_HOT_STEP}__categories": [categories[feature] for feature in config.CATEGORICAL_FEATURES_TO_ENCODE]})
+            preprocessing = None
+
+        classes = np.array([0, 1])
+        epoch_losses = []
+        rows = 0
+        for epoch in range(epochs):
+            loss_sum, epoch_rows = 0.0, 0
+            for X, y in _shuffled_chunks(file_name, chunk_size, rng):
+                if preprocessing is None:
+                    #the stages before the model only learn column names, and the categories are fixed above
+                    preprocessing = pipeline[:-1].fit(X, y)
+                X_model = preprocessing.transform(X)
+                if hasattr(model, 'coef_'):
+                    loss_sum += _log_loss(y, model.predict_proba(X_model)[:, 1]) * len(y)
+                    epoch_rows += len(y)
+                model.partial_fit(X_model, y, classes=classes)
+                rows += len(y)
+            epoch_losses.append(loss_sum / epoch_rows if epoch_rows else None)
+            logging.info(f"Incremental training epoch {epoch}: progressive log loss {epoch_losses[-1]}")
+
+        summary = {'file_name': file_name, 'epochs': epochs, 'warm_start': warm_start, 'rows_seen': rows,
+                   'progressive_log_loss': epoch_losses, 'seconds': round(time.perf_counter() - start, 3)}
+        if save:
+            save_pipeline(pipeline)
+            save_model_artifact(extract_model_parameters(pipeline))
+            summary['model_version'] = register_model()
+            logging.info("Incrementally trained pipeline saved successfully")
+        if log:
+            from prediction_model.tracking import get_tracker
+            tracker = get_tracker()
+            with tracker.start_run(run_name='Incremental-Training'):
+                tracker.log_params({'data_file_name': file_name, 'chunk_size': chunk_size, 'epochs': epochs,
+                                    'warm_start': warm_start, 'alpha': alpha})
+                for epoch, loss in enumerate(epoch_losses):
+                    if loss is not None:
+                        tracker.log_metric('progressive_log_loss', loss, step=epoch)
+                tracker.log_metrics({'rows_seen': rows, 'training_seconds': summary['seconds']})
+        return pipeline, summary
+    except Exception as e:
+        raise CustomException(e,sys)
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Train the classification pipeline chunk by chunk with partial_fit")
+    parser.add_argument('--file', default=config.DATA_FILE_NAME, help="raw csv or parquet file, relative to the datasets directory or absolute")
+    parser.add_argument('--chunk-size', type=int, default=config.CHUNK_SIZE)
+    parser.add_argument('--epochs', type=int, help=f"passes over the file, {config.INCREMENTAL_EPOCHS} from scratch and 1 with --warm-start by default")
+    parser.add_argument('--warm-start', action='store_true', help=f"update the saved {config.MODEL_NAME} with the new data")
+    parser.add_argument('--no-save', action='store_true')
+    parser.add_argument('--no-log', action='store_true')
+    args = parser.parse_args(argv)
+    _, summary = run_incremental_training(args.file, args.chunk_size, args.epochs, args.warm_start, save=not args.no_save, log=not args.no_log)
+    print(summary)
+
+if __name__ == '__main__':
+    main()
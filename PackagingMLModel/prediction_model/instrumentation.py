@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import time
+import bisect
+import threading
+import functools
+from contextlib import nullcontext
+from datetime import datetime
+from pathlib import Path
+
+PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
+sys.path.append(str(PACKAGE_ROOT))
+
+from prediction_model.config import config
+
+#per-stage timing of training and inference
+#instrumented stages (csv parsing, the preprocessing steps, one-hot encoding, model fit/predict, mlflow calls) record
+#their wall time into a histogram, with the rows they processed and the change of the process' resident memory.
+#The totals are exported in the Prometheus text format (the server's /metrics) and as a JSON summary per run.
+#Stages may nest (load_cached_splits includes load_cached_dataset on a cache miss), their times are inclusive.
+#Disabled (the default, see config.INSTRUMENTATION_ENABLED), a stage is one flag check and a shared null context
+
+_NULL_STAGE = nullcontext()
+_enabled = config.INSTRUMENTATION_ENABLED
+_lock = threading.Lock()
+_stages = {}
+
+def enable():
+    global _enabled
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def is_enabled() -> bool:
+    return _enabled
+
+def reset():
+    with _lock:
+        _stages.clear()
+
+_page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+_statm = None #(pid, file descriptor of /proc/self/statm), reopened in forked children
+
+def _rss_bytes() -> int:
+    #current resident set size, read with one pread of /proc/self/statm on Linux, peak RSS elsewhere
+    global _statm
+    try:
+        if _statm is None or _statm[0] != os.getpid():
+            _statm = (os.getpid(), os.open('/proc/self/statm', os.O_RDONLY))
+        return int(os.pread(_statm[1], 128, 0).split()[1]) * _page_size
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+class StageStats:
+    #totals and a cumulative duration histogram of one stage, buckets from config.INSTRUMENTATION_BUCKETS_S
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.memory_delta_bytes = 0
+        self.max_memory_delta_bytes = 0
+        self.bucket_counts = [0] * (len(config.INSTRUMENTATION_BUCKETS_S) + 1) #the last one is +Inf
+
+    def add(self, seconds: float, rows: int, memory_delta: int):
+        self.calls += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.rows += rows or 0
+        self.memory_delta_bytes += memory_delta
+        self.max_memory_delta_bytes = max(self.max_memory_delta_bytes, memory_delta)
+        self.bucket_counts[bisect.bisect_left(config.INSTRUMENTATION_BUCKETS_S, seconds)] += 1
+
+    def summary(self) -> dict:
+        return {'calls': self.calls, 'seconds': round(self.seconds, 6), 'mean_seconds': self.seconds / self.calls,
+                'max_seconds': self.max_seconds, 'rows': self.rows,
+                'rows_per_s': round(self.rows / self.seconds, 1) if self.rows and self.seconds else None,
+                'memory_delta_bytes': self.memory_delta_bytes, 'max_memory_delta_bytes': self.max_memory_delta_bytes}
+
+class _Stage:
+    #rows can be set inside the block once they are known, e.g. after a file was parsed
+    __slots__ = ('name', 'rows', '_start', '_rss')
+
+    def __init__(self, name: str, rows: int = None):
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+        self._rss = _rss_bytes()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._start
+        memory_delta = _rss_bytes() - self._rss
+        with _lock:
+            stats = _stages.get(self.name)
+            if stats is None:
+                stats = _stages[self.name] = StageStats(self.name)
+            stats.add(seconds, self.rows, memory_delta)
+        return False
+
+def stage(name: str, rows: int = None):
+    """
+    Times a block: `with stage('load_dataset') as s: ...; s.rows = len(df)`. Returns a shared null context
+    when instrumentation is disabled, so `s` is None then and nothing is recorded.
+    """
+    if not _enabled:
+        return _NULL_STAGE
+    return _Stage(name, rows)
+
+def _count_rows(value):
+    if isinstance(value, tuple):
+        value = value[0] if value else None
+    try:
+        return None if value is None or isinstance(value, (str, bytes, dict)) else len(value)
+    except TypeError:
+        return None
+
+def instrumented(name: str = None):
+    #decorator timing every call of a function, the rows are the length of its result (of the first item of a tuple)
+    def decorator(func):
+        stage_name = name or func.__qualname__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Stage(stage_name) as timed:
+                result = func(*args, **kwargs)
+                timed.rows = _count_rows(result)
+            return result
+        return wrapper
+    return decorator
+
+#sklearn pipelines run their steps internally, these run them one by one so every step is a stage of its own
+def pipeline_fit(pipeline, X, y):
+    if not _enabled:
+        return pipeline.fit(X, y)
+    for step_name, step in pipeline.steps[:-1]:
+        with _Stage(f"pipeline.{step_name}.fit_transform", len(X)):
+            X = step.fit_transform(X, y)
+    with _Stage("pipeline.model.fit", len(X)):
+        pipeline.steps[-1][1].fit(X, y)
+    return pipeline
+
+def pipeline_predict(pipeline, X, method: str = 'predict'):
+    if not _enabled:
+        return getattr(pipeline, method)(X)
+    for step_name, step in pipeline.steps[:-1]:
+        with _Stage(f"pipeline.{step_name}.transform", len(X)):
+            X = step.transform(X)
+    with _Stage(f"pipeline.model.{method}", len(X)):
+        return getattr(pipeline.steps[-1][1], method)(X)
+
+#EXPORT
+def summary() -> dict:
+    with _lock:
+        return {name: stats.summary() for name, stats in sorted(_stages.items())}
+
+def _label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def prometheus_text(prefix: str = config.INSTRUMENTATION_METRIC_PREFIX) -> str:
+    with _lock:
+        stages = sorted(_stages.items())
+        lines = [f"# HELP {prefix}_stage_duration_seconds Wall time of instrumented stages",
+                 f"# TYPE {prefix}_stage_duration_seconds histogram"]
+        for name, stats in stages:
+            cumulative = 0
+            for bound, count in zip(list(config.INSTRUMENTATION_BUCKETS_S) + ['+Inf'], stats.bucket_counts):
+                cumulative += count
+                lines.append(f'{prefix}_stage_duration_seconds_bucket{{stage="{_label(name)}",le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_duration_seconds_sum{{stage="{_label(name)}"}} {stats.seconds}')
+            lines.append(f'{prefix}_stage_duration_seconds_count{{stage="{_label(name)}"}} {stats.calls}')
+        lines += [f"# HELP {prefix}_stage_rows_total Rows processed by instrumented stages",
+                  f"# TYPE {prefix}_stage_rows_total counter"]
+        lines += [f'{prefix}_stage_rows_total{{stage="{_label(name)}"}} {stats.rows}' for name, stats in stages]
+        #a gauge, stages that free memory make it go down
+        lines += [f"# HELP {prefix}_stage_memory_delta_bytes Change of resident memory summed over instrumented stages",
+                  f"# TYPE {prefix}_stage_memory_delta_bytes gauge"]
+        lines += [f'{prefix}_stage_memory_delta_bytes{{stage="{_label(name)}"}} {stats.memory_delta_bytes}' for name, stats in stages]
+    return '\n'.join(lines) + '\n'
+
+def write_summary(run_name: str, output_dir: str = config.INSTRUMENTATION_DIR) -> str:
+    #JSON summary of the stages recorded so far, returns its path or None when nothing was recorded
+    stages = summary()
+    if not stages:
+        return None
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, f"{run_name}_{datetime.now().strftime('%Y_%m_%d_%H_%M_%S')}.json")
+    with open(output_path, 'w') as f:
+        json.dump({'run_name': run_name, 'pid': os.getpid(), 'stages': stages}, f, indent=2)
+    #imported here, data_handling imports this module and does not set up logging itself
+    from logger import logging
+    logging.info(f"Stage timings of {run_name} written to {output_path}")
+    return output_path
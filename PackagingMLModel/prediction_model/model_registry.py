@@ -0,0 +1,386 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import threading
+from collections import namedtuple, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+
+PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
+sys.path.append(str(PACKAGE_ROOT))
+
+from prediction_model.config import config
+from logger import logging
+from exception import CustomException
+from prediction_model.processing.data_handling import model_artifact_name, load_model_artifact
+from prediction_model.batch_prediction import predict_batch, load_model_parameters, raw_features_needed
+from prediction_model.prediction_cache import model_version
+from prediction_model.drift_monitor import reference_profile_name, load_reference_profile
+
+#versioned models and hot reload
+#every registered model is a directory of config.MODEL_REGISTRY_DIR named after its model version (package VERSION plus
+#a hash of the pickle, see prediction_cache.model_version) with copies of the pickle, of the compact artifact and of the
+#drift reference profile.
+#Promoting a version copies it over config.MODEL_NAME, the file every process scores with.
+#A ModelRegistry serves one active model per process. A new one is loaded and checked on a background thread, then
+#swapped in by replacing a single reference: a request reads that reference once, so in-flight requests finish on
+#the model they started with. A candidate version can also score live traffic in shadow, off the request path, to
+#compare its latency and predictions with the active model before it is promoted
+
+ActiveModel = namedtuple('ActiveModel', ['version', 'model_name', 'model_parameters', 'loaded_at'])
+
+def registry_dir() -> str:
+    return os.path.join(PACKAGE_ROOT,config.SAVE_MODEL_PATH,config.MODEL_REGISTRY_DIR)
+
+def registered_model_name(version: str) -> str:
+    #relative to config.SAVE_MODEL_PATH, so it can be passed to load_pipeline and load_model_parameters
+    return os.path.join(config.MODEL_REGISTRY_DIR, version, config.MODEL_NAME)
+
+def _is_plain_version(version) -> bool:
+    #versions come from clients (/model/shadow, the cli), only a single directory name of the registry is accepted
+    return (isinstance(version, str) and version not in ('', os.curdir, os.pardir) and os.sep not in version
+            and not (os.altsep and os.altsep in version))
+
+def check_registered_version(version: str):
+    #raises ValueError unless version is a plain name with a manifest in the registry
+    if not _is_plain_version(version) or _read_manifest(version) is None:
+        raise ValueError(f"Model version {version!r} is not registered")
+
+def _read_manifest(version: str):
+    if not _is_plain_version(version):
+        return None
+    try:
+        with open(os.path.join(registry_dir(), version, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def list_versions() -> list:
+    #manifests of the registered versions, oldest first, 'active' marks the one config.MODEL_NAME holds
+    try:
+        if not os.path.isdir(registry_dir()):
+            return []
+        model_path = os.path.join(PACKAGE_ROOT,config.SAVE_MODEL_PATH,config.MODEL_NAME)
+        current = model_version(config.MODEL_NAME) if os.path.exists(model_path) else None
+        manifests = [_read_manifest(name) for name in os.listdir(registry_dir()) if not name.endswith('.tmp')]
+        manifests = [manifest for manifest in manifests if manifest is not None]
+        for manifest in manifests:
+            manifest['active'] = manifest['version'] == current
+        return sorted(manifests, key=lambda manifest: manifest['registered_at'])
+    except Exception as e:
+        raise CustomException(e,sys)
+
+def register_model(model_name: str = config.MODEL_NAME, keep: int = config.MODEL_REGISTRY_KEEP) -> str:
+    """
+    Copies a saved model (pickle and compact artifact) into the registry and returns its version. Registering
+    the same model again is a no-op. Only the newest `keep` versions are kept, besides the promoted one.
+    """
+    try:
+        version = model_version(model_name)
+        version_dir = os.path.join(registry_dir(), version)
+        if _read_manifest(version) is None:
+            source_dir = os.path.dirname(os.path.join(PACKAGE_ROOT,config.SAVE_MODEL_PATH,model_name))
+            #built in a temporary directory and renamed, so a half copied version is never listed
+            tmp_dir = f"{version_dir}.{os.getpid()}.tmp"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            files = [config.MODEL_NAME]
+            shutil.copy2(os.path.join(source_dir, os.path.basename(model_name)), os.path.join(tmp_dir, config.MODEL_NAME))
+            #a stale artifact (exported from another pickle) is not copied, the pickle alone is enough to load
+            if load_model_artifact(model_name) is not None:
+                shutil.copy2(os.path.join(source_dir, os.path.basename(model_artifact_name(model_name))),
+                             os.path.join(tmp_dir, model_artifact_name(config.MODEL_NAME)))
+                files.append(model_artifact_name(config.MODEL_NAME))
+            if load_reference_profile(model_name) is not None:
+                shutil.copy2(os.path.join(source_dir, os.path.basename(reference_profile_name(model_name))),
+                             os.path.join(tmp_dir, reference_profile_name(config.MODEL_NAME)))
+                files.append(reference_profile_name(config.MODEL_NAME))
+            with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+                json.dump({'version': version, 'registered_at': time.time(), 'source': model_name, 'files': files}, f)
+            try:
+                os.rename(tmp_dir, version_dir)
+                logging.info(f"Model version {version} registered")
+            except OSError:
+                #registered by another process in the meantime
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        _prune(keep)
+        return version
+    except Exception as e:
+        raise CustomException(e,sys)
+
+def _prune(keep: int):
+    versions = list_versions()
+    removable = [manifest['version'] for manifest in versions if not manifest['active']]
+    for version in removable[:max(0, len(versions) - keep)]:
+        shutil.rmtree(os.path.join(registry_dir(), version), ignore_errors=True)
+        logging.info(f"Model version {version} removed from the registry")
+
+def promote(version: str) -> str:
+    """
+    Makes a registered version the saved model (config.MODEL_NAME). The files are replaced atomically, the
+    artifact first and the pickle last, and running registries pick the new model up on their next check.
+    """
+    try:
+        manifest = _read_manifest(version)
+        if manifest is None:
+            raise ValueError(f"Model version {version} is not registered")
+        source_dir = os.path.join(registry_dir(), version)
+        target_dir = os.path.join(PACKAGE_ROOT,config.SAVE_MODEL_PATH)
+        for artifact in (model_artifact_name(config.MODEL_NAME), reference_profile_name(config.MODEL_NAME)):
+            if artifact not in manifest['files'] and os.path.exists(os.path.join(target_dir, artifact)):
+                os.remove(os.path.join(target_dir, artifact))
+        for file_name in sorted(manifest['files'], key=lambda name: name == config.MODEL_NAME):
+            tmp_path = os.path.join(target_dir, f"{file_name}.{os.getpid()}.tmp")
+            shutil.copy2(os.path.join(source_dir, file_name), tmp_path)
+            os.replace(tmp_path, os.path.join(target_dir, file_name))
+        logging.info(f"Model version {version} promoted to {config.MODEL_NAME}")
+        return version
+    except Exception as e:
+        raise CustomException(e,sys)
+
+def _canary_records(model_parameters: dict) -> list:
+    #applications covering every category the model knows, plus an unknown one, with all numeric fields set to 1
+    categories = {}
+    for feature, category in model_parameters['columns']:
+        if category is not None:
+            categories.setdefault(feature, []).append(category)
+    for values in categories.values():
+        values.append('unknown')
+    n = max([len(values) for values in categories.values()] + [1])
+    return [{feature: categories[feature][i % len(categories[feature])] if feature in categories else 1
+             for feature in raw_features_needed(model_parameters)} for i in range(n)]
+
+def check_model(model_parameters: dict, records: list = None):
+    #raises when a model cannot be served: malformed parameters, or scores that are not finite probabilities
+    coef = np.asarray(model_parameters['coef'], dtype=np.float64)
+    if coef.shape != (len(model_parameters['columns']),) or not np.all(np.isfinite(coef)) or not np.isfinite(model_parameters['intercept']):
+        raise ValueError("Model coefficients are malformed or not finite")
+    if len(model_parameters['classes']) != 2:
+        raise ValueError(f"Expected a binary model, got classes {model_parameters['classes']}")
+    _, y_proba = predict_batch(records or _canary_records(model_parameters), return_proba=True, model_parameters=model_parameters)
+    if not np.all(np.isfinite(y_proba)) or np.any((y_proba < 0) | (y_proba > 1)):
+        raise ValueError("Model returned invalid probabilities on the check records")
+
+class ShadowStats:
+    """
+    Comparison of a shadow model with the active one on the same batches: prediction agreement, probability
+    differences and scoring latency of both (percentiles over the last `window` batches).
+    """
+    def __init__(self, version: str, window: int = 10_000):
+        self.version = version
+        self._lock = threading.Lock()
+        self.batches = self.rows = self.agreements = self.dropped = self.errors = 0
+        self.abs_diff_sum = self.max_abs_diff = 0.0
+        self.active_latency = deque(maxlen=window)
+        self.shadow_latency = deque(maxlen=window)
+
+    def record(self, y_pred, y_proba, shadow_pred, shadow_proba, active_seconds: float, shadow_seconds: float):
+        diff = np.abs(np.asarray(y_proba) - np.asarray(shadow_proba))
+        with self._lock:
+            self.batches += 1
+            self.rows += len(diff)
+            self.agreements += int(np.count_nonzero(np.asarray(y_pred) == np.asarray(shadow_pred)))
+            self.abs_diff_sum += float(diff.sum())
+            self.max_abs_diff = max(self.max_abs_diff, float(diff.max(initial=0.0)))
+            self.active_latency.append(active_seconds)
+            self.shadow_latency.append(shadow_seconds)
+
+    def count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def report(self) -> dict:
+        with self._lock:
+            latency = {}
+            for name, values in (('active', self.active_latency), ('shadow', self.shadow_latency)):
+                if values:
+                    p50, p95, p99 = np.percentile(np.asarray(values) * 1000, [50, 95, 99])
+                    latency[name] = {'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99)}
+            return {'version': self.version, 'batches': self.batches, 'rows': self.rows, 'dropped_batches': self.dropped,
+                    'errors': self.errors, 'agreement_rate': self.agreements / self.rows if self.rows else None,
+                    'mean_abs_probability_diff': self.abs_diff_sum / self.rows if self.rows else None,
+                    'max_abs_probability_diff': self.max_abs_diff, 'latency': latency}
+
+class ModelRegistry:
+    """
+    Serves the saved model of one process and replaces it without a restart. load() (or the watcher started with
+    start_watching) loads and checks a model on a background thread and swaps it in only when the check passed;
+    start_shadow() scores a sample of the live batches with a registered candidate as well.
+    """
+    def __init__(self, model_name: str = config.MODEL_NAME, check_records: list = None):
+        self.model_name = model_name
+        self.check_records = check_records
+        self._lock = threading.Lock()
+        self._loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-loader")
+        self._loading = None
+        self._pinned = None #registered version loaded explicitly, the watcher leaves it active until load() is called again
+        self._watcher = None
+        self._stop_watching = threading.Event()
+        self._shadow = None #(ActiveModel, sample rate, ShadowStats), replaced as a whole
+        self._shadow_executor = None
+        self._shadow_slots = threading.Semaphore(config.SHADOW_MAX_PENDING)
+        #the first model is loaded before serving, a process without a valid model should not start
+        self._active = self._load(model_name)
+
+    @property
+    def active(self) -> ActiveModel:
+        return self._active
+
+    def _load(self, model_name: str) -> ActiveModel:
+        version = model_version(model_name)
+        model_parameters = load_model_parameters(model_name)
+        check_model(model_parameters, self.check_records)
+        return ActiveModel(version, model_name, model_parameters, time.time())
+
+    #HOT RELOAD
+    def load(self, version: str = None) -> Future:
+        """
+        Loads a registered version (the saved config.MODEL_NAME by default) in the background and makes it active.
+        The future resolves to the new ActiveModel, or to the exception when loading or checking failed, in which
+        case the current model stays active. A load already in progress is returned instead of starting another.
+        A registered version stays active until load() is called again, the watcher does not replace it.
+        A version that is not registered raises ValueError right away.
+        """
+        if version is not None:
+            check_registered_version(version)
+        with self._lock:
+            if self._loading is not None and not self._loading.done():
+                return self._loading
+            model_name = self.model_name if version is None else registered_model_name(version)
+            self._loading = self._loader.submit(self._swap, model_name, version)
+            return self._loading
+
+    def _swap(self, model_name: str, pinned: str = None) -> ActiveModel:
+        try:
+            candidate = self._load(model_name)
+        except Exception as e:
+            logging.error(f"Model {model_name} failed to load or check, keeping version {self._active.version}: {e}")
+            raise
+        self._pinned = pinned
+        if candidate.version != self._active.version:
+            previous, self._active = self._active, candidate
+            logging.info(f"Active model swapped from version {previous.version} to {candidate.version}")
+        return self._active
+
+    def start_watching(self, interval_s: float = config.MODEL_RELOAD_INTERVAL_S):
+        #checks the saved model every interval_s seconds (one os.stat unless it changed) and loads it when it did
+        if self._watcher is not None or not interval_s:
+            return
+        self._stop_watching.clear()
+        self._watcher = threading.Thread(target=self._watch, args=(interval_s,), name="model-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        if self._watcher is not None:
+            self._stop_watching.set()
+            self._watcher.join()
+            self._watcher = None
+
+    def _watch(self, interval_s: float):
+        failed_version = None
+        while not self._stop_watching.wait(interval_s):
+            try:
+                if self._pinned is not None:
+                    continue
+                version = model_version(self.model_name)
+                #a saved model that failed its check is not retried until it changes again
+                if version != self._active.version and version != failed_version:
+                    if self.load().exception() is not None:
+                        failed_version = version
+            except Exception as e:
+                logging.warning(f"Checking {self.model_name} for a new version failed: {e}")
+
+    #SCORING
+    def predict(self, records, model: ActiveModel = None) -> tuple:
+        #records: one application dict or a list of them, returns the predicted classes and approval probabilities
+        try:
+            model = model or self._active
+            shadow = self._shadow
+            start = time.perf_counter()
+            y_pred, y_proba = predict_batch(records, return_proba=True, model_parameters=model.model_parameters)
+            if shadow is not None and random.random() < shadow[1]:
+                self._submit_shadow(shadow, records, y_pred, y_proba, time.perf_counter() - start)
+            return y_pred, y_proba
+        except Exception as e:
+            raise CustomException(e,sys)
+
+    #SHADOW SCORING
+    def start_shadow(self, version: str, sample_rate: float = config.SHADOW_SAMPLE_RATE) -> Future:
+        """
+        Loads a registered version in the background and, once its check passed, scores sample_rate of the live
+        batches with it too. Returns a future of the shadow model, the comparison is read with shadow_report().
+        A version that is not registered raises ValueError right away.
+        """
+        check_registered_version(version)
+        def _start():
+            candidate = self._load(registered_model_name(version))
+            if self._shadow_executor is None:
+                self._shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow-scorer")
+            self._shadow = (candidate, sample_rate, ShadowStats(candidate.version))
+            logging.info(f"Shadow scoring {sample_rate:.0%} of the traffic with model version {candidate.version}")
+            return candidate
+        return self._loader.submit(_start)
+
+    def stop_shadow(self) -> dict:
+        shadow, self._shadow = self._shadow, None
+        return shadow[2].report() if shadow is not None else None
+
+    def shadow_report(self) -> dict:
+        shadow = self._shadow
+        return shadow[2].report() if shadow is not None else None
+
+    def _submit_shadow(self, shadow: tuple, records, y_pred, y_proba, active_seconds: float):
+        #the live request never waits for the shadow model, batches are dropped when it falls behind
+        if not self._shadow_slots.acquire(blocking=False):
+            shadow[2].count('dropped')
+            return
+        try:
+            self._shadow_executor.submit(self._score_shadow, shadow, records, y_pred, y_proba, active_seconds)
+        except Exception:
+            self._shadow_slots.release()
+            raise
+
+    def _score_shadow(self, shadow: tuple, records, y_pred, y_proba, active_seconds: float):
+        candidate, _, stats = shadow
+        try:
+            start = time.perf_counter()
+            shadow_pred, shadow_proba = predict_batch(records, return_proba=True, model_parameters=candidate.model_parameters)
+            stats.record(y_pred, y_proba, shadow_pred, shadow_proba, active_seconds, time.perf_counter() - start)
+        except Exception as e:
+            stats.count('errors')
+            logging.warning(f"Shadow model {candidate.version} failed to score a batch: {e}")
+        finally:
+            self._shadow_slots.release()
+
+    def status(self) -> dict:
+        active = self._active
+        loading = self._loading
+        return {'active_version': active.version, 'loaded_at': active.loaded_at,
+                'loading': loading is not None and not loading.done(), 'watching': self._watcher is not None,
+                'pinned_version': self._pinned,
+                'shadow': self.shadow_report()}
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Manage the registered versions of the saved model")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list', help="list the registered versions")
+    subparsers.add_parser('register', help=f"register the saved {config.MODEL_NAME}")
+    promote_parser = subparsers.add_parser('promote', help=f"copy a registered version over {config.MODEL_NAME}")
+    promote_parser.add_argument('version')
+    args = parser.parse_args(argv)
+    if args.command == 'register':
+        print(register_model())
+    elif args.command == 'promote':
+        print(promote(args.version))
+    else:
+        for manifest in list_versions():
+            registered_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(manifest['registered_at']))
+            print(f"{'*' if manifest['active'] else ' '} {manifest['version']}  {registered_at}  {manifest['source']}")
+
+if __name__ == '__main__':
+    main()
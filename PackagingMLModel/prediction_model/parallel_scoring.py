@@ -0,0 +1,65 @@
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import pandas as pd
+
+PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
+sys.path.append(str(PACKAGE_ROOT))
+
+from prediction_model.config import config
+from logger import logging
+from exception import CustomException
+from prediction_model.processing.data_handling import dataset_slices, load_dataset_slice
+from prediction_model.batch_prediction import load_model_parameters, raw_features_needed, predict_batch
+
+#parallel batch scoring across worker processes
+#the parent only splits the input file into slices (line aligned byte ranges of a csv file, row groups of a parquet
+#file) and sends their offsets. Each worker parses its slice, builds the feature matrix and scores it with the model
+#parameters it loaded at start-up, only the ids, predictions and probabilities come back. Parsing dominates the cost
+#of scoring a file, so it has to happen in the workers for the pool to pay off
+
+_worker_model_parameters = None
+
+def _init_worker(model_name: str):
+    #runs once per worker process
+    global _worker_model_parameters
+    _worker_model_parameters = load_model_parameters(model_name)
+    logging.info(f"Scoring worker {os.getpid()} loaded {model_name}")
+
+def _score_slice(input_path: str, dataset_slice: tuple, usecols: list, id_column: str) -> pd.DataFrame:
+    chunk = load_dataset_slice(input_path, dataset_slice, usecols)
+    y_pred, y_proba = predict_batch(chunk, return_proba=True, model_parameters=_worker_model_parameters)
+    scored = pd.DataFrame({'prediction': y_pred, 'probability': y_proba})
+    if id_column is not None and id_column in chunk.columns:
+        scored.insert(0, id_column, chunk[id_column].to_numpy())
+    return scored
+
+def score_file_parallel(input_path: str, chunk_size: int = config.CHUNK_SIZE, workers: int = config.SCORING_WORKERS,
+                        id_column: str = None, model_name: str = config.MODEL_NAME):
+    """
+    Scores a raw application file (csv or parquet) on a pool of worker processes and yields one scored DataFrame
+    per slice of about chunk_size rows, in input order. At most two slices per worker are in flight, which bounds
+    memory use.
+    """
+    try:
+        model_parameters = load_model_parameters(model_name)
+        usecols = raw_features_needed(model_parameters) + ([id_column] if id_column else [])
+        slices = dataset_slices(input_path, chunk_size)
+        pending = deque()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model_name,)) as executor:
+            try:
+                for dataset_slice in slices:
+                    pending.append(executor.submit(_score_slice, input_path, dataset_slice, usecols, id_column))
+                    if len(pending) >= 2 * workers:
+                        #waits for the oldest slice, so results come back in input order
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                #slices not started yet are not scored when the caller stops early or a slice failed
+                for future in pending:
+                    future.cancel()
+    except Exception as e:
+        raise CustomException(e,sys)
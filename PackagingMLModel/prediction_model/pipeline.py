@@ -32,7 +32,13 @@ preprocessor = ColumnTransformer(
     ]
 )   
 
+# The pipeline takes the raw application columns: CreateCustomColumns, ColumnsToDrop and TransformingNumericFeatures
+# run as its first stages, so one predict call on raw data does everything
 classification_pipeline = Pipeline([
+    ('strip_categories', dp.CategoricalValuesStripper()),  # ' Graduate' -> 'Graduate'
+    ('custom_columns', dp.CustomColumnsCreator()),  # total_assets_value = sum of the asset columns
+    ('columns_to_drop', dp.ColumnsDropper()),  # loan_id and the merged asset columns
+    ('log_transformation', dp.NumericFeaturesLogTransformer()),  # log1p of the skewed numeric features
     ('preprocessor', preprocessor),  # Preprocessing step
     ('model', LogisticRegression(random_state=42))  # Logistic regression model
 ])
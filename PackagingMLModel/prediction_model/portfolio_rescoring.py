@@ -0,0 +1,184 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
+sys.path.append(str(PACKAGE_ROOT))
+
+from prediction_model.config import config
+from logger import logging
+from exception import CustomException
+from prediction_model.processing.data_handling import load_dataset_in_chunks
+from prediction_model.batch_prediction import load_model_parameters, raw_features_needed, records_to_columns, build_feature_matrix, check_feature_matrix
+from prediction_model.prediction_cache import model_version
+from prediction_model.score_file import PredictionWriter
+
+#incremental rescoring of the loan book
+#an index on disk keeps, for every loan_id of the last run, a 64-bit hash of the raw fields the model reads with the
+#prediction and probability it got, as .npy arrays sorted by loan_id (memory-mapped, looked up with searchsorted).
+#A run streams the book chunk by chunk, hashes the rows with vectorized integer arithmetic, rescores only the loans
+#that are new or whose fields changed, takes the other scores from the index, writes the full score table and replaces
+#the index. A new model version (or a change of the fields it reads) rescores every loan
+
+INDEX_ARRAYS = ('loan_id', 'content_hash', 'prediction', 'probability')
+_HASH_SEED = np.uint64(0x9E3779B97F4A7C15)
+_MISSING_HASH = np.uint64(0x5BD1E9955BD1E995) #hash of missing categorical values
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    #splitmix64 finalizer, uint64 arithmetic wraps around
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+def _string_hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def _column_bits(values, categorical: bool) -> np.ndarray:
+    #one uint64 per row: the hash of the stripped category, or the bits of the value as a float (2 and 2.0 match)
+    if categorical:
+        #factorized first, so only the distinct values are stripped and hashed, missing values get code -1
+        codes, uniques = pd.factorize(values)
+        lookup = np.array([_string_hash(str(value).strip()) for value in uniques] + [int(_MISSING_HASH)], dtype=np.uint64)
+        return lookup[codes]
+    numbers = np.asarray(values, dtype=np.float64) + 0.0 #-0.0 becomes 0.0
+    return numbers.view(np.uint64)
+
+def hash_rows(raw_columns: dict, fields: list) -> np.ndarray:
+    """
+    64-bit content hash of every row over fields, computed column by column for the whole chunk.
+    Categorical values are compared after stripping whitespace, numbers as floats.
+    """
+    n_rows = len(raw_columns[fields[0]]) if fields else 0
+    hashes = np.full(n_rows, _HASH_SEED, dtype=np.uint64)
+    for i, field in enumerate(fields):
+        bits = _column_bits(raw_columns[field], field in config.CATEGORICAL_FEATURES_TO_ENCODE)
+        hashes = _mix(hashes ^ _mix(bits + np.uint64(i + 1)))
+    return hashes
+
+def load_index(index_dir: str = config.PORTFOLIO_INDEX_DIR) -> tuple:
+    #(metadata, {array name: memory-mapped array}), (None, None) when no run saved an index yet
+    for path in (index_dir, index_dir + '.old'): #.old is left behind when a run stopped while replacing the index
+        meta_path = os.path.join(path, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            return meta, {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r') for name in INDEX_ARRAYS}
+    return None, None
+
+def save_index(arrays: dict, meta: dict, index_dir: str = config.PORTFOLIO_INDEX_DIR):
+    #written to a temporary directory and swapped in, so a failed run leaves the previous index intact
+    tmp_dir, old_dir = index_dir + '.tmp', index_dir + '.old'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name in INDEX_ARRAYS:
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), arrays[name])
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(index_dir):
+        os.rename(index_dir, old_dir)
+    os.rename(tmp_dir, index_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+def rescore_portfolio(input_path: str, output_path: str, index_dir: str = config.PORTFOLIO_INDEX_DIR, id_column: str = 'loan_id',
+                      chunk_size: int = config.CHUNK_SIZE, model_name: str = config.MODEL_NAME, full: bool = False) -> dict:
+    """
+    Writes the scores of every loan in input_path (csv or parquet) to output_path with a 'rescored' column, scoring only
+    the loans that are new or changed since the run that saved the index in index_dir, every loan when full is True.
+    id_column must hold unique integer ids, otherwise the run fails and output_path and the index are left as they were.
+    """
+    #the score table is written next to output_path and moved over it once the ids were found unique
+    root, extension = os.path.splitext(output_path)
+    tmp_output = f"{root}.{os.getpid()}.tmp{extension}"
+    try:
+        start = time.perf_counter()
+        model_parameters = load_model_parameters(model_name)
+        version = model_version(model_name)
+        fields = raw_features_needed(model_parameters)
+        meta, index = load_index(index_dir)
+        reuse = not full and meta is not None and meta['model_version'] == version and meta['fields'] == fields
+        if meta is not None and not reuse:
+            logging.info(f"Rescoring every loan, the index was built with model {meta['model_version']} and {version} is current")
+        old_ids = index['loan_id'] if reuse else np.empty(0, dtype=np.int64)
+        seen = np.zeros(len(old_ids), dtype=bool)
+        pieces = {name: [] for name in INDEX_ARRAYS}
+        counts = {'rows': 0, 'new': 0, 'changed': 0, 'unchanged': 0}
+        writer = PredictionWriter(tmp_output)
+        try:
+            for chunk in load_dataset_in_chunks(input_path, chunk_size, usecols=fields + [id_column]):
+                if not pd.api.types.is_integer_dtype(chunk[id_column].dtype):
+                    raise ValueError(f"{id_column} must hold integer loan ids, {input_path} has {chunk[id_column].dtype} values")
+                ids = chunk[id_column].to_numpy(dtype=np.int64)
+                raw_columns = records_to_columns(chunk, fields)
+                hashes = hash_rows(raw_columns, fields)
+                positions = np.minimum(np.searchsorted(old_ids, ids), max(len(old_ids) - 1, 0))
+                found = old_ids[positions] == ids if len(old_ids) else np.zeros(len(ids), dtype=bool)
+                unchanged = found & (index['content_hash'][positions] == hashes) if len(old_ids) else found
+                seen[positions[found]] = True
+                rescore = ~unchanged
+                y_proba = np.empty(len(ids), dtype=np.float64)
+                y_pred = np.empty(len(ids), dtype=model_parameters['classes'].dtype)
+                if unchanged.any():
+                    y_proba[unchanged] = index['probability'][positions[unchanged]]
+                    y_pred[unchanged] = index['prediction'][positions[unchanged]]
+                if rescore.any():
+                    X = build_feature_matrix({col: values[rescore] for col, values in raw_columns.items()}, model_parameters)
+                    check_feature_matrix(X)
+                    scores = X @ model_parameters['coef'] + model_parameters['intercept']
+                    y_proba[rescore] = 1.0 / (1.0 + np.exp(-scores))
+                    y_pred[rescore] = model_parameters['classes'][(scores > 0).astype(np.intp)]
+                writer.write(pd.DataFrame({id_column: ids, 'prediction': y_pred, 'probability': y_proba, 'rescored': rescore}))
+                for name, values in zip(INDEX_ARRAYS, (ids, hashes, y_pred, y_proba)):
+                    pieces[name].append(values)
+                counts['rows'] += len(ids)
+                counts['new'] += int(np.count_nonzero(~found))
+                counts['changed'] += int(np.count_nonzero(found & rescore))
+                counts['unchanged'] += int(np.count_nonzero(unchanged))
+        finally:
+            writer.close()
+        arrays = {name: np.concatenate(values) if values else np.empty(0) for name, values in pieces.items()}
+        #books are usually stored in loan_id order, then no sort is needed
+        if not (arrays['loan_id'][1:] > arrays['loan_id'][:-1]).all():
+            order = np.argsort(arrays['loan_id'], kind='stable')
+            arrays = {name: values[order] for name, values in arrays.items()}
+        if (np.diff(arrays['loan_id']) == 0).any():
+            raise ValueError(f"{id_column} is not unique in {input_path}, the score table and the index were not updated")
+        if os.path.exists(tmp_output):
+            os.replace(tmp_output, output_path)
+        del index, old_ids #releasing the memory maps of the old index, mapped files cannot be renamed on windows
+        save_index(arrays, {'model_version': version, 'fields': fields, 'rows': counts['rows'], 'id_column': id_column}, index_dir)
+        elapsed = time.perf_counter() - start
+        summary = {**counts, 'removed': int(len(seen) - np.count_nonzero(seen)), 'rescored': counts['new'] + counts['changed'],
+                   'full_rescore': not reuse, 'model_version': version, 'seconds': round(elapsed, 3)}
+        logging.info(f"Rescored {input_path} into {output_path}: {summary}")
+        return summary
+    except Exception as e:
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+        raise CustomException(e,sys)
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog='rescore-portfolio', description="Rescore the loans that changed since the last run")
+    parser.add_argument('input', help="csv or parquet file of the whole loan book, raw application columns")
+    parser.add_argument('output', help="csv or parquet file for the full score table")
+    parser.add_argument('--index-dir', default=config.PORTFOLIO_INDEX_DIR)
+    parser.add_argument('--id-column', default='loan_id', help="column of unique integer loan ids")
+    parser.add_argument('--chunk-size', type=int, default=config.CHUNK_SIZE)
+    parser.add_argument('--full', action='store_true', help="rescore every loan and rebuild the index")
+    args = parser.parse_args(argv)
+    summary = rescore_portfolio(os.path.abspath(args.input), os.path.abspath(args.output), os.path.abspath(args.index_dir),
+                                args.id_column, args.chunk_size, full=args.full)
+    print(f"{summary['rows']} loans, {summary['rescored']} rescored ({summary['new']} new, {summary['changed']} changed), "
+          f"{summary['removed']} removed, in {summary['seconds']}s")
+
+if __name__ == '__main__':
+    main()
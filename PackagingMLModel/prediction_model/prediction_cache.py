@@ -0,0 +1,243 @@
+import os
+import sys
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+
+PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
+sys.path.append(str(PACKAGE_ROOT))
+
+from prediction_model import __version__
+from prediction_model.config import config
+from logger import logging
+from exception import CustomException
+from prediction_model.processing.data_handling import _file_sha256
+from prediction_model.batch_prediction import predict_batch, load_model_parameters, raw_features_needed
+
+#cache of predictions for applications that are submitted again (edits, retries, status checks)
+#the key is a hash of the model version and of the canonical values of the raw fields the model reads, so fields the
+#model ignores (loan_id, ...) and formatting differences (' Graduate', 2 vs 2.0) do not cause misses. The model version
+#is the package VERSION plus a hash of the saved pickle: saving a new model changes it, which empties the cache.
+#Each process keeps an LRU/TTL cache in memory, an optional sqlite file lets the server worker processes share hits
+
+_model_versions = {}
+
+def model_version(model_name: str = config.MODEL_NAME) -> str:
+    #the pickle is only hashed again when its size or modification time changed, so checking costs one os.stat
+    model_path = os.path.join(PACKAGE_ROOT,config.SAVE_MODEL_PATH,model_name)
+    stat = os.stat(model_path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _model_versions.get(model_path)
+    if cached is None or cached[0] != signature:
+        cached = (signature, f"{__version__}+{_file_sha256(model_path)[:12]}")
+        _model_versions[model_path] = cached
+    return cached[1]
+
+def canonical_features(record: dict, needed: list) -> tuple:
+    #categorical values are stripped, numbers are compared as floats
+    names = {str(key).strip(): key for key in record}
+    return tuple(str(record[names[col]]).strip() if col in config.CATEGORICAL_FEATURES_TO_ENCODE else float(record[names[col]])
+                 for col in needed)
+
+def cache_key(features: tuple, version: str) -> str:
+    return hashlib.blake2b(repr((version,) + features).encode('utf-8'), digest_size=16).hexdigest()
+
+class SqliteCacheBackend:
+    #prediction cache shared between processes through a sqlite file in WAL mode
+    def __init__(self, path: str, max_entries: int = config.PREDICTION_CACHE_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._connection = None
+        self._puts_since_trim = 0
+
+    def _connect(self):
+        #opened on first use, so a backend created before the server forks its workers is not shared by them
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, version TEXT, "
+                                     "prediction INTEGER, probability REAL, expires_at REAL)")
+        return self._connection
+
+    def get_many(self, keys: list) -> dict:
+        #key -> ((prediction, probability), expires_at) for the keys found and not expired
+        found = {}
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            #sqlite limits the number of query parameters
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = connection.execute(f"SELECT key, prediction, probability, expires_at FROM predictions WHERE key IN "
+                                          f"({','.join('?' * len(batch))}) AND expires_at > ?", (*batch, now))
+                found.update((key, ((prediction, probability), expires_at)) for key, prediction, probability, expires_at in rows)
+        return found
+
+    def put_many(self, items: dict, version: str, expires_at: float):
+        with self._lock:
+            connection = self._connect()
+            connection.executemany("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?)",
+                                   [(key, version, prediction, probability, expires_at) for key, (prediction, probability) in items.items()])
+            self._puts_since_trim += len(items)
+            if self._puts_since_trim >= 1000:
+                self._trim(connection)
+
+    def _trim(self, connection):
+        #drops expired entries, then the ones closest to expiring until the size bound holds
+        self._puts_since_trim = 0
+        connection.execute("DELETE FROM predictions WHERE expires_at <= ?", (time.time(),))
+        (count,) = connection.execute("SELECT COUNT(*) FROM predictions").fetchone()
+        if count > self.max_entries:
+            connection.execute("DELETE FROM predictions WHERE key IN (SELECT key FROM predictions ORDER BY expires_at LIMIT ?)",
+                               (count - self.max_entries,))
+
+    def purge_other_versions(self, version: str):
+        with self._lock:
+            self._connect().execute("DELETE FROM predictions WHERE version != ?", (version,))
+
+class PredictionCache:
+    """
+    Size-bounded LRU cache with a time to live, in front of an optional shared backend. Values are
+    (prediction, probability) tuples. Counts hits (shared_hits of them from the backend), misses and evictions.
+    """
+    def __init__(self, max_entries: int = config.PREDICTION_CACHE_SIZE, ttl_s: float = config.PREDICTION_CACHE_TTL_S,
+                 shared_path: str = config.PREDICTION_CACHE_PATH):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.shared = SqliteCacheBackend(shared_path, max_entries) if shared_path else None
+        self._entries = OrderedDict() #key -> (value, expires_at), least recently used first
+        self._lock = threading.Lock()
+        self.hits = self.shared_hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def get_many(self, keys: list) -> list:
+        now = time.time()
+        values = [None] * len(keys)
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] <= now:
+                    del self._entries[key]
+                    self.expirations += 1
+                    entry = None
+                if entry is None:
+                    missing.append(i)
+                else:
+                    self._entries.move_to_end(key)
+                    values[i] = entry[0]
+        shared_hits = 0
+        if missing and self.shared is not None:
+            found = self.shared.get_many([keys[i] for i in missing])
+            if found:
+                self._put_local(found)
+                for i in missing:
+                    values[i] = found[keys[i]][0] if keys[i] in found else None
+                shared_hits = len(missing)
+                missing = [i for i in missing if values[i] is None]
+                shared_hits -= len(missing)
+        with self._lock:
+            self.shared_hits += shared_hits
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        return values
+
+    def _put_local(self, entries: dict):
+        #entries: key -> (value, expires_at)
+        with self._lock:
+            for key, entry in entries.items():
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def put_many(self, items: dict, version: str):
+        expires_at = time.time() + self.ttl_s
+        self._put_local({key: (value, expires_at) for key, value in items.items()})
+        if self.shared is not None:
+            self.shared.put_many(items, version, expires_at)
+
+    def invalidate(self, version: str):
+        #called when the model changed, entries of other model versions can no longer be hit
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+        if self.shared is not None:
+            self.shared.purge_other_versions(version)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._entries), 'max_entries': self.max_entries, 'hits': self.hits, 'shared_hits': self.shared_hits,
+                    'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else None, 'evictions': self.evictions,
+                    'expirations': self.expirations, 'invalidations': self.invalidations}
+
+class CachedPredictor:
+    """
+    predict_batch behind a PredictionCache. Every call checks the saved model's version and reloads the model
+    (and empties the cache) when a new one was saved, so a cached prediction never outlives its model.
+    With a model_registry.ModelRegistry the misses are scored by its active model instead, which the registry
+    reloads in the background, and the cache is emptied when the registry swapped models.
+    """
+    def __init__(self, model_name: str = config.MODEL_NAME, cache: PredictionCache = None, registry=None):
+        self.model_name = model_name
+        self.cache = cache if cache is not None else PredictionCache()
+        self.registry = registry
+        self._lock = threading.Lock()
+        self._state = None #(version, model parameters, raw fields needed, registry model), replaced as a whole on reload
+        self._refresh()
+
+    def _refresh(self) -> tuple:
+        active = self.registry.active if self.registry is not None else None
+        version = active.version if active is not None else model_version(self.model_name)
+        state = self._state
+        if state is not None and state[0] == version:
+            return state
+        with self._lock:
+            if self._state is None or self._state[0] != version:
+                model_parameters = active.model_parameters if active is not None else load_model_parameters(self.model_name)
+                if self._state is not None:
+                    logging.info(f"Model {self.model_name} changed to version {version}, prediction cache cleared")
+                self.cache.invalidate(version)
+                self._state = (version, model_parameters, raw_features_needed(model_parameters), active)
+            return self._state
+
+    @property
+    def version(self) -> str:
+        return self._state[0]
+
+    def predict(self, records) -> tuple:
+        #records: one application dict or a list of them, returns the predicted classes and approval probabilities
+        try:
+            version, model_parameters, needed, active = self._refresh()
+            records = [records] if isinstance(records, dict) else list(records)
+            keys = [cache_key(canonical_features(record, needed), version) for record in records]
+            values = self.cache.get_many(keys)
+            missing = [i for i, value in enumerate(values) if value is None]
+            if missing:
+                if active is not None:
+                    y_pred, y_proba = self.registry.predict([records[i] for i in missing], model=active)
+                else:
+                    y_pred, y_proba = predict_batch([records[i] for i in missing], return_proba=True, model_parameters=model_parameters)
+                scored = {}
+                for i, prediction, probability in zip(missing, y_pred.tolist(), y_proba.tolist()):
+                    values[i] = scored[keys[i]] = (prediction, probability)
+                self.cache.put_many(scored, version)
+            y_pred = np.array([value[0] for value in values])
+            y_proba = np.array([value[1] for value in values], dtype=np.float64)
+            return y_pred, y_proba
+        except Exception as e:
+            raise CustomException(e,sys)
+
+    def predict_one(self, record: dict) -> tuple:
+        y_pred, y_proba = self.predict([record])
+        return y_pred.tolist()[0], float(y_proba[0])
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), 'model_version': self.version}
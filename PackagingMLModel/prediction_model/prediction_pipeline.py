@@ -3,37 +3,65 @@ import sys
 import pandas as pd
 from pathlib import Path
 import numpy as np
-import mlflow
-import seaborn as sns
-import matplotlib.pyplot as plt
 
 PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
 sys.path.append(str(PACKAGE_ROOT))
 
-mlflow.set_tracking_uri("http://localhost:5000") #default path to mlartifact
-mlflow.set_experiment("END-TO-END-LOAN-APPROVAL-PRediction") #experiment name
-
 from prediction_model.config import config
 from logger import logging
 from exception import CustomException
 import prediction_model.processing.data_preprocessing as dp
-from prediction_model.processing.data_handling import load_dataset, separate_data, data_split_strategy, save_pipeline, load_pipeline
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, confusion_matrix
+from prediction_model.processing.data_handling import load_dataset, load_cached_splits, separate_data, data_split_strategy, save_pipeline, load_pipeline
+from prediction_model.tracking import get_tracker
+from prediction_model.prediction_cache import model_version
+from prediction_model import instrumentation
+from prediction_model.evaluation import confusion_counts, metrics_from_confusion, plot_confusion_matrix, evaluate_model
+
+#mlflow, plotting and the model itself are loaded on first use, importing this module has no side effects
+_classification_pipeline = None #(model version, pipeline)
+_mlflow = None
+
+def get_classification_pipeline():
+    #the model is loaded again when a new one was saved (checking costs one os.stat), so long running processes
+    #pick up a retrained model without a restart
+    global _classification_pipeline
+    try:
+        version = model_version(config.MODEL_NAME)
+        if _classification_pipeline is None or _classification_pipeline[0] != version:
+            _classification_pipeline = (version, load_pipeline(config.MODEL_NAME))
+            logging.info(f"Model version {version} loaded successfully")
+            # preprocessor = classification_pipeline.named_steps['preprocessor'] to obtain only preprocessor from pipeline
+        return _classification_pipeline[1]
+    except Exception as e:
+        raise CustomException(e,sys)
 
-try:
-    classification_pipeline = load_pipeline(config.MODEL_NAME)
-    logging.info("Model loaded successfully")
-    # preprocessor = classification_pipeline.named_steps['preprocessor'] to obtain only preprocessor from pipeline
-except Exception as e:
-    raise CustomException(e,sys)
+def get_mlflow():
+    #imports mlflow the first time it is needed, runs are logged through prediction_model.tracking
+    global _mlflow
+    if _mlflow is None:
+        import mlflow
+        _mlflow = mlflow
+    return _mlflow
 
-def generate_predictions():
+def __getattr__(name):
+    #keeps prediction_pipeline.classification_pipeline working for existing callers
+    if name == "classification_pipeline":
+        return get_classification_pipeline()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def generate_predictions(subset: str = "Test"):
     try:
-        mlflow.sklearn.autolog()
-        with mlflow.start_run(run_name='Evaluation-Loan_prediction') as run:
-            mlflow.set_tag("mlflow.user", "Suhaib_Mukhtar")
-            test_data = load_dataset(config.TEST_FILE_NAME)
-            train_data = load_dataset(config.TRAIN_FILE_NAME)
+        instrumentation.reset()
+        mlflow = get_mlflow()
+        classification_pipeline = get_classification_pipeline()
+        #evaluation runs are logged through the buffered tracker, which does not block on the tracking server
+        tracker = get_tracker()
+        with tracker.start_run(run_name='Evaluation-Loan_prediction') as run:
+            tracker.set_tag("mlflow.user", "Suhaib_Mukhtar")
+            #the splits are read from the arrow dataset cache instead of re-parsing train.csv and test.csv
+            X_train, X_test, y_train, y_test, _ = load_cached_splits(config.DATA_FILE_NAME)
+            test_data = pd.concat([X_test, y_test], axis=1)
+            train_data = pd.concat([X_train, y_train], axis=1)
             mlflow.data.from_pandas(
                 train_data,
                 source=os.path.join(PACKAGE_ROOT,config.DATASET_DIR,config.TRAIN_FILE_NAME),
@@ -45,59 +73,41 @@ def generate_predictions():
                 name="test_data",
             )
             logging.info("Test Data loaded successfully")
-            X_test, y_test = separate_data(test_data)
-            logging.info("Separated test data successfully")
-            y_pred = classification_pipeline.predict(X_test)
-            logging.info("Predictions generated successfully")
+            X, y = (X_train, y_train) if subset == "Train" else (X_test, y_test)
+            #step by step, so every pipeline stage is timed, when instrumentation is enabled
+            y_pred = instrumentation.pipeline_predict(classification_pipeline, X)
+            logging.info(f"{subset} predictions generated successfully")
             y_pred_class = np.where(y_pred > 0.5, 1, 0)
             logging.info("Predictions converted to classes successfully")
-            return y_pred_class, y_test
+        instrumentation.write_summary(f"predictions_{subset}")
+        return y_pred_class, y
     except Exception as e:
         raise CustomException(e,sys)
 
 def EvaluationMetrics(y_pred_class, y_test, subset):
     try:
-        accuracy = accuracy_score(y_test, y_pred_class)
-        precision = precision_score(y_test, y_pred_class)
-        recall = recall_score(y_test, y_pred_class)
-        f1 = f1_score(y_test, y_pred_class)
-        cm = confusion_matrix(y_test, y_pred_class)
+        #one bincount pass for the confusion matrix, the metrics are derived from it
+        cm = confusion_counts(y_test, y_pred_class)
+        metrics = metrics_from_confusion(cm)
         logging.info(f"Confusion Matrix:{cm}")
-        logging.info(f"Accuracy:{accuracy}")
-        logging.info(f"Precision:{precision}")
-        logging.info(f"Recall:{recall}")
-        logging.info(f"F1 Score:{f1}")
-        sns.heatmap(cm, annot=True, fmt='d')
-        plt.xlabel('Predicted')
-        plt.ylabel('True')
-        plt.title(f'Confusion Matrix_{subset}')
-        
-        # Ensure the directory exists
-        confusion_matrix_path = os.path.join(PACKAGE_ROOT, config.SAVE_MODEL_PATH, f"confusion_matrix_{subset}.png")        
-        plt.savefig(confusion_matrix_path)
-        
-        if subset == "Test":
-            mlflow.log_metric("Test_Accuracy", accuracy)
-            mlflow.log_metric("Test_Precision", precision)
-            mlflow.log_metric("Test_Recall", recall)
-            mlflow.log_metric("Test_F1_Score", f1)
-            mlflow.log_artifact(confusion_matrix_path)
-        else:
-            mlflow.log_metric("Train_Accuracy", accuracy)
-            mlflow.log_metric("Train_Precision", precision)
-            mlflow.log_metric("Train_Recall", recall)
-            mlflow.log_metric("Train_F1_Score", f1)
-            mlflow.log_artifact(confusion_matrix_path)
-            
-        mlflow.log_artifact(__file__) #log the current file
-        return {"Accuracy":accuracy, "Precision":precision, "Recall":recall, "f1-score":f1}
+        logging.info(f"Accuracy:{metrics['accuracy']}")
+        logging.info(f"Precision:{metrics['precision']}")
+        logging.info(f"Recall:{metrics['recall']}")
+        logging.info(f"F1 Score:{metrics['f1']}")
+        confusion_matrix_path = plot_confusion_matrix(cm, subset)
+
+        prefix = "Test" if subset == "Test" else "Train"
+        tracker = get_tracker()
+        with tracker.start_run(run_name=f'Evaluation-Metrics_{subset}'):
+            tracker.log_metrics({f"{prefix}_Accuracy": metrics['accuracy'], f"{prefix}_Precision": metrics['precision'],
+                                 f"{prefix}_Recall": metrics['recall'], f"{prefix}_F1_Score": metrics['f1']})
+            tracker.log_artifact(confusion_matrix_path)
+            tracker.log_artifact(__file__) #log the current file, only uploaded again when it changed
+        return {"Accuracy":metrics['accuracy'], "Precision":metrics['precision'], "Recall":metrics['recall'], "f1-score":metrics['f1']}
     except Exception as e:
         raise CustomException(e,sys)
 
 if __name__=="__main__":
-    y_pred_class, y_test = generate_predictions()
-    y_pred_train_class, y_train = generate_predictions()
-    results = EvaluationMetrics(y_pred_class, y_test, subset="Test")
-    train_results = EvaluationMetrics(y_pred_train_class, y_train, subset="Train")
+    #the model and the splits are loaded once and train and test are each scored on their own data
+    results = evaluate_model(plot=True)
     logging.info("Evaluation Metrics calculated successfully")
-    
@@ -1,8 +1,11 @@
+import io
 import os
 import sys
+import json
+import struct
+import hashlib
+import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import StandardScaler
 from pathlib import Path
 import joblib
 
@@ -17,16 +20,206 @@ from exception import CustomException
 #the path above is added to the sys.path so that the modules in the parent directory can be imported, so that the config file can be imported easily without any errors
 
 from prediction_model.config import config
+from prediction_model.instrumentation import instrumented
+
+#removing leading and trailing spaces from categorical values (' Graduate' -> 'Graduate')
+#for categorical columns only the categories are stripped, so the cost does not depend on the number of rows
+def strip_categorical_values(values):
+    if isinstance(values, pd.Series):
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            if values.cat.categories.inferred_type != 'string':
+                return values
+            stripped = values.cat.categories.str.strip()
+            if stripped.is_unique:
+                return values.cat.rename_categories(stripped)
+            return values.astype(str).str.strip().astype('category')
+        if pd.api.types.is_string_dtype(values.dtype):
+            return values.str.strip()
+        return values
+    values = np.asarray(values)
+    if values.dtype.kind == 'U':
+        return np.char.strip(values)
+    if values.dtype.kind == 'O':
+        return np.array([value.strip() if isinstance(value, str) else value for value in values], dtype=object)
+    return values
+
+#dtypes from config.DATA_DTYPES keyed by the column names as they appear in the file header
+def _csv_dtypes(file_path: str) -> dict:
+    header = pd.read_csv(file_path, nrows=0).columns
+    return {col: config.DATA_DTYPES[col.strip()] for col in header if col.strip() in config.DATA_DTYPES}
+
+def _normalize_columns(_data: pd.DataFrame) -> pd.DataFrame:
+    #removing leading and trailing spaces from the column names and from the categorical values
+    _data.columns = [col.strip() for col in _data.columns]
+    if config.TARGET in _data.columns and pd.api.types.is_string_dtype(_data[config.TARGET].dtype):
+        _data[config.TARGET] = _data[config.TARGET].astype('category')
+    for col in _data.columns:
+        if isinstance(_data[col].dtype, pd.CategoricalDtype):
+            _data[col] = strip_categorical_values(_data[col])
+    return _data
+
 #loading the dataset
+@instrumented('load_dataset')
 def load_dataset(file_name: str) -> pd.DataFrame:
     try:
         file_path = os.path.join(PACKAGE_ROOT,config.DATASET_DIR, file_name)
-        _data = pd.read_csv(file_path)
-        #removing leading and trailing spaces from the column names
-        _data.columns = [col.strip() for col in _data.columns]
+        _data = pd.read_csv(file_path, dtype=_csv_dtypes(file_path))
+        return _normalize_columns(_data)
+    except Exception as e:
+        raise CustomException(e,sys)
+
+#loading the dataset lazily in chunks, so files larger than memory can be processed chunk by chunk
+def load_dataset_in_chunks(file_name: str, chunk_size: int = config.CHUNK_SIZE, usecols: list = None):
+    try:
+        file_path = os.path.join(PACKAGE_ROOT,config.DATASET_DIR, file_name)
+        #raw csv headers carry leading spaces, so the requested columns are matched on the stripped names
+        columns_filter = None if usecols is None else (lambda col: col.strip() in usecols)
+        if file_path.endswith('.parquet'):
+            import pyarrow.parquet as pq
+            parquet_file = pq.ParquetFile(file_path)
+            columns = None if usecols is None else [col for col in parquet_file.schema_arrow.names if columns_filter(col)]
+            for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+                _data = batch.to_pandas()
+                _data = _data.astype({col: config.DATA_DTYPES[col.strip()] for col in _data.columns if col.strip() in config.DATA_DTYPES})
+                yield _normalize_columns(_data)
+        else:
+            for _data in pd.read_csv(file_path, chunksize=chunk_size, usecols=columns_filter, dtype=_csv_dtypes(file_path)):
+                yield _normalize_columns(_data)
+    except Exception as e:
+        raise CustomException(e,sys)
+
+#loading the dataset in slices that worker processes read on their own: line aligned byte ranges of about chunk_size
+#rows of a csv file (a record must not span lines, which holds for the application files) or row groups of a parquet file
+def dataset_slices(file_name: str, chunk_size: int = config.CHUNK_SIZE) -> list:
+    try:
+        file_path = os.path.join(PACKAGE_ROOT,config.DATASET_DIR, file_name)
+        if file_path.endswith('.parquet'):
+            import pyarrow.parquet as pq
+            return [('row_group', i) for i in range(pq.ParquetFile(file_path).num_row_groups)]
+        size = os.path.getsize(file_path)
+        with open(file_path, 'rb') as f:
+            f.readline()
+            bounds = [f.tell()]
+            #the row length is estimated from the first MB, the ranges are then cut at the next line end
+            sample = f.read(1 << 20)
+            step = max(1, len(sample) * chunk_size // max(1, sample.count(b'\n')))
+            while bounds[-1] + step < size:
+                f.seek(bounds[-1] + step)
+                f.readline()
+                if f.tell() >= size:
+                    break
+                bounds.append(f.tell())
+        bounds.append(size)
+        return [('bytes', start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+    except Exception as e:
+        raise CustomException(e,sys)
+
+def load_dataset_slice(file_name: str, dataset_slice: tuple, usecols: list = None) -> pd.DataFrame:
+    try:
+        file_path = os.path.join(PACKAGE_ROOT,config.DATASET_DIR, file_name)
+        columns_filter = None if usecols is None else (lambda col: col.strip() in usecols)
+        if dataset_slice[0] == 'row_group':
+            import pyarrow.parquet as pq
+            parquet_file = pq.ParquetFile(file_path)
+            columns = None if usecols is None else [col for col in parquet_file.schema_arrow.names if columns_filter(col)]
+            _data = parquet_file.read_row_group(dataset_slice[1], columns=columns).to_pandas()
+            _data = _data.astype({col: config.DATA_DTYPES[col.strip()] for col in _data.columns if col.strip() in config.DATA_DTYPES})
+            return _normalize_columns(_data)
+        _, start, end = dataset_slice
+        with open(file_path, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start)
+        header = list(pd.read_csv(file_path, nrows=0).columns)
+        _data = pd.read_csv(io.BytesIO(data), header=None, names=header, usecols=columns_filter, dtype=_csv_dtypes(file_path))
+        return _normalize_columns(_data)
+    except Exception as e:
+        raise CustomException(e,sys)
+
+#DATASET CACHE
+#the raw data and the train/test splits are kept as uncompressed arrow ipc files under config.DATASET_CACHE_DIR, keyed by
+#the hash of the source file and of the config values that shape them. Reading an entry memory-maps the file, numeric
+#columns are handed to pandas without copying and nothing is parsed from text, so floats round-trip exactly
+def dataset_cache_key(file_name: str) -> str:
+    try:
+        file_path = os.path.join(PACKAGE_ROOT,config.DATASET_DIR, file_name)
+        settings = {
+            'source_sha256': _file_sha256(file_path),
+            'columns_to_merge': config.COLUMNS_TO_MERGE,
+            'log_transformation': config.LOG_TRANSFORMATION,
+            'test_size': config.TEST_SIZE,
+            'data_dtypes': config.DATA_DTYPES,
+            'target': config.TARGET,
+            'target_positive_class': config.TARGET_POSITIVE_CLASS,
+            'cache_format': 2, #entries of format 1 did not keep the row index
+        }
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    except Exception as e:
+        raise CustomException(e,sys)
+
+def _cache_path(file_name: str, kind: str, key: str) -> str:
+    return os.path.join(config.DATASET_CACHE_DIR, f"{Path(file_name).stem}.{kind}.{key}.arrow")
+
+def _write_cache_entry(df: pd.DataFrame, file_name: str, kind: str, key: str):
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    os.makedirs(config.DATASET_CACHE_DIR, exist_ok=True)
+    cache_path = _cache_path(file_name, kind, key)
+    #removing the entries of older versions of the same file, so the cache holds one entry per source and kind
+    prefix = f"{Path(file_name).stem}.{kind}."
+    for entry in os.listdir(config.DATASET_CACHE_DIR):
+        if entry.startswith(prefix) and entry.endswith('.arrow'):
+            os.remove(os.path.join(config.DATASET_CACHE_DIR, entry))
+    #written to a temporary file first, so a reader never memory-maps a half written entry
+    #the row index is kept (as metadata for a RangeIndex), the splits carry the row labels of the source file
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    feather.write_feather(pa.Table.from_pandas(df, preserve_index=None), tmp_path, compression='uncompressed')
+    os.replace(tmp_path, cache_path)
+
+def _read_cache_entry(file_name: str, kind: str, key: str):
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+    cache_path = _cache_path(file_name, kind, key)
+    if not os.path.exists(cache_path):
+        return None
+    table = ipc.open_file(pa.memory_map(cache_path, 'r')).read_all()
+    return table.to_pandas(split_blocks=True)
+
+#loading the raw dataset through the cache, the csv is only parsed when the file or the schema changed
+@instrumented('load_cached_dataset')
+def load_cached_dataset(file_name: str = config.DATA_FILE_NAME) -> pd.DataFrame:
+    try:
+        key = dataset_cache_key(file_name)
+        _data = _read_cache_entry(file_name, 'raw', key)
+        if _data is None:
+            _data = load_dataset(file_name)
+            _write_cache_entry(_data, file_name, 'raw', key)
         return _data
     except Exception as e:
         raise CustomException(e,sys)
+
+#loading the train/test splits of a raw dataset through the cache, returns X_train, X_test, y_train, y_test and
+#whether they came from the cache. On a miss the splits are made with EncodingTargetVariable and data_split_strategy
+@instrumented('load_cached_splits')
+def load_cached_splits(file_name: str = config.DATA_FILE_NAME) -> tuple:
+    try:
+        key = dataset_cache_key(file_name)
+        train_data = _read_cache_entry(file_name, 'train', key)
+        test_data = _read_cache_entry(file_name, 'test', key)
+        cache_hit = train_data is not None and test_data is not None
+        if cache_hit:
+            X_train, y_train = separate_data(train_data)
+            X_test, y_test = separate_data(test_data)
+        else:
+            #imported here to avoid a circular import, data_preprocessing imports this module
+            from prediction_model.processing.data_preprocessing import EncodingTargetVariable
+            X, y = separate_data(load_cached_dataset(file_name))
+            X_train, X_test, y_train, y_test = data_split_strategy(X, EncodingTargetVariable(y))
+            _write_cache_entry(pd.concat([X_train, y_train], axis=1), file_name, 'train', key)
+            _write_cache_entry(pd.concat([X_test, y_test], axis=1), file_name, 'test', key)
+        return X_train, X_test, y_train, y_test, cache_hit
+    except Exception as e:
+        raise CustomException(e,sys)
+
 #Creating matrix of features and dependent variable vector i.e. separating the features and target variable
 def separate_data(df: pd.DataFrame) -> tuple:
     try:
@@ -37,14 +230,18 @@ def separate_data(df: pd.DataFrame) -> tuple:
         raise CustomException(e,sys) 
     
 #splitting the dataset into training and testing set
+@instrumented('data_split_strategy')
 def data_split_strategy(X: pd.DataFrame, y: pd.Series) -> tuple:
     try:
+        #imported here so that inference-only callers of this module do not pay for importing sklearn
+        from sklearn.model_selection import train_test_split
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=config.TEST_SIZE,stratify=y, random_state=42)
         return X_train, X_test, y_train, y_test
     except Exception as e:
         raise CustomException(e,sys)
     
 #saving the model to the disk
+@instrumented('save_pipeline')
 def save_pipeline(pipeline_to_save):
     try:
         model_path = os.path.join(PACKAGE_ROOT,config.SAVE_MODEL_PATH,config.MODEL_NAME)
@@ -53,6 +250,7 @@ def save_pipeline(pipeline_to_save):
         raise CustomException(e,sys)
     
 #loading the model from the disk
+@instrumented('load_pipeline')
 def load_pipeline(saved_pipeline_name: str):
     try:
         model_path = os.path.join(PACKAGE_ROOT,config.SAVE_MODEL_PATH,saved_pipeline_name)
@@ -61,3 +259,71 @@ def load_pipeline(saved_pipeline_name: str):
     except Exception as e:
         raise CustomException(e,sys)
 
+#compact model artifact written next to the pickle: magic bytes, header length, JSON header, float64 coefficients
+#it is read with a plain file read + np.memmap, so short-lived scoring processes do not need to import sklearn
+MODEL_ARTIFACT_MAGIC = b'LOANMDL1'
+
+def model_artifact_name(model_name: str) -> str:
+    return os.path.splitext(model_name)[0] + config.MODEL_ARTIFACT_SUFFIX
+
+def _file_sha256(file_path: str) -> str:
+    #hashing in blocks so large dataset files are not read into memory at once
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+#saving the fitted model parameters (see batch_prediction.extract_model_parameters) as a compact artifact
+def save_model_artifact(model_parameters: dict, model_name: str = config.MODEL_NAME):
+    try:
+        model_path = os.path.join(PACKAGE_ROOT,config.SAVE_MODEL_PATH,model_name)
+        artifact_path = os.path.join(PACKAGE_ROOT,config.SAVE_MODEL_PATH,model_artifact_name(model_name))
+        coef = np.ascontiguousarray(model_parameters['coef'], dtype='<f8')
+        header = {
+            'format_version': 1,
+            'columns': [[feature, category] for feature, category in model_parameters['columns']],
+            'intercept': model_parameters['intercept'],
+            'classes': np.asarray(model_parameters['classes']).tolist(),
+            'n_coef': len(coef),
+            #hash of the pickle the artifact was exported from, a stale artifact is ignored by load_model_artifact
+            'source_sha256': _file_sha256(model_path) if os.path.exists(model_path) else None,
+        }
+        header_bytes = json.dumps(header).encode('utf-8')
+        #padding the header so the coefficients start on an 8 byte boundary
+        header_bytes += b' ' * (-(len(MODEL_ARTIFACT_MAGIC) + 4 + len(header_bytes)) % 8)
+        #written to a temporary file first, so a process reloading the model never reads a half written artifact
+        tmp_path = f"{artifact_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(MODEL_ARTIFACT_MAGIC)
+            f.write(struct.pack('<I', len(header_bytes)))
+            f.write(header_bytes)
+            f.write(coef.tobytes())
+        os.replace(tmp_path, artifact_path)
+        return artifact_path
+    except Exception as e:
+        raise CustomException(e,sys)
+
+#loading the compact artifact, returns None when it does not exist or no longer matches the pickle
+def load_model_artifact(model_name: str = config.MODEL_NAME, check_source: bool = True):
+    try:
+        model_path = os.path.join(PACKAGE_ROOT,config.SAVE_MODEL_PATH,model_name)
+        artifact_path = os.path.join(PACKAGE_ROOT,config.SAVE_MODEL_PATH,model_artifact_name(model_name))
+        if not os.path.exists(artifact_path):
+            return None
+        with open(artifact_path, 'rb') as f:
+            if f.read(len(MODEL_ARTIFACT_MAGIC)) != MODEL_ARTIFACT_MAGIC:
+                raise ValueError(f"{artifact_path} is not a model artifact")
+            (header_length,) = struct.unpack('<I', f.read(4))
+            header = json.loads(f.read(header_length))
+        if check_source and os.path.exists(model_path) and header['source_sha256'] != _file_sha256(model_path):
+            return None
+        coef = np.memmap(artifact_path, dtype='<f8', mode='r', offset=len(MODEL_ARTIFACT_MAGIC) + 4 + header_length, shape=(header['n_coef'],))
+        return {
+            'columns': [(feature, category) for feature, category in header['columns']],
+            'coef': coef,
+            'intercept': header['intercept'],
+            'classes': np.asarray(header['classes']),
+        }
+    except Exception as e:
+        raise CustomException(e,sys)
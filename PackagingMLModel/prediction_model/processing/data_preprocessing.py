@@ -11,15 +11,29 @@ from prediction_model.config import config
 from logger import logging
 from exception import CustomException
 from sklearn.preprocessing import OneHotEncoder
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.utils.validation import check_is_fitted
+from prediction_model.processing.data_handling import strip_categorical_values
+from prediction_model.instrumentation import instrumented
 
+def _sum_columns(df: pd.DataFrame, columns: list) -> np.ndarray:
+    #summing in at least int64, the compact int32 columns from load_dataset could overflow otherwise
+    total = df[columns[0]].to_numpy()
+    total = total.astype(np.promote_types(total.dtype, np.int64))
+    for col in columns[1:]:
+        total = total + df[col].to_numpy()
+    return total
+
+@instrumented('CreateCustomColumns')
 def CreateCustomColumns(df: pd.DataFrame) -> pd.DataFrame:
     try:
-        df[config.CUSTOM_COLUMN_NAME] = df[config.COLUMNS_TO_MERGE[0]] + df[config.COLUMNS_TO_MERGE[1]] + df[config.COLUMNS_TO_MERGE[2]] + df[config.COLUMNS_TO_MERGE[3]]
+        df[config.CUSTOM_COLUMN_NAME] = _sum_columns(df, config.COLUMNS_TO_MERGE)
         logging.info(f"New column {config.CUSTOM_COLUMN_NAME} created successfully")
         return df
     except Exception as e:
         raise CustomException(e,sys)
     
+@instrumented('ColumnsToDrop')
 def ColumnsToDrop(df: pd.DataFrame) -> pd.DataFrame:
     try:
         df.drop(config.COLUMNS_TO_DROP, axis=1,inplace=True)
@@ -29,24 +43,97 @@ def ColumnsToDrop(df: pd.DataFrame) -> pd.DataFrame:
     
 def EncodingTarget(text: str) -> int:
     try:
-        if text == ' Approved':
+        if str(text).strip() == config.TARGET_POSITIVE_CLASS:
             return 1
         else:
             return 0
     except Exception as e:
         raise CustomException(e,sys)
     
+@instrumented('EncodingTargetVariable')
 def EncodingTargetVariable(y: pd.Series) -> pd.Series:
     try:
-        # Map the categorical values to numeric values
-        y_encoded = y.map(EncodingTarget)
-        return y_encoded
+        # Map the categorical values to numeric values with one vectorized comparison,
+        # for a categorical target the comparison runs on the categories and the codes are looked up
+        if isinstance(y.dtype, pd.CategoricalDtype):
+            positive = np.flatnonzero(y.cat.categories.astype(str).str.strip() == config.TARGET_POSITIVE_CLASS)
+            y_encoded = np.isin(y.cat.codes.to_numpy(), positive)
+        else:
+            y_encoded = np.asarray(strip_categorical_values(y.astype(str)) == config.TARGET_POSITIVE_CLASS)
+        return pd.Series(y_encoded.astype(np.int64), index=y.index, name=y.name)
     except Exception as e:
         raise CustomException(e, sys)
     
+@instrumented('TransformingNumericFeatures')
 def TransformingNumericFeatures(df: pd.DataFrame) -> pd.DataFrame:
     try:
         df[config.LOG_TRANSFORMATION] = np.log1p(df[config.LOG_TRANSFORMATION])
         return df
     except Exception as e:
-        raise CustomException(e,sys)
\ No newline at end of file
+        raise CustomException(e,sys)
+
+#the same steps as sklearn transformers, so they can run inside pipeline.py's classification_pipeline
+#they never mutate their input: new columns are attached with assign/drop, which do not copy the untouched
+#columns under pandas copy-on-write. NumPy input is accepted as well, using the column order seen in fit
+
+class _DataFrameStage(TransformerMixin, BaseEstimator):
+    def fit(self, X, y=None):
+        if not isinstance(X, pd.DataFrame):
+            raise ValueError(f"{type(self).__name__} must be fitted on a DataFrame with named columns")
+        self.feature_names_in_ = np.asarray(X.columns, dtype=object)
+        self.n_features_in_ = len(self.feature_names_in_)
+        return self
+
+    def _as_frame(self, X) -> pd.DataFrame:
+        check_is_fitted(self, 'feature_names_in_')
+        if isinstance(X, pd.DataFrame):
+            return X
+        return pd.DataFrame(X, columns=self.feature_names_in_, copy=False)
+
+class CategoricalValuesStripper(_DataFrameStage):
+    def __init__(self, columns: list = config.CATEGORICAL_FEATURES_TO_ENCODE):
+        self.columns = columns
+
+    def transform(self, X):
+        #raw applications may still carry the leading space of the raw csv (' Graduate')
+        X = self._as_frame(X)
+        return X.assign(**{col: strip_categorical_values(X[col]) for col in self.columns if col in X.columns})
+
+    def get_feature_names_out(self, input_features=None):
+        return np.asarray(self.feature_names_in_, dtype=object)
+
+class CustomColumnsCreator(_DataFrameStage):
+    def __init__(self, columns_to_merge: list = config.COLUMNS_TO_MERGE, new_column: str = config.CUSTOM_COLUMN_NAME):
+        self.columns_to_merge = columns_to_merge
+        self.new_column = new_column
+
+    def transform(self, X):
+        X = self._as_frame(X)
+        return X.assign(**{self.new_column: _sum_columns(X, self.columns_to_merge)})
+
+    def get_feature_names_out(self, input_features=None):
+        if self.new_column in self.feature_names_in_:
+            return np.asarray(self.feature_names_in_, dtype=object)
+        return np.asarray(list(self.feature_names_in_) + [self.new_column], dtype=object)
+
+class ColumnsDropper(_DataFrameStage):
+    def __init__(self, columns_to_drop: list = config.COLUMNS_TO_DROP):
+        self.columns_to_drop = columns_to_drop
+
+    def transform(self, X):
+        #missing columns are ignored, e.g. loan_id is not always sent at scoring time
+        return self._as_frame(X).drop(columns=self.columns_to_drop, errors='ignore')
+
+    def get_feature_names_out(self, input_features=None):
+        return np.asarray([col for col in self.feature_names_in_ if col not in self.columns_to_drop], dtype=object)
+
+class NumericFeaturesLogTransformer(_DataFrameStage):
+    def __init__(self, columns: list = config.LOG_TRANSFORMATION):
+        self.columns = columns
+
+    def transform(self, X):
+        X = self._as_frame(X)
+        return X.assign(**{col: np.log1p(X[col].to_numpy(dtype=np.float64)) for col in self.columns})
+
+    def get_feature_names_out(self, input_features=None):
+        return np.asarray(self.feature_names_in_, dtype=object)
@@ -0,0 +1,106 @@
+import os
+import sys
+import time
+import argparse
+from pathlib import Path
+import pandas as pd
+
+PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
+sys.path.append(str(PACKAGE_ROOT))
+
+from prediction_model.config import config
+from logger import logging
+from exception import CustomException
+from prediction_model.processing.data_handling import load_dataset_in_chunks
+from prediction_model.batch_prediction import predict_batch, get_model_parameters, raw_features_needed
+from prediction_model.parallel_scoring import score_file_parallel
+
+#streaming batch scoring of application files that do not fit in memory
+#the input is read chunk by chunk, each chunk is scored and appended to the output file before the next one is read
+
+def peak_rss_mb() -> float:
+    #peak resident set size of the current process, None where the resource module is not available (windows)
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is reported in bytes on macOS and in kilobytes on linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+class PredictionWriter:
+    #appends scored chunks to a csv or parquet file, the format is picked from the output file extension
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        self.is_parquet = output_path.endswith('.parquet')
+        self._parquet_writer = None
+        self._header_written = False
+
+    def write(self, chunk: pd.DataFrame):
+        if self.is_parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(self.output_path, table.schema)
+            self._parquet_writer.write_table(table)
+        else:
+            chunk.to_csv(self.output_path, mode='a' if self._header_written else 'w', header=not self._header_written, index=False)
+            self._header_written = True
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+
+def score_chunk(chunk: pd.DataFrame, id_column: str = None) -> pd.DataFrame:
+    y_pred, y_proba = predict_batch(chunk, return_proba=True)
+    scored = pd.DataFrame({'prediction': y_pred, 'probability': y_proba})
+    if id_column is not None and id_column in chunk.columns:
+        scored.insert(0, id_column, chunk[id_column].to_numpy())
+    return scored
+
+def score_file(input_path: str, output_path: str, chunk_size: int = config.CHUNK_SIZE, id_column: str = 'loan_id', workers: int = 1) -> dict:
+    """
+    Scores a raw application file (csv or parquet) chunk by chunk and writes predictions and probabilities
+    incrementally to output_path (csv or parquet), so memory use does not grow with the file size.
+    With workers > 1 slices of the file are parsed and scored on a process pool and written back in input order.
+    """
+    try:
+        start = time.perf_counter()
+        writer = PredictionWriter(output_path)
+        rows = 0
+        if workers > 1:
+            #the workers read and parse their own slices of the file
+            scored_chunks = score_file_parallel(input_path, chunk_size, workers, id_column)
+        else:
+            usecols = raw_features_needed(get_model_parameters()) + ([id_column] if id_column else [])
+            chunks = load_dataset_in_chunks(input_path, chunk_size, usecols=usecols)
+            scored_chunks = (score_chunk(chunk, id_column) for chunk in chunks)
+        try:
+            for scored in scored_chunks:
+                writer.write(scored)
+                rows += len(scored)
+        finally:
+            writer.close()
+        elapsed = time.perf_counter() - start
+        summary = {'rows': rows, 'seconds': round(elapsed, 3), 'rows_per_s': round(rows / elapsed, 1) if elapsed > 0 else None,
+                   'peak_rss_mb': peak_rss_mb()}
+        logging.info(f"Scored {input_path} into {output_path}: {summary}")
+        return summary
+    except Exception as e:
+        raise CustomException(e,sys)
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog='score-file', description="Score a raw loan application file chunk by chunk")
+    parser.add_argument('input', help="input csv or parquet file with raw application columns")
+    parser.add_argument('output', help="output csv or parquet file for the predictions")
+    parser.add_argument('--chunk-size', type=int, default=config.CHUNK_SIZE)
+    parser.add_argument('--id-column', default='loan_id', help="input column copied to the output to identify rows")
+    parser.add_argument('--workers', type=int, default=1, help=f"worker processes, e.g. {config.SCORING_WORKERS} to use every core")
+    args = parser.parse_args(argv)
+    summary = score_file(os.path.abspath(args.input), os.path.abspath(args.output), args.chunk_size, args.id_column, args.workers)
+    peak_rss = 'n/a' if summary['peak_rss_mb'] is None else f"{summary['peak_rss_mb']:.1f} MB"
+    print(f"Scored {summary['rows']} rows in {summary['seconds']}s ({summary['rows_per_s']} rows/s), peak RSS {peak_rss}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import os
+import sys
+import math
+from pathlib import Path
+import numpy as np
+
+PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
+sys.path.append(str(PACKAGE_ROOT))
+
+from prediction_model.config import config
+from logger import logging
+from exception import CustomException
+from prediction_model.processing.data_handling import strip_categorical_values
+from prediction_model.batch_prediction import extract_model_parameters, load_model_parameters, build_feature_matrix, records_to_columns, raw_features_needed, check_feature_matrix
+
+#low latency scoring of single applications
+#the fitted OneHotEncoder categories and LogisticRegression weights are compiled into plain python tuples once,
+#so scoring one dict is a handful of comparisons and multiplications instead of a pandas + sklearn round trip
+
+def _sigmoid(z: float) -> float:
+    #numerically stable logistic function, math.exp overflows for large negative z
+    if z >= 0:
+        return 1.0 / (1.0 + math.exp(-z))
+    e = math.exp(z)
+    return e / (1.0 + e)
+
+class CompiledScorer:
+    def __init__(self, model_parameters: dict):
+        self.model_parameters = model_parameters
+        self.intercept = model_parameters['intercept']
+        self.classes = model_parameters['classes']
+        self.negative_class, self.positive_class = self.classes.tolist()
+        #(feature, category, weight) for one-hot columns, (feature, weight) for numeric columns
+        self.categorical_terms = tuple((feature, category, float(weight)) for (feature, category), weight in zip(model_parameters['columns'], model_parameters['coef']) if category is not None)
+        self.numeric_terms = tuple((feature, float(weight)) for (feature, category), weight in zip(model_parameters['columns'], model_parameters['coef']) if category is None)
+
+    @classmethod
+    def from_pipeline(cls, pipeline):
+        return cls(extract_model_parameters(pipeline))
+
+    @classmethod
+    def from_saved_model(cls, model_name: str = config.MODEL_NAME):
+        try:
+            scorer = cls(load_model_parameters(model_name))
+            logging.info(f"Compiled scorer built from {model_name}")
+            return scorer
+        except Exception as e:
+            raise CustomException(e,sys)
+
+    def _raw_value(self, record: dict, feature: str) -> float:
+        #applies CreateCustomColumns and TransformingNumericFeatures to a single raw value
+        if feature == config.CUSTOM_COLUMN_NAME:
+            value = sum(record[col] for col in config.COLUMNS_TO_MERGE)
+        else:
+            value = record[feature]
+        return math.log1p(value) if feature in config.LOG_TRANSFORMATION else value
+
+    def decision_function_one(self, record: dict, raw: bool = False) -> float:
+        """
+        Log-odds of approval for one application. By default the record holds the preprocessed columns the
+        ColumnTransformer sees, with raw=True it holds the raw application columns (as in train.csv/test.csv).
+        """
+        try:
+            z = self.intercept
+            for feature, category, weight in self.categorical_terms:
+                value = record[feature]
+                if value == category or (isinstance(value, str) and value.strip() == category):
+                    z += weight
+            for feature, weight in self.numeric_terms:
+                try:
+                    value = float(self._raw_value(record, feature) if raw else record[feature])
+                except (TypeError, ValueError):
+                    value = math.nan #None, strings and log1p of values below -1
+                if not math.isfinite(value):
+                    raise ValueError(f"{feature} is missing or not a finite number, the application cannot be scored")
+                z += weight * value
+            return z
+        except Exception as e:
+            raise CustomException(e,sys)
+
+    def predict_proba_one(self, record: dict, raw: bool = False) -> float:
+        #probability of the positive class (loan approved)
+        return _sigmoid(self.decision_function_one(record, raw))
+
+    def predict_one(self, record: dict, raw: bool = False):
+        return self.positive_class if self.decision_function_one(record, raw) > 0 else self.negative_class
+
+    def decision_function(self, X, raw: bool = False) -> np.ndarray:
+        #batch version, X is a DataFrame or a dict of NumPy arrays
+        try:
+            if raw:
+                raw_columns = records_to_columns(X, raw_features_needed(self.model_parameters))
+                X_matrix = build_feature_matrix(raw_columns, self.model_parameters)
+                check_feature_matrix(X_matrix)
+                return X_matrix @ self.model_parameters['coef'] + self.intercept
+            scores = np.full(len(X[self.model_parameters['columns'][0][0]]), self.intercept, dtype=np.float64)
+            for feature, category, weight in self.categorical_terms:
+                scores += weight * np.asarray(strip_categorical_values(X[feature]) == category)
+            for feature, weight in self.numeric_terms:
+                scores += weight * np.asarray(X[feature], dtype=np.float64)
+            check_feature_matrix(scores[:, None]) #a NaN or inf numeric input leaves a non finite score on its row
+            return scores
+        except Exception as e:
+            raise CustomException(e,sys)
+
+    def predict_proba(self, X, raw: bool = False) -> np.ndarray:
+        return 1.0 / (1.0 + np.exp(-self.decision_function(X, raw)))
+
+    def predict(self, X, raw: bool = False) -> np.ndarray:
+        return self.classes[(self.decision_function(X, raw) > 0).astype(np.intp)]
@@ -0,0 +1,261 @@
+import os
+import sys
+import time
+import queue
+import socket
+import argparse
+import threading
+import multiprocessing
+import numpy as np
+from concurrent.futures import Future
+from pathlib import Path
+from flask import Flask, Response, request, jsonify
+from werkzeug.serving import make_server
+
+PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
+sys.path.append(str(PACKAGE_ROOT))
+
+from prediction_model.config import config
+from logger import logging
+from prediction_model.batch_prediction import predict_batch
+from prediction_model.prediction_cache import CachedPredictor
+from prediction_model.model_registry import ModelRegistry, check_registered_version
+from prediction_model.instrumentation import stage, prometheus_text
+from prediction_model.validation import validate_batch
+from prediction_model.drift_monitor import DriftMonitor, load_reference_profile
+
+#HTTP prediction server
+#single /predict requests arriving at the same time are gathered into micro-batches and scored with one
+#predict_batch call, /predict/batch scores the posted list directly. With config.PREDICTION_CACHE_ENABLED both go
+#through a CachedPredictor, so applications submitted again are answered from the cache.
+#Each worker scores with a ModelRegistry that reloads the saved model in the background when a new one is saved
+#(every config.MODEL_RELOAD_INTERVAL_S), so rolling out a retrained model needs no restart.
+#Both endpoints validate the applications before scoring them (every micro-batch is validated at once): /predict
+#answers an invalid application with the failed checks, /predict/batch gives invalid ones null predictions and
+#their reasons in "errors". Internal errors are logged, the response only says the request could not be served
+#With config.DRIFT_MONITOR_ENABLED the scored batches are counted by a DriftMonitor on a background thread, against the
+#reference profile of the active model version, and /drift reports the drift of this worker's traffic
+
+def _predict_uncached(records: list) -> tuple:
+    return predict_batch(records, return_proba=True)
+
+class InvalidApplication(ValueError):
+    #an application that failed validation, the message lists the failed checks
+    def __init__(self, reasons: list):
+        super().__init__("; ".join(reasons))
+        self.reasons = reasons
+
+class MicroBatcher:
+    def __init__(self, max_batch_size: int = config.MAX_BATCH_SIZE, max_wait_ms: float = config.MAX_WAIT_MS, score=_predict_uncached,
+                 validate: bool = True):
+        #score takes a list of application dicts and returns (predictions, probabilities)
+        self.score = score
+        self.validate = validate
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, record: dict) -> Future:
+        future = Future()
+        self._queue.put((record, future))
+        return future
+
+    def _collect(self) -> list:
+        #blocks for the first request, then waits at most max_wait for the batch to fill up
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _score(self, batch: list):
+        try:
+            with stage('serve.micro_batch', len(batch)):
+                if self.validate:
+                    #invalid applications fail their own request, the rest of the batch is scored
+                    validation = validate_batch([record for record, _ in batch])
+                    for row in np.flatnonzero(~validation.valid).tolist():
+                        batch[row][1].set_exception(InvalidApplication(validation.reasons(row)))
+                    if validation.n_invalid:
+                        batch = [batch[row] for row in np.flatnonzero(validation.valid).tolist()]
+                if not batch:
+                    return
+                y_pred, y_proba = self.score([record for record, _ in batch])
+            for (_, future), pred, proba in zip(batch, y_pred.tolist(), y_proba.tolist()):
+                future.set_result((pred, proba))
+        except Exception:
+            #one record failing to score must not fail the requests it was batched with
+            for record, future in batch:
+                if future.done():
+                    continue
+                try:
+                    y_pred, y_proba = self.score([record])
+                    future.set_result((y_pred.tolist()[0], y_proba.tolist()[0]))
+                except Exception as e:
+                    future.set_exception(e)
+
+    def _run(self):
+        while True:
+            self._score(self._collect())
+
+def create_app(max_batch_size: int = config.MAX_BATCH_SIZE, max_wait_ms: float = config.MAX_WAIT_MS,
+               cache: bool = config.PREDICTION_CACHE_ENABLED, reload_interval_s: float = config.MODEL_RELOAD_INTERVAL_S,
+               drift: bool = config.DRIFT_MONITOR_ENABLED) -> Flask:
+    app = Flask(__name__)
+    #loading the model once per worker, before the first request, later versions are loaded in the background
+    registry = ModelRegistry()
+    registry.start_watching(reload_interval_s)
+    predictor = CachedPredictor(registry=registry) if cache else None
+    score = predictor.predict if cache else registry.predict
+    monitor = None
+    if drift:
+        active = registry.active
+        monitor = DriftMonitor(load_reference_profile(active.model_name), active.version)
+        score_only = score
+        def score(records: list) -> tuple:
+            y_pred, y_proba = score_only(records)
+            active = registry.active
+            if active.version != monitor.version:
+                #counting starts over against the profile of the model loaded in the meantime
+                monitor.set_reference(load_reference_profile(active.model_name), active.version)
+            monitor.submit(records, y_proba)
+            return y_pred, y_proba
+    batcher = MicroBatcher(max_batch_size, max_wait_ms, score)
+    logging.info(f"Prediction server ready in process {os.getpid()}")
+
+    @app.get("/health")
+    def health():
+        return jsonify({"status": "ok"})
+
+    @app.get("/cache/stats")
+    def cache_stats():
+        if predictor is None:
+            return jsonify({"error": "Prediction cache is disabled"}), 404
+        return jsonify(predictor.stats())
+
+    #stage timings of this worker in the Prometheus text format, empty unless PREDICTION_MODEL_INSTRUMENTATION=1
+    @app.get("/metrics")
+    def metrics():
+        return Response(prometheus_text(), mimetype="text/plain; version=0.0.4")
+
+    #feature and score drift of the traffic this worker scored since its model version was loaded
+    @app.get("/drift")
+    def drift_report():
+        if monitor is None:
+            return jsonify({"error": "Drift monitoring is disabled"}), 404
+        return jsonify(monitor.report())
+
+    #model versions of this worker, shadow scoring is started per worker process
+    @app.get("/model")
+    def model_status():
+        return jsonify(registry.status())
+
+    @app.post("/model/shadow")
+    def start_shadow():
+        body = request.get_json(silent=True) or {}
+        if not isinstance(body.get("version"), str):
+            return jsonify({"error": "Request body must be a JSON object with the registered version to shadow"}), 400
+        try:
+            check_registered_version(body["version"])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        try:
+            registry.start_shadow(body["version"], float(body.get("sample_rate", config.SHADOW_SAMPLE_RATE))).result()
+        except Exception:
+            logging.exception(f"Starting shadow scoring with version {body['version']} failed")
+            return jsonify({"error": f"Version {body['version']} could not be loaded for shadow scoring"}), 400
+        return jsonify(registry.status())
+
+    @app.delete("/model/shadow")
+    def stop_shadow():
+        return jsonify({"shadow": registry.stop_shadow()})
+
+    @app.post("/predict")
+    def predict():
+        record = request.get_json(silent=True)
+        if not isinstance(record, dict):
+            return jsonify({"error": "Request body must be a JSON object with the application fields"}), 400
+        try:
+            prediction, probability = batcher.submit(record).result()
+        except InvalidApplication as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception:
+            logging.exception("Scoring a /predict request failed")
+            return jsonify({"error": "The application could not be scored"}), 500
+        return jsonify({"prediction": prediction, "probability": probability})
+
+    @app.post("/predict/batch")
+    def predict_many():
+        records = request.get_json(silent=True)
+        if isinstance(records, dict):
+            records = records.get("records")
+        if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+            return jsonify({"error": "Request body must be a JSON list of application objects"}), 400
+        try:
+            with stage('serve.batch', len(records)):
+                validation = validate_batch(records)
+                valid_rows = np.flatnonzero(validation.valid)
+                if len(valid_rows):
+                    y_pred, y_proba = score([records[row] for row in valid_rows] if validation.n_invalid else records)
+                else:
+                    y_pred = y_proba = np.empty(0)
+        except Exception:
+            logging.exception("Scoring a /predict/batch request failed")
+            return jsonify({"error": "The applications could not be scored"}), 500
+        predictions, probabilities = [None] * len(records), [None] * len(records)
+        for row, pred, proba in zip(valid_rows.tolist(), y_pred.tolist(), y_proba.tolist()):
+            predictions[row], probabilities[row] = pred, proba
+        return jsonify({"predictions": predictions, "probabilities": probabilities, "errors": validation.error_report()})
+
+    return app
+
+def _serve_worker(host: str, port: int, fd: int, max_batch_size: int, max_wait_ms: float):
+    app = create_app(max_batch_size, max_wait_ms)
+    make_server(host, port, app, threaded=True, fd=fd).serve_forever()
+
+def run_server(host: str = config.SERVE_HOST, port: int = config.SERVE_PORT, workers: int = config.SERVE_WORKERS,
+               max_batch_size: int = config.MAX_BATCH_SIZE, max_wait_ms: float = config.MAX_WAIT_MS):
+    """
+    Starts the prediction server. With more than one worker the listening socket is bound once and shared by
+    forked worker processes, the kernel spreads incoming connections between them.
+    """
+    if workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        app = create_app(max_batch_size, max_wait_ms)
+        logging.info(f"Serving predictions on http://{host}:{port}")
+        make_server(host, port, app, threaded=True).serve_forever()
+        return
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_serve_worker, args=(host, port, sock.fileno(), max_batch_size, max_wait_ms), daemon=True)
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    logging.info(f"Serving predictions on http://{host}:{port} with {workers} workers")
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+    finally:
+        sock.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Loan approval prediction server")
+    parser.add_argument("--host", default=config.SERVE_HOST)
+    parser.add_argument("--port", type=int, default=config.SERVE_PORT)
+    parser.add_argument("--workers", type=int, default=config.SERVE_WORKERS)
+    parser.add_argument("--max-batch-size", type=int, default=config.MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=config.MAX_WAIT_MS)
+    args = parser.parse_args()
+    run_server(args.host, args.port, args.workers, args.max_batch_size, args.max_wait_ms)
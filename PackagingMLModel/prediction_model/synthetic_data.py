@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
+sys.path.append(str(PACKAGE_ROOT))
+
+from prediction_model.config import config
+from logger import logging
+from exception import CustomException
+
+#synthetic loan applications in the raw schema of loan_approval_dataset.csv, for benchmarks on more rows than we have
+#a profile is fitted on the shipped dataset: the loan_status frequencies and, for each status, the category frequencies
+#and a quantile table of every numeric column. Rows are drawn status first, then every column by inverse transform
+#sampling of its quantile table, rounded to the column's granularity (e.g. amounts are multiples of 100000).
+#Columns are drawn independently given the status, so the marginals and the status signal of each column are kept
+#but not the correlations between columns. Files are written chunk by chunk, memory does not grow with the row count
+
+def _raw_frame(file_name: str) -> pd.DataFrame:
+    #read as in the file, the header names and categorical values keep their leading spaces
+    file_path = os.path.join(PACKAGE_ROOT,config.DATASET_DIR, file_name)
+    return pd.read_csv(file_path)
+
+def fit_profile(file_name: str = config.DATA_FILE_NAME, n_quantiles: int = config.SYNTHETIC_QUANTILES) -> dict:
+    try:
+        df = _raw_frame(file_name)
+        names = {col.strip(): col for col in df.columns}
+        target = names[config.TARGET]
+        categorical = [names[col] for col in config.CATEGORICAL_FEATURES_TO_ENCODE]
+        numeric = [col for col in df.columns if col not in categorical and col != target and col.strip() != 'loan_id']
+        probabilities = np.linspace(0.0, 1.0, n_quantiles)
+        classes = {}
+        for label, group in df.groupby(target, sort=True):
+            classes[label] = {
+                'categorical': {col: group[col].value_counts(normalize=True).sort_index().to_dict() for col in categorical},
+                'numeric': {col: {'quantiles': np.quantile(group[col].to_numpy(dtype=np.float64), probabilities).tolist(),
+                                  'step': int(np.gcd.reduce(np.abs(group[col].to_numpy(dtype=np.int64)))) or 1}
+                            for col in numeric},
+            }
+        profile = {
+            'source': file_name,
+            'rows': len(df),
+            'columns': list(df.columns),
+            'target': target,
+            'class_frequencies': df[target].value_counts(normalize=True).sort_index().to_dict(),
+            'classes': classes,
+        }
+        logging.info(f"Synthetic data profile fitted on {len(df)} rows of {file_name}")
+        return profile
+    except Exception as e:
+        raise CustomException(e,sys)
+
+def generate_chunk(profile: dict, n_rows: int, rng, first_loan_id: int = 1) -> pd.DataFrame:
+    #categorical columns are drawn as category codes, so no per-row python objects are created
+    try:
+        labels = list(profile['class_frequencies'])
+        label_codes = rng.choice(len(labels), size=n_rows, p=list(profile['class_frequencies'].values())).astype(np.int8)
+        class_rows = [np.flatnonzero(label_codes == i) for i in range(len(labels))]
+        columns = {}
+        for col in profile['columns']:
+            if col.strip() == 'loan_id':
+                columns[col] = np.arange(first_loan_id, first_loan_id + n_rows, dtype=np.int64)
+            elif col == profile['target']:
+                columns[col] = pd.Categorical.from_codes(label_codes, labels)
+            elif col in profile['classes'][labels[0]]['numeric']:
+                values = np.empty(n_rows, dtype=np.int64)
+                for label, rows in zip(labels, class_rows):
+                    table = profile['classes'][label]['numeric'][col]
+                    quantiles = np.asarray(table['quantiles'])
+                    #the quantiles are evenly spaced in probability, so the interpolation needs no search
+                    position = rng.random(len(rows)) * (len(quantiles) - 1)
+                    index = position.astype(np.intp)
+                    upper = np.minimum(index + 1, len(quantiles) - 1)
+                    sampled = quantiles[index] + (position - index) * (quantiles[upper] - quantiles[index])
+                    values[rows] = np.round(sampled / table['step']).astype(np.int64) * table['step']
+                columns[col] = values
+            else:
+                categories = sorted(set().union(*(profile['classes'][label]['categorical'][col] for label in labels)))
+                codes = np.empty(n_rows, dtype=np.int8)
+                for label, rows in zip(labels, class_rows):
+                    frequencies = profile['classes'][label]['categorical'][col]
+                    category_codes = np.array([categories.index(value) for value in frequencies], dtype=np.int8)
+                    codes[rows] = category_codes[rng.choice(len(frequencies), size=len(rows), p=list(frequencies.values()))]
+                columns[col] = pd.Categorical.from_codes(codes, categories)
+        return pd.DataFrame(columns)
+    except Exception as e:
+        raise CustomException(e,sys)
+
+def write_synthetic_dataset(output_path: str, n_rows: int, profile: dict = None, seed: int = 42,
+                            chunk_size: int = config.SYNTHETIC_CHUNK_SIZE) -> str:
+    """
+    Writes n_rows synthetic applications to output_path, a .csv in the raw layout of the shipped dataset or a
+    .parquet file, generating and writing chunk_size rows at a time. The same seed gives the same file.
+    """
+    try:
+        profile = profile or fit_profile()
+        rng = np.random.default_rng(seed)
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        writer = None
+        try:
+            for start in range(0, n_rows, chunk_size):
+                chunk = generate_chunk(profile, min(chunk_size, n_rows - start), rng, first_loan_id=start + 1)
+                if output_path.endswith('.parquet'):
+                    import pyarrow as pa
+                    import pyarrow.parquet as pq
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    if writer is None:
+                        writer = pq.ParquetWriter(output_path, table.schema)
+                    writer.write_table(table)
+                else:
+                    #pyarrow's csv writer is several times faster than to_csv, the header is written as in the raw
+                    #file (pyarrow would quote it) and values are not quoted, so ' Graduate' keeps its raw form
+                    import pyarrow as pa
+                    import pyarrow.csv as pa_csv
+                    with open(output_path, 'ab' if start else 'wb') as f:
+                        if not start:
+                            f.write((','.join(chunk.columns) + '\n').encode('utf-8'))
+                        pa_csv.write_csv(pa.Table.from_pandas(chunk, preserve_index=False), f,
+                                         pa_csv.WriteOptions(include_header=False, quoting_style='none'))
+        finally:
+            if writer is not None:
+                writer.close()
+        logging.info(f"{n_rows} synthetic rows written to {output_path}")
+        return output_path
+    except Exception as e:
+        raise CustomException(e,sys)
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Generate synthetic loan applications in the raw dataset schema")
+    parser.add_argument('output', help="output .csv or .parquet file")
+    parser.add_argument('--rows', type=int, default=10_000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chunk-size', type=int, default=config.SYNTHETIC_CHUNK_SIZE)
+    parser.add_argument('--profile', help="profile JSON to use instead of fitting one on the shipped dataset")
+    parser.add_argument('--save-profile', help="write the fitted profile to this JSON file")
+    args = parser.parse_args(argv)
+    if args.profile:
+        with open(args.profile) as f:
+            profile = json.load(f)
+    else:
+        profile = fit_profile()
+    if args.save_profile:
+        with open(args.save_profile, 'w') as f:
+            json.dump(profile, f, indent=2)
+    print(write_synthetic_dataset(args.output, args.rows, profile, args.seed, args.chunk_size))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import urllib.request
+from contextlib import contextmanager
+from pathlib import Path
+
+PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
+sys.path.append(str(PACKAGE_ROOT))
+
+from prediction_model.config import config
+from logger import logging
+from exception import CustomException
+from prediction_model.processing.data_handling import _file_sha256
+from prediction_model.instrumentation import stage
+
+#non-blocking experiment tracking on top of the MlflowClient API
+#params, metrics and tags are buffered and sent with log_batch from a background thread, artifacts, dataset inputs and
+#models are uploaded by the same thread, so the training and evaluation code never waits on the tracking server.
+#Artifacts are deduplicated by content hash: a file that was already uploaded (in this run or an earlier one) is
+#referenced with an 'artifact_ref.<name>' tag instead of being uploaded again.
+#When the tracking server does not answer its health check, runs are recorded in a local sqlite store under
+#config.MLFLOW_OFFLINE_DIR instead
+
+#mlflow limits, see mlflow.utils.validation
+MAX_PARAM_VAL_LENGTH = 6000
+MAX_PARAMS_TAGS_PER_BATCH = 100
+MAX_METRICS_PER_BATCH = 1000
+MAX_FLUSH_ATTEMPTS = 3
+
+def tracking_server_reachable(tracking_uri: str, timeout: float = config.TRACKING_CONNECT_TIMEOUT_S) -> bool:
+    #only http(s) servers are checked, local stores are always available
+    if not tracking_uri.startswith(('http://', 'https://')):
+        return True
+    try:
+        with urllib.request.urlopen(f"{tracking_uri.rstrip('/')}/health", timeout=timeout) as response:
+            return response.status == 200
+    except Exception:
+        return False
+
+def offline_tracking_uri(offline_dir: str = config.MLFLOW_OFFLINE_DIR) -> str:
+    return f"sqlite:///{os.path.join(offline_dir, 'mlflow.db')}"
+
+def _chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+class AsyncTracker:
+    """
+    Buffered MLflow tracking with a background flush thread. One run is active at a time, started with
+    `with tracker.start_run(run_name=...)`; the log_* methods only queue work and return immediately.
+    """
+    def __init__(self, tracking_uri: str = config.MLFLOW_TRACKING_URI, experiment_name: str = config.MLFLOW_EXPERIMENT_NAME,
+                 flush_interval_s: float = config.TRACKING_FLUSH_INTERVAL_S, offline_dir: str = config.MLFLOW_OFFLINE_DIR):
+        self.experiment_name = experiment_name
+        self.flush_interval_s = flush_interval_s
+        self.offline_dir = offline_dir
+        self.offline = not tracking_server_reachable(tracking_uri)
+        if self.offline:
+            logging.warning(f"Tracking server {tracking_uri} is unreachable, logging to the local store in {offline_dir}")
+        self.tracking_uri = offline_tracking_uri(offline_dir) if self.offline else tracking_uri
+        self.run_id = None
+        self.artifact_uri = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closing = False
+        self._status = 'FINISHED'
+        self._thread = None
+        self._reset_buffers()
+        atexit.register(self.end_run)
+
+    def _reset_buffers(self):
+        self._params = {}
+        self._tags = {}
+        self._metrics = []
+        self._uploads = []
+        self._flush_failures = 0
+        self._run_hashes = set()
+
+    #BUFFERING, called from the training and evaluation code
+    def set_tag(self, key: str, value):
+        with self._lock:
+            self._tags[key] = str(value)
+
+    def log_param(self, key: str, value):
+        with self._lock:
+            self._params[key] = str(value)[:MAX_PARAM_VAL_LENGTH]
+
+    def log_params(self, params: dict):
+        for key, value in params.items():
+            self.log_param(key, value)
+
+    def log_metric(self, key: str, value: float, step: int = 0):
+        with self._lock:
+            self._metrics.append((key, float(value), int(time.time() * 1000), step))
+
+    def log_metrics(self, metrics: dict, step: int = 0):
+        for key, value in metrics.items():
+            self.log_metric(key, value, step)
+
+    def log_artifact(self, local_path: str, artifact_path: str = None):
+        with self._lock:
+            self._uploads.append(('artifact', local_path, artifact_path))
+        self._wakeup.set()
+
+    def log_input(self, dataset, context: str = None):
+        #dataset is an mlflow dataset, e.g. from mlflow.data.from_pandas
+        with self._lock:
+            self._uploads.append(('input', dataset, context))
+        self._wakeup.set()
+
+    def log_model(self, model, name: str):
+        #logged with mlflow.sklearn.log_model, which pickles the model on the background thread
+        with self._lock:
+            self._uploads.append(('model', model, name))
+        self._wakeup.set()
+
+    #RUN LIFECYCLE
+    @contextmanager
+    def start_run(self, run_name: str = None):
+        try:
+            if self._thread is not None:
+                raise RuntimeError(f"Run {self.run_id} is still active, end it before starting another one")
+            self._reset_buffers()
+            self._closing = False
+            self._status = 'FINISHED'
+            self._thread = threading.Thread(target=self._worker, args=(run_name,), name="mlflow-tracker", daemon=True)
+            self._thread.start()
+        except Exception as e:
+            raise CustomException(e,sys)
+        status = 'FINISHED'
+        try:
+            yield self
+        except BaseException:
+            status = 'FAILED'
+            raise
+        finally:
+            self.end_run(status)
+
+    def flush(self):
+        #asks the background thread to send everything buffered so far, without waiting for it
+        self._wakeup.set()
+
+    def end_run(self, status: str = 'FINISHED', timeout: float = config.TRACKING_CLOSE_TIMEOUT_S):
+        thread = self._thread
+        if thread is None:
+            return
+        self._status = status
+        self._closing = True
+        self._wakeup.set()
+        thread.join(timeout)
+        if thread.is_alive():
+            logging.warning(f"Tracking run {self.run_id} did not finish uploading within {timeout}s")
+        self._thread = None
+
+    #BACKGROUND THREAD
+    def _worker(self, run_name: str):
+        try:
+            client = self._start_client_run(run_name)
+        except Exception as e:
+            logging.error(f"Could not start a tracking run, nothing will be logged: {e}")
+            return
+        while True:
+            self._wakeup.wait(self.flush_interval_s)
+            self._wakeup.clear()
+            closing = self._closing
+            self._flush_batch(client)
+            self._run_uploads(client)
+            #on close, buffers put back by a failed flush are retried until they are sent or dropped
+            if closing and not (self._params or self._tags or self._metrics):
+                break
+        try:
+            client.set_terminated(self.run_id, self._status)
+            logging.info(f"Tracking run {self.run_id} ended")
+        except Exception as e:
+            logging.error(f"Could not end tracking run {self.run_id}: {e}")
+
+    def _start_client_run(self, run_name: str):
+        from mlflow import MlflowClient
+        try:
+            client = MlflowClient(self.tracking_uri)
+            experiment_id = self._experiment_id(client)
+        except Exception as e:
+            if self.offline:
+                raise
+            #the server went away after the health check
+            logging.warning(f"Tracking server {self.tracking_uri} failed ({e}), logging to the local store in {self.offline_dir}")
+            self.offline = True
+            self.tracking_uri = offline_tracking_uri(self.offline_dir)
+            client = MlflowClient(self.tracking_uri)
+            experiment_id = self._experiment_id(client)
+        run = client.create_run(experiment_id, run_name=run_name)
+        self.run_id = run.info.run_id
+        self.artifact_uri = run.info.artifact_uri
+        logging.info(f"Tracking run {self.run_id} started on {self.tracking_uri}")
+        return client
+
+    def _experiment_id(self, client) -> str:
+        experiment = client.get_experiment_by_name(self.experiment_name)
+        if experiment is not None:
+            return experiment.experiment_id
+        artifact_location = None
+        if self.offline:
+            os.makedirs(self.offline_dir, exist_ok=True)
+            artifact_location = Path(self.offline_dir, 'artifacts').as_uri()
+        return client.create_experiment(self.experiment_name, artifact_location=artifact_location)
+
+    def _flush_batch(self, client):
+        from mlflow.entities import Metric, Param, RunTag
+        with self._lock:
+            params, tags, metrics = self._params, self._tags, self._metrics
+            self._params, self._tags, self._metrics = {}, {}, []
+        if not (params or tags or metrics):
+            return
+        try:
+            with stage('mlflow.log_batch', len(params) + len(tags) + len(metrics)):
+                for batch in _chunks([Param(key, value) for key, value in params.items()], MAX_PARAMS_TAGS_PER_BATCH):
+                    client.log_batch(self.run_id, params=batch)
+                params = {}
+                for batch in _chunks([RunTag(key, value) for key, value in tags.items()], MAX_PARAMS_TAGS_PER_BATCH):
+                    client.log_batch(self.run_id, tags=batch)
+                tags = {}
+                for batch in _chunks([Metric(*metric) for metric in metrics], MAX_METRICS_PER_BATCH):
+                    client.log_batch(self.run_id, metrics=batch)
+                self._flush_failures = 0
+        except Exception as e:
+            #what was not sent goes back into the buffers and is retried on the next flush
+            self._flush_failures += 1
+            if self._flush_failures >= MAX_FLUSH_ATTEMPTS:
+                logging.error(f"Dropping buffered tracking data after {self._flush_failures} failed flushes: {e}")
+                return
+            logging.warning(f"Tracking flush failed, retrying: {e}")
+            with self._lock:
+                self._params = {**params, **self._params}
+                self._tags = {**tags, **self._tags}
+                self._metrics = metrics + self._metrics
+
+    def _run_uploads(self, client):
+        with self._lock:
+            uploads, self._uploads = self._uploads, []
+        for kind, item, option in uploads:
+            try:
+                with stage(f"mlflow.log_{kind}"):
+                    if kind == 'artifact':
+                        self._upload_artifact(client, item, option)
+                    elif kind == 'input':
+                        self._upload_input(client, item, option)
+                    else:
+                        self._upload_model(item, option)
+            except Exception as e:
+                logging.error(f"Tracking upload of {kind} {option or item} failed: {e}")
+
+    #ARTIFACT DEDUPLICATION
+    def _artifact_index_path(self) -> str:
+        return os.path.join(self.offline_dir, 'artifact_index.json')
+
+    def _read_artifact_index(self) -> dict:
+        try:
+            with open(self._artifact_index_path()) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _record_artifact(self, digest: str, artifact_uri: str):
+        index = self._read_artifact_index()
+        index.setdefault(self.tracking_uri, {})[digest] = artifact_uri
+        os.makedirs(self.offline_dir, exist_ok=True)
+        tmp_path = f"{self._artifact_index_path()}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self._artifact_index_path())
+
+    def _upload_artifact(self, client, local_path: str, artifact_path: str = None):
+        digest = _file_sha256(local_path)
+        name = os.path.basename(local_path) if artifact_path is None else f"{artifact_path}/{os.path.basename(local_path)}"
+        if (digest, name) in self._run_hashes:
+            return
+        self._run_hashes.add((digest, name))
+        previous_uri = self._read_artifact_index().get(self.tracking_uri, {}).get(digest)
+        if previous_uri is not None:
+            client.set_tag(self.run_id, f"artifact_ref.{name}", previous_uri)
+            logging.info(f"{local_path} is unchanged, referencing {previous_uri} instead of uploading it again")
+            return
+        client.log_artifact(self.run_id, local_path, artifact_path)
+        self._record_artifact(digest, f"{self.artifact_uri}/{name}")
+
+    def _upload_input(self, client, dataset, context: str = None):
+        from mlflow.entities import DatasetInput, InputTag
+        from mlflow.utils.mlflow_tags import MLFLOW_DATASET_CONTEXT
+        tags = [InputTag(key=MLFLOW_DATASET_CONTEXT, value=context)] if context else []
+        client.log_inputs(self.run_id, datasets=[DatasetInput(dataset._to_mlflow_entity(), tags=tags)])
+
+    def _upload_model(self, model, name: str):
+        import mlflow
+        mlflow.set_tracking_uri(self.tracking_uri)
+        with mlflow.start_run(run_id=self.run_id):
+            mlflow.sklearn.log_model(model, name)
+
+_tracker = None
+
+#shared tracker of the process, created (and the tracking server checked) on first use
+def get_tracker() -> AsyncTracker:
+    global _tracker
+    if _tracker is None:
+        _tracker = AsyncTracker()
+    return _tracker
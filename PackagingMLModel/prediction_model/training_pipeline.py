@@ -4,9 +4,6 @@ import pandas as pd
 from pathlib import Path
 import mlflow
 
-mlflow.set_tracking_uri("http://localhost:5000") #default path to mlartifact
-mlflow.set_experiment("END-TO-END-LOAN-APPROVAL-PRediction") #experiment name
-
 PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
 sys.path.append(str(PACKAGE_ROOT))
 
@@ -14,7 +11,12 @@ from prediction_model.config import config
 from logger import logging
 from exception import CustomException
 import prediction_model.processing.data_preprocessing as dp
-from prediction_model.processing.data_handling import load_dataset, separate_data, data_split_strategy, save_pipeline, load_pipeline
+from prediction_model.processing.data_handling import load_cached_dataset, load_cached_splits, separate_data, save_pipeline, load_pipeline, save_model_artifact
+from prediction_model.batch_prediction import extract_model_parameters
+from prediction_model.tracking import get_tracker
+from prediction_model.model_registry import register_model
+from prediction_model.drift_monitor import build_reference_profile, save_reference_profile
+from prediction_model import instrumentation
 import joblib
 import prediction_model.pipeline as pipe
 from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, confusion_matrix
@@ -22,18 +24,24 @@ from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_sc
 
 def run_training_pipeline():
     try:
+        #params, metrics and artifacts are buffered and sent by the tracker's background thread, so training does not
+        #wait on the tracking server (or fails over to the local store when it is down)
+        tracker = get_tracker()
+        #per-stage timings of this run (with PREDICTION_MODEL_INSTRUMENTATION=1), written once the run has ended so
+        #they include the tracker's uploads
+        instrumentation.reset()
         # mlflow.sklearn.autolog()
-        with mlflow.start_run(run_name="Training-Pipeline-updated") as run:
-            mlflow.set_tag("mlflow.user", "Suhaib_Mukhtar")
-            mlflow.set_tag("datasets_used", "loan_approval_dataset.csv")
+        with tracker.start_run(run_name="Training-Pipeline-updated") as run:
+            tracker.set_tag("mlflow.user", "Suhaib_Mukhtar")
+            tracker.set_tag("datasets_used", "loan_approval_dataset.csv")
             logging.info("Starting Data Handling")
-            #loading the dataset
-            df = load_dataset(config.DATA_FILE_NAME)
+            #loading the dataset, through the arrow cache when the csv has not changed since the last run
+            df = load_cached_dataset(config.DATA_FILE_NAME)
             # Create an instance of a PandasDataset
             dataset = mlflow.data.from_pandas(
                 df, source=os.path.join(PACKAGE_ROOT,config.DATASET_DIR,config.DATA_FILE_NAME), name="loan_approval_dataset", targets="loan_status"
             )
-            mlflow.log_input(dataset, context = "Raw Data")
+            tracker.log_input(dataset, context = "Raw Data")
             logging.info("Dataset loaded successfully")
             logging.info(f"Dataset shape:{df.shape}")
             logging.info(f"Columns in the dataset:{df.columns}")
@@ -43,49 +51,61 @@ def run_training_pipeline():
             logging.info(f"Nan-values in y:{y.isna().sum()}")
             logging.info(f"Target variable distribution:{y.value_counts()}")
             logging.info("Data separated successfully")
-            mlflow.log_param("Feature_names",config.FEATURES)
-            mlflow.log_param("Target_name",config.TARGET)
-            X = dp.CreateCustomColumns(X)
-            logging.info("Custom column created successfully")
-            X = dp.ColumnsToDrop(X)
-            mlflow.log_param("Columns_to_drop",config.COLUMNS_TO_DROP)
-            mlflow.log_param("Custom_columns",config.CUSTOM_COLUMN_NAME)
-            mlflow.log_param("Categories_to_encode",config.CATEGORICAL_FEATURES_TO_ENCODE)
-            mlflow.log_param("Numeric Features to Transform",config.LOG_TRANSFORMATION)
-            logging.info("Columns dropped successfully")
-            X= dp.TransformingNumericFeatures(X)
-            y = dp.EncodingTargetVariable(y)
-            logging.info("Target variable encoded successfully")
-            X_train, X_test, y_train, y_test = data_split_strategy(X, y)
-            logging.info("Data split successfully")
+            tracker.log_param("Feature_names",config.FEATURES)
+            tracker.log_param("Target_name",config.TARGET)
+            tracker.log_param("Columns_to_drop",config.COLUMNS_TO_DROP)
+            tracker.log_param("Custom_columns",config.CUSTOM_COLUMN_NAME)
+            tracker.log_param("Categories_to_encode",config.CATEGORICAL_FEATURES_TO_ENCODE)
+            tracker.log_param("Numeric Features to Transform",config.LOG_TRANSFORMATION)
+            #custom column, column drop and log transformation are stages of pipe.classification_pipeline,
+            #so the splits below keep the raw columns and the saved model scores raw applications
+            #the target is encoded and the data split once per source file and config, later runs reuse the cached splits
+            X_train, X_test, y_train, y_test, cache_hit = load_cached_splits(config.DATA_FILE_NAME)
+            logging.info(f"Data split successfully (dataset cache {'hit' if cache_hit else 'miss'})")
             logging.info(f"Training set shape:{X_train.shape}")
             logging.info(f"Testing set shape:{X_test.shape}")
-            pd.concat([X_train,y_train],axis=1).to_csv(os.path.join(PACKAGE_ROOT,config.DATASET_DIR,config.TRAIN_FILE_NAME), index=False, header=True)
-            pd.concat([X_test,y_test],axis=1).to_csv(os.path.join(PACKAGE_ROOT,config.DATASET_DIR,config.TEST_FILE_NAME), index=False, header=True)
-            logging.info("Training and Testing set saved successfully")
+            #the csv copies are only exported when the splits changed
+            train_path = os.path.join(PACKAGE_ROOT,config.DATASET_DIR,config.TRAIN_FILE_NAME)
+            test_path = os.path.join(PACKAGE_ROOT,config.DATASET_DIR,config.TEST_FILE_NAME)
+            if not cache_hit or not (os.path.exists(train_path) and os.path.exists(test_path)):
+                pd.concat([X_train,y_train],axis=1).to_csv(train_path, index=False, header=True)
+                pd.concat([X_test,y_test],axis=1).to_csv(test_path, index=False, header=True)
+                logging.info("Training and Testing set saved successfully")
             logging.info("Starting Data Preprocessing")        
             # Log parameters
-            mlflow.log_param("data_file_name", config.DATA_FILE_NAME)
-            mlflow.log_param("train_file_name", config.TRAIN_FILE_NAME)
-            mlflow.log_param("test_file_name", config.TEST_FILE_NAME)
+            tracker.log_param("data_file_name", config.DATA_FILE_NAME)
+            tracker.log_param("train_file_name", config.TRAIN_FILE_NAME)
+            tracker.log_param("test_file_name", config.TEST_FILE_NAME)
 
             #pipeline
-            pipe.classification_pipeline.fit(X_train, y_train)
+            instrumentation.pipeline_fit(pipe.classification_pipeline, X_train, y_train)
             logging.info("Pipeline fit successfully")
             save_pipeline(pipe.classification_pipeline)
             logging.info("Model saved successfully")
-            mlflow.sklearn.log_model(pipe.classification_pipeline, "model")
-            logging.info("Model logged successfully")
-            mlflow.log_artifact(os.path.join(PACKAGE_ROOT,config.DATASET_DIR,config.TRAIN_FILE_NAME))
-            mlflow.log_artifact(os.path.join(PACKAGE_ROOT,config.DATASET_DIR,config.TEST_FILE_NAME))
-            mlflow.log_artifact(os.path.join(PACKAGE_ROOT,config.DATASET_DIR,config.DATA_FILE_NAME))
-            logging.info("Artifacts logged successfully")
-            mlflow.log_params(config.__dict__)
+            artifact_path = save_model_artifact(extract_model_parameters(pipe.classification_pipeline))
+            logging.info("Compact model artifact exported successfully")
+            #training distributions the live traffic is compared with, saved before registering so the registry copies it
+            profile_path = save_reference_profile(build_reference_profile(X_train, pipe.classification_pipeline.predict_proba(X_train)[:, 1]))
+            logging.info("Drift reference profile saved successfully")
+            tracker.set_tag("model_version", register_model())
+            logging.info("Model registered successfully")
+            tracker.log_model(pipe.classification_pipeline, "model")
+            logging.info("Model queued for logging")
+            tracker.log_artifact(artifact_path)
+            tracker.log_artifact(profile_path)
+            tracker.log_artifact(os.path.join(PACKAGE_ROOT,config.DATASET_DIR,config.TRAIN_FILE_NAME))
+            tracker.log_artifact(os.path.join(PACKAGE_ROOT,config.DATASET_DIR,config.TEST_FILE_NAME))
+            tracker.log_artifact(os.path.join(PACKAGE_ROOT,config.DATASET_DIR,config.DATA_FILE_NAME))
+            #unchanged files (the raw csv, this module) are referenced from the run that first uploaded them
+            logging.info("Artifacts queued for logging")
+            #the upper case settings of the config module, the module dict also holds imports and builtins
+            tracker.log_params({key: value for key, value in vars(config).items() if key.isupper()})
             logging.info("Parameters logged successfully")
-            mlflow.log_artifact(__file__)
+            tracker.log_artifact(__file__)
             logging.info("Code logged successfully")
-            mlflow.set_tag("Author","Suhaib-Mukhtar")
-            mlflow.set_tag("Version","1.0")
+            tracker.set_tag("Author","Suhaib-Mukhtar")
+            tracker.set_tag("Version","1.0")
+        instrumentation.write_summary("training")
             
     except Exception as e:
         raise CustomException(e,sys)
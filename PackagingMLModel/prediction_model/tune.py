@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import time
+import math
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+
+PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
+sys.path.append(str(PACKAGE_ROOT))
+
+from prediction_model.config import config
+from logger import logging
+from exception import CustomException
+from prediction_model.evaluation import roc_auc, evaluate
+
+#hyperparameter and model search over the model step of pipe.classification_pipeline
+#the preprocessing stages are fitted once and the transformed matrices are handed to every worker process when it
+#starts, so a trial only fits an estimator. Candidates are ranked by validation ROC-AUC with successive halving:
+#every round gives the surviving candidates TUNING_HALVING_FACTOR times more training rows and keeps the best
+#1/TUNING_HALVING_FACTOR of them, so poor configurations are dropped after fitting on a small sample
+
+#candidates are plain dicts so they can be sent to worker processes and logged as they are
+SEARCH_SPACE = (
+    [{'estimator': 'LogisticRegression', 'params': {'C': C, 'solver': solver, 'max_iter': 1000, 'random_state': 42}}
+     for C in (0.01, 0.1, 1.0, 10.0, 100.0) for solver in ('lbfgs', 'liblinear', 'newton-cg')]
+    + [{'estimator': 'SGDClassifier', 'params': {'loss': 'log_loss', 'alpha': alpha, 'random_state': 42}}
+       for alpha in (1e-4, 1e-3, 1e-2)]
+    + [{'estimator': 'RandomForestClassifier', 'params': {'n_estimators': 200, 'max_depth': depth, 'random_state': 42}}
+       for depth in (3, 6)]
+    + [{'estimator': 'HistGradientBoostingClassifier', 'params': {'learning_rate': rate, 'max_iter': 100, 'random_state': 42}}
+       for rate in (0.05, 0.1)]
+)
+
+#estimators whose fitted coefficients can be exported by batch_prediction.extract_model_parameters, the batch scorer,
+#the compiled scorer and the compact artifact only support linear models, so only these can replace the saved model
+LINEAR_ESTIMATORS = ('LogisticRegression', 'SGDClassifier')
+
+def build_estimator(candidate: dict):
+    from sklearn.linear_model import LogisticRegression, SGDClassifier
+    from sklearn.ensemble import RandomForestClassifier, HistGradientBoostingClassifier
+    estimators = {
+        'LogisticRegression': LogisticRegression,
+        'SGDClassifier': SGDClassifier,
+        'RandomForestClassifier': RandomForestClassifier,
+        'HistGradientBoostingClassifier': HistGradientBoostingClassifier,
+    }
+    return estimators[candidate['estimator']](**candidate['params'])
+
+def describe(candidate: dict) -> str:
+    return candidate['estimator'] + '(' + ', '.join(f"{key}={value}" for key, value in candidate['params'].items() if key != 'random_state') + ')'
+
+#TRIALS, run in the worker processes (or in process for the sequential search)
+_trial_data = None
+
+def _init_worker(trial_data: dict):
+    global _trial_data
+    _trial_data = trial_data
+
+def _run_trial(candidate_index: int, candidate: dict, n_rows: int) -> dict:
+    import warnings
+    from sklearn.exceptions import ConvergenceWarning
+    start = time.perf_counter()
+    estimator = build_estimator(candidate)
+    with warnings.catch_warnings():
+        #a configuration that does not converge on a small sample is ranked on its score like any other
+        warnings.simplefilter('ignore', ConvergenceWarning)
+        estimator.fit(_trial_data['X_fit'][:n_rows], _trial_data['y_fit'][:n_rows])
+    y_score = estimator.predict_proba(_trial_data['X_valid'])[:, 1]
+    return {'candidate': candidate_index, 'n_rows': n_rows, 'roc_auc': roc_auc(_trial_data['y_valid'], y_score),
+            'fit_seconds': time.perf_counter() - start}
+
+def prepare_trial_data(X_train, y_train, validation_size: float = config.TUNING_VALIDATION_SIZE, seed: int = 42) -> dict:
+    """
+    Splits the training data into a fit and a validation part, fits the preprocessing stages of the pipeline once
+    and returns the transformed matrices. The fit rows are shuffled, so any prefix of them is a random sample.
+    """
+    try:
+        from sklearn.base import clone
+        from sklearn.model_selection import train_test_split
+        import prediction_model.pipeline as pipe
+        X_fit, X_valid, y_fit, y_valid = train_test_split(X_train, y_train, test_size=validation_size, stratify=y_train, random_state=seed)
+        preprocessing = clone(pipe.classification_pipeline[:-1])
+        X_fit = np.ascontiguousarray(preprocessing.fit_transform(X_fit, y_fit), dtype=np.float64)
+        X_valid = np.ascontiguousarray(preprocessing.transform(X_valid), dtype=np.float64)
+        order = np.random.default_rng(seed).permutation(len(X_fit))
+        return {'X_fit': X_fit[order], 'y_fit': np.asarray(y_fit)[order], 'X_valid': X_valid, 'y_valid': np.asarray(y_valid)}
+    except Exception as e:
+        raise CustomException(e,sys)
+
+def halving_schedule(n_candidates: int, n_rows: int, min_rows: int = config.TUNING_MIN_ROWS, factor: int = config.TUNING_HALVING_FACTOR) -> list:
+    #(candidates kept, training rows) per round, the last round trains the finalists on every row
+    schedule = []
+    rows = min(min_rows, n_rows)
+    while True:
+        schedule.append((n_candidates, rows))
+        if n_candidates == 1 or rows == n_rows:
+            return schedule
+        n_candidates = max(1, math.ceil(n_candidates / factor))
+        rows = min(rows * factor, n_rows)
+
+def successive_halving(trial_data: dict, candidates: list = SEARCH_SPACE, workers: int = config.TUNING_WORKERS,
+                       min_rows: int = config.TUNING_MIN_ROWS, factor: int = config.TUNING_HALVING_FACTOR) -> list:
+    """
+    Runs the successive halving search and returns every trial result (candidate index, rows, validation ROC-AUC,
+    fit seconds, round). With workers > 1 the trials of a round run on a process pool.
+    """
+    try:
+        trials = []
+        schedule = halving_schedule(len(candidates), len(trial_data['y_fit']), min_rows, factor)
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(trial_data,)) if workers > 1 else None
+        if executor is None:
+            _init_worker(trial_data)
+        try:
+            survivors = list(range(len(candidates)))
+            for round_index, (n_keep, n_rows) in enumerate(schedule):
+                #ranking by the previous round decides who continues, ties keep the search space order
+                survivors = survivors[:n_keep]
+                args = [(index, candidates[index], n_rows) for index in survivors]
+                if executor is None:
+                    results = [_run_trial(*arg) for arg in args]
+                else:
+                    results = list(executor.map(_run_trial, *zip(*args)))
+                for result in results:
+                    result['round'] = round_index
+                trials.extend(results)
+                ranked = sorted(results, key=lambda result: -np.nan_to_num(result['roc_auc'], nan=-np.inf))
+                survivors = [result['candidate'] for result in ranked]
+                logging.info(f"Tuning round {round_index}: {len(results)} candidates on {n_rows} rows, best "
+                             f"{describe(candidates[survivors[0]])} with validation ROC-AUC {ranked[0]['roc_auc']:.4f}")
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return trials
+    except Exception as e:
+        raise CustomException(e,sys)
+
+def best_candidate(trials: list, candidates: list, eligible: tuple = None) -> int:
+    #highest validation ROC-AUC among the trials that got the most rows, optionally restricted to some estimators
+    pool = [trial for trial in trials if eligible is None or candidates[trial['candidate']]['estimator'] in eligible]
+    if not pool:
+        return None
+    return max(pool, key=lambda trial: (trial['n_rows'], np.nan_to_num(trial['roc_auc'], nan=-np.inf)))['candidate']
+
+def run_tuning(candidates: list = SEARCH_SPACE, workers: int = config.TUNING_WORKERS, save: bool = True,
+               compare_sequential: bool = False, log: bool = True) -> dict:
+    """
+    Searches the candidates on the cached train split, refits the best linear candidate in the full pipeline on the
+    whole train split, evaluates it on the test split and (with save=True) saves it with save_pipeline.
+    With compare_sequential=True the same search is also run in a single process to report the speedup.
+    """
+    try:
+        from sklearn.base import clone
+        import prediction_model.pipeline as pipe
+        from prediction_model.processing.data_handling import load_cached_splits, save_pipeline, save_model_artifact
+        from prediction_model.batch_prediction import extract_model_parameters
+        from prediction_model.model_registry import register_model
+        from prediction_model.drift_monitor import build_reference_profile, save_reference_profile
+        X_train, X_test, y_train, y_test, _ = load_cached_splits(config.DATA_FILE_NAME)
+        start = time.perf_counter()
+        trial_data = prepare_trial_data(X_train, y_train)
+        preprocessing_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        trials = successive_halving(trial_data, candidates, workers)
+        search_seconds = time.perf_counter() - start
+        summary = {'candidates': len(candidates), 'trials': len(trials), 'workers': workers,
+                   'preprocessing_seconds': round(preprocessing_seconds, 3), 'search_seconds': round(search_seconds, 3)}
+        if compare_sequential:
+            start = time.perf_counter()
+            successive_halving(trial_data, candidates, workers=1)
+            summary['sequential_seconds'] = round(time.perf_counter() - start, 3)
+            summary['speedup'] = round(summary['sequential_seconds'] / search_seconds, 2)
+
+        best_index = best_candidate(trials, candidates)
+        saved_index = best_candidate(trials, candidates, eligible=LINEAR_ESTIMATORS)
+        summary['best'] = describe(candidates[best_index])
+        if saved_index is not None:
+            final_pipeline = clone(pipe.classification_pipeline).set_params(model=build_estimator(candidates[saved_index]))
+            final_pipeline.fit(X_train, y_train)
+            test_metrics = evaluate(y_test, final_pipeline.predict_proba(X_test)[:, 1], n_bootstrap=0)['metrics']
+            summary['selected'] = describe(candidates[saved_index])
+            summary['test_metrics'] = test_metrics
+            if save:
+                save_pipeline(final_pipeline)
+                save_model_artifact(extract_model_parameters(final_pipeline))
+                save_reference_profile(build_reference_profile(X_train, final_pipeline.predict_proba(X_train)[:, 1]))
+                summary['model_version'] = register_model()
+                logging.info(f"Saved tuned pipeline {summary['selected']}")
+        summary['saved'] = save and saved_index is not None
+
+        if log:
+            from prediction_model.tracking import get_tracker
+            tracker = get_tracker()
+            with tracker.start_run(run_name='Hyperparameter-Tuning'):
+                #one param and one metric series per trial, the step is the successive halving round
+                for index, candidate in enumerate(candidates):
+                    tracker.log_param(f"trial_{index}", describe(candidate))
+                for trial in trials:
+                    tracker.log_metric(f"trial_{trial['candidate']}_val_roc_auc", np.nan_to_num(trial['roc_auc']), step=trial['round'])
+                    tracker.log_metric(f"trial_{trial['candidate']}_rows", trial['n_rows'], step=trial['round'])
+                    tracker.log_metric(f"trial_{trial['candidate']}_fit_seconds", trial['fit_seconds'], step=trial['round'])
+                tracker.log_params({'best_candidate': summary['best'], 'selected_candidate': summary.get('selected')})
+                tracker.log_metrics({key: summary[key] for key in ('search_seconds', 'sequential_seconds', 'speedup') if key in summary})
+                tracker.log_metrics({f"Test_{name}": value for name, value in summary.get('test_metrics', {}).items()})
+        summary['trial_results'] = [{**trial, 'candidate': describe(candidates[trial['candidate']])} for trial in trials]
+        return summary
+    except Exception as e:
+        raise CustomException(e,sys)
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog='tune', description="Successive halving search over the classification pipeline's model")
+    parser.add_argument('--workers', type=int, default=config.TUNING_WORKERS, help="worker processes for the trials")
+    parser.add_argument('--compare-sequential', action='store_true', help="also run the search in one process and report the speedup")
+    parser.add_argument('--no-save', action='store_true', help="do not replace the saved model")
+    parser.add_argument('--no-log', action='store_true', help="do not log the trials to mlflow")
+    args = parser.parse_args(argv)
+    summary = run_tuning(workers=args.workers, save=not args.no_save, compare_sequential=args.compare_sequential, log=not args.no_log)
+    summary.pop('trial_results')
+    print(json.dumps(summary, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+import os
+import sys
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
+sys.path.append(str(PACKAGE_ROOT))
+
+from prediction_model.config import config
+from logger import logging
+from exception import CustomException
+from prediction_model.batch_prediction import get_model_parameters, raw_features_needed, build_feature_matrix
+
+#vectorized validation of raw loan applications
+#the schema is built from config.FEATURES (total_assets_value is checked on the sum of config.COLUMNS_TO_MERGE),
+#config.VALID_CATEGORIES and config.VALID_RANGES. Every column is checked for the whole batch with array operations:
+#missing values and columns, values that are not numbers, values out of range and unknown categories. Each row gets
+#a bit set of the checks it failed, so one malformed application is reported instead of failing the whole batch
+
+def build_schema() -> list:
+    #one rule per raw input column, in the order of config.FEATURES
+    rules = []
+    for feature in config.FEATURES:
+        if feature == config.TARGET:
+            continue
+        if feature == config.CUSTOM_COLUMN_NAME:
+            rules.extend({'column': col, 'kind': 'number', 'range': config.VALID_RANGES.get(col, (None, None))}
+                         for col in config.COLUMNS_TO_MERGE)
+            rules.append({'column': feature, 'kind': 'sum', 'of': config.COLUMNS_TO_MERGE,
+                          'range': config.VALID_RANGES.get(feature, (None, None))})
+        elif feature in config.CATEGORICAL_FEATURES_TO_ENCODE:
+            rules.append({'column': feature, 'kind': 'category', 'categories': list(config.VALID_CATEGORIES[feature])})
+        else:
+            rules.append({'column': feature, 'kind': 'number', 'range': config.VALID_RANGES.get(feature, (None, None))})
+    return rules
+
+def _range_text(bounds: tuple) -> str:
+    low, high = bounds
+    return f"[{'-inf' if low is None else low}, {'inf' if high is None else high}]"
+
+def _check_names(schema: list) -> list:
+    #bit i of a row's error code is set when check i failed
+    checks = []
+    for rule in schema:
+        col = rule['column']
+        if rule['kind'] == 'number':
+            checks += [f"{col}: missing", f"{col}: not a number", f"{col}: out of range {_range_text(rule['range'])}"]
+        elif rule['kind'] == 'category':
+            checks += [f"{col}: missing", f"{col}: unknown category, expected one of {rule['categories']}"]
+        else:
+            checks.append(f"{col}: sum of {', '.join(rule['of'])} out of range {_range_text(rule['range'])}")
+    if len(checks) > 64:
+        raise ValueError(f"The schema has {len(checks)} checks, error codes hold 64")
+    return checks
+
+class ValidationResult:
+    """
+    Outcome of validate_batch. valid is the boolean mask of the rows that passed, errors the uint64 bit set of the
+    failed checks of every row (0 when valid), checks the check names by bit. columns holds the validated columns
+    (float64 numbers, stripped categoricals), the valid rows can be scored from them without parsing the input again.
+    """
+    def __init__(self, errors: np.ndarray, checks: list, columns: dict):
+        self.errors = errors
+        self.valid = errors == 0
+        self.checks = checks
+        self.columns = columns
+
+    @property
+    def n_invalid(self) -> int:
+        return int(len(self.valid) - np.count_nonzero(self.valid))
+
+    def reasons(self, row: int) -> list:
+        code = int(self.errors[row])
+        return [name for bit, name in enumerate(self.checks) if code >> bit & 1]
+
+    def error_report(self, limit: int = None) -> list:
+        #[{'index': row, 'reasons': [...]}] of the invalid rows, the first limit of them when given
+        rows = np.flatnonzero(~self.valid)[:limit]
+        return [{'index': int(row), 'reasons': self.reasons(row)} for row in rows]
+
+    def summary(self) -> dict:
+        #number of rows failing each check, checks no row failed are left out
+        counts = {}
+        invalid = self.errors[~self.valid]
+        for bit, name in enumerate(self.checks):
+            count = int(np.count_nonzero(invalid >> np.uint64(bit) & np.uint64(1)))
+            if count:
+                counts[name] = count
+        return {'rows': len(self.valid), 'invalid': self.n_invalid, 'checks': counts}
+
+def _input_columns(records, columns: list) -> tuple:
+    #(number of rows, {column: values}) from a list of dicts, DataFrame or structured array, None for absent columns
+    if isinstance(records, pd.DataFrame):
+        names = {str(col).strip(): col for col in records.columns}
+        return len(records), {col: records[names[col]] if col in names else None for col in columns}
+    if isinstance(records, np.ndarray) and records.dtype.names is not None:
+        names = {name.strip(): name for name in records.dtype.names}
+        return len(records), {col: records[names[col]] if col in names else None for col in columns}
+    if isinstance(records, dict):
+        records = [records]
+    records = list(records)
+    #keys are taken from the first record (raw csv headers carry a leading space), a record lacking one is missing it
+    names = {str(key).strip(): key for key in records[0]} if records else {}
+    return len(records), {col: np.array([record.get(names.get(col, col)) for record in records], dtype=object) for col in columns}
+
+def _as_series(values) -> pd.Series:
+    return values if isinstance(values, pd.Series) else pd.Series(values, copy=False)
+
+def _check_number(values, n_rows: int, bounds: tuple) -> tuple:
+    #returns the values as float64 (NaN where invalid) and the missing, not a number and out of range masks
+    if values is None:
+        return np.full(n_rows, np.nan), np.ones(n_rows, dtype=bool), np.zeros(n_rows, dtype=bool), np.zeros(n_rows, dtype=bool)
+    series = _as_series(values)
+    if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+        numbers = series.to_numpy(dtype=np.float64, na_value=np.nan)
+        missing = np.isnan(numbers)
+        not_number = np.isinf(numbers)
+    else:
+        missing = series.isna().to_numpy()
+        if series.dtype == object and pd.api.types.infer_dtype(series, skipna=True) not in ('integer', 'floating', 'mixed-integer-float', 'string', 'empty'):
+            #to_numeric would turn True into 1, booleans are not accepted as numbers
+            series = series.where(~series.map(lambda value: isinstance(value, (bool, np.bool_))))
+        numbers = pd.to_numeric(series, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        not_number = ~np.isfinite(numbers) & ~missing
+    low, high = bounds
+    with np.errstate(invalid='ignore'):
+        out_of_range = np.zeros(n_rows, dtype=bool)
+        if low is not None:
+            out_of_range |= numbers < low
+        if high is not None:
+            out_of_range |= numbers > high
+    return numbers, missing, not_number, out_of_range
+
+def _check_category(values, n_rows: int, categories: list) -> tuple:
+    #returns a categorical Series over the allowed categories and the missing and unknown category masks
+    #the input is factorized once, so stripping and matching run on the distinct values only
+    if values is None:
+        codes = np.full(n_rows, -1, dtype=np.int8)
+        return pd.Series(pd.Categorical.from_codes(codes, categories)), np.ones(n_rows, dtype=bool), np.zeros(n_rows, dtype=bool)
+    series = _as_series(values)
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        try:
+            series = series.astype('category')
+        except TypeError:
+            #unhashable values (lists, dicts) are unknown categories
+            series = series.map(lambda value: value if value is None or isinstance(value, (str, int, float)) else repr(value)).astype('category')
+    codes = series.cat.codes.to_numpy()
+    stripped = [value.strip() if isinstance(value, str) else value for value in series.cat.categories]
+    #the extra -1 at the end maps the missing code -1 to missing
+    lookup = np.array([categories.index(value) if value in categories else -1 for value in stripped] + [-1], dtype=np.int16)
+    allowed_codes = lookup[codes]
+    missing = codes == -1
+    unknown = (allowed_codes == -1) & ~missing
+    return pd.Series(pd.Categorical.from_codes(allowed_codes, categories)), missing, unknown
+
+def validate_batch(records, schema: list = None) -> ValidationResult:
+    """
+    Checks raw loan applications (list of dicts, DataFrame or NumPy structured array) against the schema, the
+    default one of build_schema(). Never raises for invalid values or missing columns, they are reported per row.
+    """
+    try:
+        schema = schema or build_schema()
+        checks = _check_names(schema)
+        n_rows, raw_columns = _input_columns(records, [rule['column'] for rule in schema if rule['kind'] != 'sum'])
+        errors = np.zeros(n_rows, dtype=np.uint64)
+        columns = {}
+        bit = 0
+        def flag(mask):
+            nonlocal bit
+            errors[:] |= np.asarray(mask, dtype=np.uint64) << np.uint64(bit)
+            bit += 1
+        for rule in schema:
+            col = rule['column']
+            if rule['kind'] == 'number':
+                columns[col], missing, not_number, out_of_range = _check_number(raw_columns[col], n_rows, rule['range'])
+                for mask in (missing, not_number, out_of_range):
+                    flag(mask)
+            elif rule['kind'] == 'category':
+                columns[col], missing, unknown = _check_category(raw_columns[col], n_rows, rule['categories'])
+                flag(missing)
+                flag(unknown)
+            else:
+                #NaN parts (already reported) make the sum NaN, which compares as in range
+                total = np.sum([columns[part] for part in rule['of']], axis=0)
+                low, high = rule['range']
+                with np.errstate(invalid='ignore'):
+                    flag(((total < low) if low is not None else False) | ((total > high) if high is not None else False))
+        result = ValidationResult(errors, checks, columns)
+        if result.n_invalid:
+            logging.info(f"{result.n_invalid} of {n_rows} applications failed validation")
+        return result
+    except Exception as e:
+        raise CustomException(e,sys)
+
+def predict_valid(records, model_parameters: dict = None) -> tuple:
+    """
+    Validates the applications and scores the valid ones from the validated columns. Returns (predictions,
+    probabilities, validation), the predictions and probabilities cover the rows where validation.valid is True.
+    """
+    try:
+        if model_parameters is None:
+            model_parameters = get_model_parameters()
+        validation = validate_batch(records)
+        valid = validation.valid
+        raw_columns = {col: validation.columns[col][valid] for col in raw_features_needed(model_parameters)}
+        X = build_feature_matrix(raw_columns, model_parameters)
+        scores = X @ model_parameters['coef'] + model_parameters['intercept']
+        y_pred = model_parameters['classes'][(scores > 0).astype(np.intp)]
+        return y_pred, 1.0 / (1.0 + np.exp(-scores)), validation
+    except Exception as e:
+        raise CustomException(e,sys)
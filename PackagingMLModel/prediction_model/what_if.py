@@ -0,0 +1,137 @@
+import os
+import sys
+from pathlib import Path
+import numpy as np
+
+PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
+sys.path.append(str(PACKAGE_ROOT))
+
+from prediction_model.config import config
+from logger import logging
+from exception import CustomException
+from prediction_model.batch_prediction import get_model_parameters, raw_features_needed, records_to_columns, build_feature_matrix
+
+#what-if scoring of raw loan applications
+#the log-odds are linear in every model input column: z = rest + weight * g(value), g is log1p for the
+#config.LOG_TRANSFORMATION features and the identity otherwise. The values of one numeric field (e.g. loan_amount or
+#loan_term) that get an application approved at a probability threshold are therefore an interval solved in closed
+#form, and grids of candidate values are scored by broadcasting the per-candidate terms against the rest of the score.
+#A field the fitted model does not use (weight 0 or no model column) does not change any prediction: it gets
+#unbounded intervals on approved applications and none on rejected ones, and a warning is logged
+
+def _field_term(field: str, model_parameters: dict):
+    #(model column index, is one of the asset columns summed into total_assets_value) or None when the model ignores field
+    if field in config.CATEGORICAL_FEATURES_TO_ENCODE:
+        raise ValueError(f"What-if scoring needs a numeric field, {field} is categorical")
+    for i, (feature, category) in enumerate(model_parameters['columns']):
+        if category is None and feature == field:
+            return i, False
+        if feature == config.CUSTOM_COLUMN_NAME and field in config.COLUMNS_TO_MERGE:
+            return i, True
+    return None
+
+def _prepare(records, fields: list, model_parameters: dict) -> tuple:
+    """
+    Scores the applications without the model terms of fields. Returns (partial log-odds, {field: (weight, offset,
+    log transformed)}), the model input of a field's column is its value + offset (the other asset values when the
+    field is summed into total_assets_value), the entry is None when the model does not use the field.
+    """
+    raw_columns = records_to_columns(records, raw_features_needed(model_parameters))
+    X = build_feature_matrix(raw_columns, model_parameters)
+    coef = model_parameters['coef']
+    scores = X @ coef + model_parameters['intercept']
+    terms, seen = {}, set()
+    for field in fields:
+        term = _field_term(field, model_parameters)
+        if term is None or coef[term[0]] == 0:
+            logging.warning(f"{field} is not used by the fitted model, it does not change any prediction")
+            terms[field] = None
+            continue
+        i, merged = term
+        if i in seen:
+            raise ValueError(f"{field} feeds the same model column as another what-if field")
+        seen.add(i)
+        scores -= X[:, i] * coef[i]
+        offset = 0.0
+        if merged:
+            offset = sum(np.asarray(raw_columns[col], dtype=np.float64) for col in config.COLUMNS_TO_MERGE if col != field)
+        feature = model_parameters['columns'][i][0]
+        terms[field] = (float(coef[i]), offset, feature in config.LOG_TRANSFORMATION)
+    return scores, terms
+
+def _logit(threshold: float) -> float:
+    if not 0.0 < threshold < 1.0:
+        raise ValueError(f"The probability threshold must be between 0 and 1, got {threshold}")
+    return float(np.log(threshold / (1.0 - threshold)))
+
+def approval_range(records, field: str, threshold: float = config.DECISION_THRESHOLD, model_parameters: dict = None) -> tuple:
+    """
+    (lower, upper) arrays of the values of field that get each application approved with a probability above
+    threshold, all other fields unchanged. Bounded by config.VALID_RANGES, inf where the interval is open on that
+    side, NaN on both where no value of field gets the application approved.
+    """
+    try:
+        if model_parameters is None:
+            model_parameters = get_model_parameters()
+        scores, terms = _prepare(records, [field], model_parameters)
+        target = _logit(threshold)
+        low, high = config.VALID_RANGES.get(field, (None, None))
+        n_rows = len(scores)
+        lower = np.full(n_rows, -np.inf if low is None else float(low))
+        upper = np.full(n_rows, np.inf if high is None else float(high))
+        if terms[field] is None:
+            approved = scores > target
+        else:
+            weight, offset, log = terms[field]
+            with np.errstate(over='ignore'):
+                #boundary of the model input, then of the field value
+                boundary = (target - scores) / weight
+                boundary = (np.expm1(boundary) if log else boundary) - offset
+            if log:
+                lower = np.maximum(lower, -1.0 - offset) #log1p needs the model input above -1
+            if weight > 0:
+                lower = np.maximum(lower, boundary)
+            else:
+                upper = np.minimum(upper, boundary)
+            approved = lower < upper
+        lower[~approved] = np.nan
+        upper[~approved] = np.nan
+        return lower, upper
+    except Exception as e:
+        raise CustomException(e,sys)
+
+def max_approvable(records, field: str = 'loan_amount', threshold: float = config.DECISION_THRESHOLD, model_parameters: dict = None) -> np.ndarray:
+    #largest value of field (e.g. loan_amount) that gets each application approved, inf when there is no upper limit
+    #(the model does not use the field, or larger values only help), NaN when no value gets it approved
+    return approval_range(records, field, threshold, model_parameters)[1]
+
+def score_grid(records, candidates: dict, model_parameters: dict = None) -> np.ndarray:
+    """
+    Approval probabilities of every application for every combination of candidate values, e.g.
+    score_grid(records, {'loan_amount': amounts, 'loan_term': terms}) has shape (rows, len(amounts), len(terms)).
+    The candidate terms are computed once per value (per row and value for the asset columns) and broadcast.
+    """
+    try:
+        if model_parameters is None:
+            model_parameters = get_model_parameters()
+        fields = list(candidates)
+        scores, terms = _prepare(records, fields, model_parameters)
+        n_rows = len(scores)
+        z = scores.reshape((n_rows,) + (1,) * len(fields))
+        for axis, field in enumerate(fields):
+            values = np.asarray(candidates[field], dtype=np.float64)
+            if terms[field] is None:
+                contribution = np.zeros(len(values))
+            else:
+                weight, offset, log = terms[field]
+                inputs = values if np.ndim(offset) == 0 else values + np.asarray(offset)[:, None]
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    contribution = weight * (np.log1p(inputs) if log else inputs)
+            shape = [1] * (len(fields) + 1)
+            shape[axis + 1] = len(values)
+            if contribution.ndim == 2:
+                shape[0] = n_rows
+            z = z + contribution.reshape(shape)
+        return 1.0 / (1.0 + np.exp(-z))
+    except Exception as e:
+        raise CustomException(e,sys)
@@ -35,6 +35,13 @@ setup(
     ),
     packages=find_packages(),
     install_requires=get_requirements('./requirements.txt'),
+    entry_points={
+        'console_scripts': [
+            'score-file=prediction_model.score_file:main',
+            'tune=prediction_model.tune:main',
+            'rescore-portfolio=prediction_model.portfolio_rescoring:main',
+        ],
+    },
     classifiers=[
         'Programming Language :: Python :: 3',
         'License :: OSI Approved :: MIT License',
@@ -1,8 +1,10 @@
 import pytest
 import os
 import sys
+import json
 from pathlib import Path
 import pandas as pd
+import numpy as np
 
 from logger import logging
 from exception import CustomException
@@ -10,9 +12,27 @@ PACKAGE_ROOT = Path(os.path.abspath(os.path.dirname(__file__))).parent
 sys.path.append(str(PACKAGE_ROOT))
 
 from prediction_model.config import config
-from prediction_model.processing.data_handling import load_dataset, separate_data,load_pipeline, data_split_strategy
-from prediction_model.processing.data_preprocessing import CreateCustomColumns, ColumnsToDrop, EncodingTargetVariable
+from prediction_model.processing.data_handling import load_dataset, separate_data,load_pipeline, data_split_strategy, load_model_artifact, load_cached_splits
+from prediction_model.processing.data_preprocessing import CreateCustomColumns, ColumnsToDrop, EncodingTargetVariable, TransformingNumericFeatures, EncodingTarget
 from prediction_model.prediction_pipeline import generate_predictions
+from prediction_model import predict_batch, CompiledScorer
+from prediction_model.serve import create_app
+from prediction_model.score_file import score_file
+from prediction_model.batch_prediction import extract_model_parameters, get_model_parameters
+from prediction_model.tracking import AsyncTracker
+from prediction_model.evaluation import evaluate, bootstrap_confidence_intervals
+from prediction_model.tune import prepare_trial_data, successive_halving, run_tuning, SEARCH_SPACE
+from prediction_model.incremental_training import run_incremental_training, collect_categories
+from prediction_model.prediction_cache import CachedPredictor, PredictionCache
+from prediction_model.async_predictor import AsyncPredictor
+from prediction_model import instrumentation
+from prediction_model.synthetic_data import fit_profile, write_synthetic_dataset
+from prediction_model.model_registry import ModelRegistry, register_model, list_versions, promote
+from prediction_model.drift_monitor import DriftMonitor, build_reference_profile, load_reference_profile
+from prediction_model.validation import validate_batch, predict_valid
+from prediction_model.reason_codes import predict_with_reasons
+from prediction_model.what_if import approval_range, max_approvable, score_grid
+from prediction_model.portfolio_rescoring import rescore_portfolio
 
 
 def test_load_pipeline():
@@ -131,4 +151,641 @@ def test_generate_prediction_not_none(single_prediction):
     assert single_prediction is not None, "Prediction failed as it is None"
 
 def test_check_dtype_of_prediction(single_prediction):
-    assert single_prediction in [0, 1], "Prediction failed as it is not of type Integer"
\ No newline at end of file
+    assert single_prediction in [0, 1], "Prediction failed as it is not of type Integer"
+
+def test_predict_batch_matches_pipeline():
+    try:
+        df = load_dataset(config.DATA_FILE_NAME)
+        X, y = separate_data(df)
+        y_pred, y_proba = predict_batch(X, return_proba=True)
+        # Reference: the sklearn pipeline, which runs the preprocessing stages itself on the raw columns
+        classification_pipeline = load_pipeline(config.MODEL_NAME)
+        assert (y_pred == classification_pipeline.predict(X)).all(), "Batch predictions differ from the pipeline"
+        assert np.allclose(y_proba, classification_pipeline.predict_proba(X)[:, 1]), "Batch probabilities differ from the pipeline"
+        # List of dicts input must give the same result as the DataFrame input
+        assert (predict_batch(X.head(50).to_dict('records')) == y_pred[:50]).all(), "Record input not scored correctly"
+        # Missing numbers raise like the pipeline instead of scoring as rejected
+        records = X.head(3).to_dict('records')
+        records[1]['loan_term'] = None
+        with pytest.raises(CustomException):
+            predict_batch(records)
+    except CustomException:
+        pytest.fail("CustomException raised: Batch prediction failed")
+    except FileNotFoundError:
+        pytest.fail("FileNotFoundError: Data file not found")
+    except Exception as e:
+        pytest.fail(f"Unexpected error: {e}")
+
+def test_compiled_scorer_parity_on_test_data():
+    try:
+        test_data = load_dataset(config.TEST_FILE_NAME)
+        X, y = separate_data(test_data)
+        classification_pipeline = load_pipeline(config.MODEL_NAME)
+        scorer = CompiledScorer.from_pipeline(classification_pipeline)
+        records = X.to_dict('records')
+        y_pred = np.array([scorer.predict_one(record, raw=True) for record in records])
+        y_proba = np.array([scorer.predict_proba_one(record, raw=True) for record in records])
+        # Ensure the compiled scorer agrees with the sklearn pipeline row by row
+        assert (y_pred == classification_pipeline.predict(X)).all(), "Compiled scorer predictions differ from the pipeline"
+        assert np.allclose(y_proba, classification_pipeline.predict_proba(X)[:, 1]), "Compiled scorer probabilities differ from the pipeline"
+        assert (scorer.predict(X, raw=True) == y_pred).all(), "Batch and single-row scoring disagree"
+        # Ensure missing numeric values are rejected instead of scoring as 0 or failing with a bare TypeError
+        for value in (float("nan"), None):
+            with pytest.raises(CustomException):
+                scorer.predict_one({**records[0], "no_of_dependents": value}, raw=True)
+            with pytest.raises(CustomException):
+                scorer.predict(X.head(3).assign(no_of_dependents=[1, value, 2]), raw=True)
+    except CustomException:
+        pytest.fail("CustomException raised: Compiled scoring failed")
+    except FileNotFoundError:
+        pytest.fail("FileNotFoundError: Data file not found")
+    except Exception as e:
+        pytest.fail(f"Unexpected error: {e}")
+
+def test_serve_predict_endpoints():
+    try:
+        df = load_dataset(config.DATA_FILE_NAME)
+        X, y = separate_data(df)
+        records = X.head(5).to_dict('records')
+        client = create_app().test_client()
+        single = client.post("/predict", json=records[0])
+        batch = client.post("/predict/batch", json=records)
+        # Ensure both endpoints agree with the batch scoring API
+        assert single.status_code == 200 and batch.status_code == 200, "Prediction endpoints failed"
+        assert single.get_json()["prediction"] == predict_batch(records[:1])[0], "Single prediction is incorrect"
+        assert batch.get_json()["predictions"] == predict_batch(records).tolist(), "Batch predictions are incorrect"
+        # A malformed application is rejected without failing the server
+        assert client.post("/predict", json={"no_of_dependents": 2}).status_code == 400, "Malformed request not rejected"
+        assert client.post("/model/shadow", json={"version": "../../tmp/evil"}).status_code == 400, "Unregistered shadow version not rejected"
+        # Ensure /predict applies the same validation as /predict/batch, even to applications that would score
+        for field, value in (("education", "Graduat"), ("cibil_score", -5), ("cibil_score", None), ("loan_term", float("nan"))):
+            response = client.post("/predict", data=json.dumps({**records[0], field: value}), content_type="application/json")
+            assert response.status_code == 400 and response.get_json()["error"].startswith(field), f"Invalid {field} accepted"
+    except Exception as e:
+        pytest.fail(f"Unexpected error: {e}")
+
+def test_score_file_streams_chunks(tmp_path):
+    try:
+        df = load_dataset(config.DATA_FILE_NAME)
+        output_path = str(tmp_path / "scored.csv")
+        input_path = os.path.join(PACKAGE_ROOT, config.DATASET_DIR, config.DATA_FILE_NAME)
+        summary = score_file(input_path, output_path, chunk_size=1000)
+        scored = pd.read_csv(output_path)
+        # Ensure every row is scored once, in input order, with the same result as a single batch
+        assert summary["rows"] == len(df) == len(scored), "Not all rows were scored"
+        assert (scored["loan_id"] == df["loan_id"]).all(), "Output rows are out of order"
+        assert (scored["prediction"] == predict_batch(df)).all(), "Chunked predictions differ from batch predictions"
+    except CustomException:
+        pytest.fail("CustomException raised: File scoring failed")
+    except Exception as e:
+        pytest.fail(f"Unexpected error: {e}")
+
+def test_score_file_parallel_keeps_input_order(tmp_path):
+    try:
+        df = load_dataset(config.DATA_FILE_NAME)
+        output_path = str(tmp_path / "scored.parquet")
+        input_path = os.path.join(PACKAGE_ROOT, config.DATASET_DIR, config.DATA_FILE_NAME)
+        summary = score_file(input_path, output_path, chunk_size=500, workers=2)
+        scored = pd.read_parquet(output_path)
+        # Ensure the chunks scored by the worker pool are reassembled in input order
+        assert summary["rows"] == len(df) == len(scored), "Not all rows were scored"
+        assert (scored["loan_id"] == df["loan_id"]).all(), "Output rows are out of order"
+        assert (scored["prediction"] == predict_batch(df)).all(), "Parallel predictions differ from batch predictions"
+    except CustomException:
+        pytest.fail("CustomException raised: Parallel file scoring failed")
+    except Exception as e:
+        pytest.fail(f"Unexpected error: {e}")
+
+def test_model_artifact_matches_pickle():
+    try:
+        df = load_dataset(config.DATA_FILE_NAME)
+        X, y = separate_data(df)
+        artifact_parameters = load_model_artifact(config.MODEL_NAME)
+        pickle_parameters = extract_model_parameters(load_pipeline(config.MODEL_NAME))
+        # Ensure the compact artifact exists, is up to date and scores exactly like the pickle
+        assert artifact_parameters is not None, "Compact model artifact missing or stale"
+        assert artifact_parameters["columns"] == pickle_parameters["columns"], "Artifact column layout differs"
+        y_pred_artifact, y_proba_artifact = predict_batch(X, return_proba=True, model_parameters=artifact_parameters)
+        y_pred_pickle, y_proba_pickle = predict_batch(X, return_proba=True, model_parameters=pickle_parameters)
+        assert (y_pred_artifact == y_pred_pickle).all(), "Artifact predictions differ from the pickle"
+        assert (y_proba_artifact == y_proba_pickle).all(), "Artifact probabilities differ from the pickle"
+    except CustomException:
+        pytest.fail("CustomException raised: Model artifact loading failed")
+    except Exception as e:
+        pytest.fail(f"Unexpected error: {e}")
+
+def test_pipeline_preprocessing_stages_do_not_mutate_input():
+    try:
+        df = load_dataset(config.DATA_FILE_NAME)
+        X, y = separate_data(df)
+        X_before = X.copy()
+        classification_pipeline = load_pipeline(config.MODEL_NAME)
+        y_pred = classification_pipeline.predict(X)
+        # Ensure the raw input is left untouched by the pipeline stages
+        pd.testing.assert_frame_equal(X, X_before)
+        # Ensure the stages match the hand-written preprocessing functions
+        X_ref = TransformingNumericFeatures(ColumnsToDrop(CreateCustomColumns(X.copy())))
+        preprocessor_index = [name for name, _ in classification_pipeline.steps].index("preprocessor")
+        X_stages = classification_pipeline[:preprocessor_index].transform(X)
+        pd.testing.assert_frame_equal(X_stages, X_ref, check_dtype=False, check_categorical=False)
+        assert (y_pred == classification_pipeline[preprocessor_index:].predict(X_ref)).all(), "Pipeline stages and preprocessing functions disagree"
+    except CustomException:
+        pytest.fail("CustomException raised: Pipeline preprocessing failed")
+    except Exception as e:
+        pytest.fail(f"Unexpected error: {e}")
+
+def test_load_dataset_applies_schema():
+    try:
+        df = load_dataset(config.DATA_FILE_NAME)
+        # Ensure categorical columns are stripped categoricals and numerics are compact
+        for col in config.CATEGORICAL_FEATURES_TO_ENCODE + [config.TARGET]:
+            assert isinstance(df[col].dtype, pd.CategoricalDtype), f"{col} not loaded as a categorical"
+            assert all(category == category.strip() for category in df[col].cat.categories), f"{col} categories not stripped"
+        assert df["loan_amount"].dtype == np.int32, "Numeric columns not loaded with the schema dtype"
+        # Ensure the vectorized target encoding matches the per-row encoding
+        y = EncodingTargetVariable(df[config.TARGET])
+        assert (y == df[config.TARGET].astype(str).map(EncodingTarget)).all(), "Vectorized target encoding is incorrect"
+        # Raw applications with the leading space of the csv are scored like stripped ones
+        X, _ = separate_data(df)
+        X_spaced = X.assign(**{col: " " + X[col].astype(str) for col in config.CATEGORICAL_FEATURES_TO_ENCODE})
+        assert (predict_batch(X_spaced) == predict_batch(X)).all(), "Leading spaces change the predictions"
+    except CustomException:
+        pytest.fail("CustomException raised: Dataset loading failed")
+    except Exception as e:
+        pytest.fail(f"Unexpected error: {e}")
+
+def test_cached_splits_round_trip(tmp_path, monkeypatch):
+    try:
+        monkeypatch.setattr(config, "DATASET_CACHE_DIR", str(tmp_path))
+        X_train, X_test, y_train, y_test, cache_hit = load_cached_splits(config.DATA_FILE_NAME)
+        assert not cache_hit, "Empty cache reported a hit"
+        cached = load_cached_splits(config.DATA_FILE_NAME)
+        assert cached[4], "Unchanged dataset was not served from the cache"
+        # Ensure the cached splits are identical to the freshly computed ones, dtypes and row index included
+        for fresh, from_cache in zip((X_train, X_test, y_train, y_test), cached[:4]):
+            if isinstance(fresh, pd.DataFrame):
+                pd.testing.assert_frame_equal(fresh, from_cache)
+            else:
+                pd.testing.assert_series_equal(fresh, from_cache)
+        # Ensure a config change produces a new cache entry
+        monkeypatch.setattr(config, "TEST_SIZE", 0.25)
+        X_train, X_test, _, _, cache_hit = load_cached_splits(config.DATA_FILE_NAME)
+        assert not cache_hit, "Cache entry reused after the split config changed"
+        assert len(X_test) == int(np.ceil(0.25 * (len(X_train) + len(X_test)))), "Splits not recomputed with the new config"
+    except CustomException:
+        pytest.fail("CustomException raised: Dataset cache failed")
+    except Exception as e:
+        pytest.fail(f"Unexpected error: {e}")
+
+def test_tracker_falls_back_to_local_store_and_deduplicates_artifacts(tmp_path):
+    try:
+        from mlflow import MlflowClient
+        # Nothing listens on port 9, so the tracker has to record the runs in the local store
+        tracker = AsyncTracker(tracking_uri="http://127.0.0.1:9", experiment_name="tracker-test", offline_dir=str(tmp_path))
+        assert tracker.offline, "Unreachable tracking server not detected"
+        artifact = tmp_path / "notes.txt"
+        artifact.write_text("unchanged artifact")
+        run_ids = []
+        for run in range(2):
+            with tracker.start_run(run_name=f"run-{run}"):
+                tracker.log_params({"TEST_SIZE": config.TEST_SIZE, "FEATURES": config.FEATURES})
+                tracker.log_metrics({"accuracy": 0.5 + run, "f1": 0.25})
+                tracker.log_artifact(str(artifact))
+                tracker.log_artifact(str(artifact))
+            run_ids.append(tracker.run_id)
+        client = MlflowClient(tracker.tracking_uri)
+        first, second = (client.get_run(run_id) for run_id in run_ids)
+        # Ensure the buffered params and metrics were flushed before the runs ended
+        assert second.info.status == "FINISHED", "Run not terminated"
+        assert second.data.params["TEST_SIZE"] == str(config.TEST_SIZE), "Buffered params not flushed"
+        assert second.data.metrics["accuracy"] == 1.5, "Buffered metrics not flushed"
+        # Ensure the artifact is uploaded once and referenced by the second run
+        assert [a.path for a in client.list_artifacts(run_ids[0])] == ["notes.txt"], "Artifact not uploaded"
+        assert client.list_artifacts(run_ids[1]) == [], "Unchanged artifact uploaded again"
+        assert second.data.tags["artifact_ref.notes.txt"].startswith(first.info.artifact_uri), "Artifact reference missing"
+    except CustomException:
+        pytest.fail("CustomException raised: Tracking failed")
+    except Exception as e:
+        pytest.fail(f"Unexpected error: {e}")
+
+def test_evaluation_matches_sklearn_metrics():
+    try:
+        from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, confusion_matrix, roc_auc_score
+        test_data = load_dataset(config.TEST_FILE_NAME)
+        X_test, y_test = separate_data(test_data)
+        y_score = load_pipeline(config.MODEL_NAME).predict_proba(X_test)[:, 1]
+        # Round the scores so the ROC-AUC tie handling is exercised too
+        y_score = np.round(y_score, 2)
+        y_pred = (y_score >= 0.5).astype(int)
+        results = evaluate(y_test, y_score, n_bootstrap=200)
+        metrics = results["metrics"]
+        # Ensure the single-pass metrics agree with sklearn
+        assert (results["confusion_matrix"] == confusion_matrix(y_test, y_pred)).all(), "Confusion matrix mismatch"
+        for name, expected in (("accuracy", accuracy_score(y_test, y_pred)), ("precision", precision_score(y_test, y_pred)),
+                               ("recall", recall_score(y_test, y_pred)), ("f1", f1_score(y_test, y_pred)),
+                               ("roc_auc", roc_auc_score(y_test, y_score))):
+            assert np.isclose(metrics[name], expected), f"{name} mismatch: {metrics[name]} != {expected}"
+        # Ensure the sweep at 0.5 agrees with the metrics at the decision threshold
+        sweep = results["threshold_sweep"]
+        at_half = int(np.flatnonzero(np.isclose(sweep["threshold"], 0.5))[0])
+        assert np.isclose(sweep["f1"][at_half], metrics["f1"]), "Threshold sweep mismatch"
+        # Ensure the intervals bracket the estimates and are reproducible
+        for name, (low, high) in results["confidence_intervals"].items():
+            assert low <= metrics[name] <= high, f"{name} outside its confidence interval"
+        assert bootstrap_confidence_intervals(y_test, y_score, n_bootstrap=200) == results["confidence_intervals"], "Bootstrap not reproducible"
+    except CustomException:
+        pytest.fail("CustomException raised: Evaluation failed")
+    except Exception as e:
+        pytest.fail(f"Unexpected error: {e}")
+
+def test_successive_halving_parallel_matches_sequential():
+    try:
+        train_data = load_dataset(config.TRAIN_FILE_NAME)
+        X_train, y_train = separate_data(train_data)
+        trial_data = prepare_trial_data(X_train, y_train)
+        candidates = [SEARCH_SPACE[0], SEARCH_SPACE[3], SEARCH_SPACE[15], SEARCH_SPACE[-1]]
+        parallel = successive_halving(trial_data, candidates, workers=2, min_rows=300, factor=2)
+        sequential = successive_halving(trial_data, candidates, workers=1, min_rows=300, factor=2)
+        # Ensure rounds halve the candidates and double the rows
+        assert [(t["round"], t["n_rows"]) for t in parallel][:4] == [(0, 300)] * 4, "First round not run on every candidate"
+        assert sum(1 for t in parallel if t["round"] == 1) == 2, "Second round did not keep half of the candidates"
+        # Ensure the process pool runs the same trials with the same scores
+        strip = lambda trials: [(t["candidate"], t["n_rows"], round(t["roc_auc"], 12)) for t in trials]
+        assert strip(parallel) == strip(sequential), "Parallel search differs from the sequential one"
+        summary = run_tuning(candidates, workers=1, save=False, log=False)
+        assert summary["selected"].startswith(("LogisticRegression", "SGDClassifier")), "A non-linear model was selected for saving"
+        assert not summary["saved"], "Model saved despite save=False"
+    except CustomException:
+        pytest.fail("CustomException raised: Tuning failed")
+    except Exception as e:
+        pytest.fail(f"Unexpected error: {e}")
+
+def test_incremental_training_streams_and_warm_starts():
+    try:
+        assert collect_categories(config.DATA_FILE_NAME, chunk_size=1000) == {
+            "education": ["Graduate", "Not Graduate"], "self_employed": ["No", "Yes"]}, "First pass categories are wrong"
+        test_data = load_dataset(config.TEST_FILE_NAME)
+        X_test, y_test = separate_data(test_data)
+        saved_model = load_pipeline(config.MODEL_NAME).named_steps["model"]
+        for warm_start in (False, True):
+            pipeline, summary = run_incremental_training(config.TRAIN_FILE_NAME, chunk_size=500, warm_start=warm_start, save=False, log=False)
+            assert summary["rows_seen"] == len(load_dataset(config.TRAIN_FILE_NAME)) * summary["epochs"], "Not every chunk was trained on"
+            # Ensure the model learned something and the fast scoring path still reads it
+            assert summary["progressive_log_loss"][-1] < np.log(2), "Model is worse than a coin flip"
+            y_pred, y_proba = predict_batch(X_test, return_proba=True, model_parameters=extract_model_parameters(pipeline))
+            assert np.allclose(y_proba, pipeline.predict_proba(X_test)[:, 1]), "Incremental model not supported by predict_batch"
+        # Ensure the warm start continued from the saved weights instead of starting over
+        coef_change = np.abs(pipeline.named_steps["model"].coef_ - saved_model.coef_).max()
+        assert coef_change < 0.05, f"Warm start moved the saved weights by {coef_change}"
+    except CustomException:
+        pytest.fail("CustomException raised: Incremental training failed")
+    except Exception as e:
+        pytest.fail(f"Unexpected error: {e}")
+
+def test_prediction_cache_hits_evicts_and_invalidates(tmp_path, monkeypatch):
+    try:
+        import joblib
+        # Work on a copy of the saved model, so it can be replaced
+        pipeline = load_pipeline(config.MODEL_NAME)
+        monkeypatch.setattr(config, "SAVE_MODEL_PATH", str(tmp_path))
+        joblib.dump(pipeline, tmp_path / config.MODEL_NAME)
+        X, _ = separate_data(load_dataset(config.TEST_FILE_NAME))
+        records = X.head(20).to_dict("records")
+        shared_path = str(tmp_path / "prediction_cache.db")
+        predictor = CachedPredictor(cache=PredictionCache(max_entries=10, shared_path=shared_path))
+        y_pred, y_proba = predictor.predict(records[:5])
+        assert np.allclose(y_proba, predict_batch(records[:5], return_proba=True)[1]), "Cached predictor scores differently"
+        # Ensure a resubmitted application is a hit even with a new loan_id and the raw csv formatting
+        resubmitted = dict(records[0], loan_id=-1, education=" " + records[0]["education"], loan_term=float(records[0]["loan_term"]))
+        predictor.predict(resubmitted)
+        stats = predictor.stats()
+        assert (stats["hits"], stats["misses"]) == (1, 5), f"Unexpected counters: {stats}"
+        # Ensure the cache stays within its size bound
+        predictor.predict(records)
+        assert predictor.stats()["size"] == 10 and predictor.stats()["evictions"] > 0, "LRU bound not enforced"
+        # Ensure another process (a second predictor) is served from the shared backend
+        other = CachedPredictor(cache=PredictionCache(max_entries=10, shared_path=shared_path))
+        other.predict(records[-3:])
+        assert other.stats()["shared_hits"] == 3, "Shared backend not used"
+        # Ensure saving a new model invalidates the cache
+        version = predictor.version
+        pipeline.named_steps["model"].intercept_ = pipeline.named_steps["model"].intercept_ - 5.0
+        joblib.dump(pipeline, tmp_path / config.MODEL_NAME)
+        _, new_proba = predictor.predict(records[:5])
+        assert predictor.version != version and predictor.stats()["invalidations"] == 2, "New model did not invalidate the cache"
+        assert np.all(new_proba < y_proba), "Stale predictions served after a new model was saved"
+    except CustomException:
+        pytest.fail("CustomException raised: Prediction cache failed")
+    except Exception as e:
+        pytest.fail(f"Unexpected error: {e}")
+
+
+def test_model_registry_hot_swaps_and_shadows(tmp_path, monkeypatch):
+    try:
+        import time
+        import joblib
+        from prediction_model.processing.data_handling import save_model_artifact
+        # Register two versions of the saved model in a scratch model directory
+        pipeline = load_pipeline(config.MODEL_NAME)
+        monkeypatch.setattr(config, "SAVE_MODEL_PATH", str(tmp_path))
+        versions = []
+        for shift in (0.0, -5.0):
+            pipeline.named_steps["model"].intercept_ = pipeline.named_steps["model"].intercept_ + shift
+            joblib.dump(pipeline, tmp_path / config.MODEL_NAME)
+            save_model_artifact(extract_model_parameters(pipeline))
+            versions.append(register_model())
+        assert [manifest["version"] for manifest in list_versions()] == versions, "Registered versions not listed"
+        assert [manifest["active"] for manifest in list_versions()] == [False, True], "Saved model not marked active"
+        X, _ = separate_data(load_dataset(config.TEST_FILE_NAME))
+        records = X.head(20).to_dict("records")
+        registry = ModelRegistry()
+        assert registry.active.version == versions[1], "Registry did not load the saved model"
+        # Ensure a candidate scores live traffic in shadow without changing the answers
+        registry.start_shadow(versions[0]).result()
+        # Ensure a version that is not a registered directory name is never joined into a model path
+        for version in ("../../../../tmp/evil", "..", "not-registered"):
+            with pytest.raises(ValueError):
+                registry.load(version)
+            with pytest.raises(ValueError):
+                registry.start_shadow(version)
+        _, y_proba = registry.predict(records)
+        for _ in range(100):
+            if registry.shadow_report()["batches"]:
+                break
+            time.sleep(0.01)
+        report = registry.stop_shadow()
+        assert report["rows"] == 20 and report["max_abs_probability_diff"] > 0, f"Unexpected shadow report: {report}"
+        assert set(report["latency"]) == {"active", "shadow"}, "Shadow latency not measured"
+        # Ensure promoting swaps the active model while a request holding the old one still uses it
+        in_flight = registry.active
+        cached_intercept = get_model_parameters()["intercept"]
+        promote(versions[0])
+        assert registry.load().result().version == versions[0], "Promoted version not swapped in"
+        assert np.allclose(registry.predict(records, model=in_flight)[1], y_proba), "In-flight request changed model"
+        assert np.all(registry.predict(records)[1] > y_proba), "Active model not used after the swap"
+        assert get_model_parameters()["intercept"] > cached_intercept, "Cached model parameters not reloaded after the promote"
+        # Ensure an explicitly loaded version is not replaced by the watcher until the saved model is loaded again
+        registry.load(versions[1]).result()
+        registry.start_watching(0.01)
+        time.sleep(0.2)
+        registry.stop_watching()
+        assert registry.active.version == versions[1], "Watcher replaced the explicitly loaded version"
+        assert registry.load().result().version == versions[0], "Saved model not loaded back"
+        # Ensure a model that fails its check is never swapped in
+        pipeline.named_steps["model"].coef_ = np.full_like(pipeline.named_steps["model"].coef_, np.nan)
+        joblib.dump(pipeline, tmp_path / config.MODEL_NAME)
+        assert registry.load().exception() is not None, "Invalid model passed the check"
+        assert registry.active.version == versions[0], "Invalid model was swapped in"
+    except CustomException:
+        pytest.fail("CustomException raised: Model registry failed")
+    except Exception as e:
+        pytest.fail(f"Unexpected error: {e}")
+
+
+def test_async_predictor_batches_concurrent_awaits():
+    try:
+        import asyncio
+        X, _ = separate_data(load_dataset(config.TEST_FILE_NAME))
+        records = X.head(300).to_dict("records")
+        expected_pred, expected_proba = predict_batch(records, return_proba=True)
+
+        async def run():
+            # A queue smaller than the number of coroutines exercises the backpressure
+            async with AsyncPredictor(max_batch_size=64, max_queue_depth=32) as predictor:
+                results = await asyncio.gather(*(predictor.predict(record) for record in records))
+                batch_pred, batch_proba = await predictor.predict_many(records)
+                # Ensure a malformed application only fails its own await
+                outcomes = await asyncio.gather(predictor.predict({"education": "Graduate"}), predictor.predict(records[0]),
+                                                return_exceptions=True)
+                return results, batch_pred, batch_proba, outcomes, predictor.stats()
+
+        results, batch_pred, batch_proba, outcomes, stats = asyncio.run(run())
+        assert [pred for pred, _ in results] == expected_pred.tolist(), "Async predictions differ from predict_batch"
+        assert np.allclose([proba for _, proba in results], expected_proba), "Async probabilities differ from predict_batch"
+        assert np.allclose(batch_proba, expected_proba) and batch_pred.tolist() == expected_pred.tolist(), "predict_many differs"
+        assert stats["batches"] < 300 / 4, f"Concurrent awaits were not batched: {stats}"
+        assert isinstance(outcomes[0], Exception) and outcomes[1][1] == results[0][1], "Malformed record not isolated"
+
+        async def close_while_collecting():
+            # Ensure closing resolves an application still waiting for its batch to fill up
+            predictor = AsyncPredictor(max_wait_ms=50)
+            pending = asyncio.ensure_future(predictor.predict(records[0]))
+            await asyncio.sleep(0.005)
+            await asyncio.wait_for(predictor.aclose(), 5)
+            return await asyncio.wait_for(pending, 1)
+
+        assert asyncio.run(close_while_collecting()) == results[0], "Application collected before aclose() was not scored"
+    except CustomException:
+        pytest.fail("CustomException raised: Async prediction failed")
+    except Exception as e:
+        pytest.fail(f"Unexpected error: {e}")
+
+
+def test_instrumentation_records_stages_and_exports(tmp_path):
+    try:
+        import json
+        instrumentation.reset()
+        # Ensure nothing is recorded while disabled
+        instrumentation.disable()
+        load_dataset(config.TEST_FILE_NAME)
+        assert instrumentation.summary() == {}, "Stages recorded while instrumentation is disabled"
+        instrumentation.enable()
+        try:
+            X, _ = separate_data(load_dataset(config.TEST_FILE_NAME))
+            classification_pipeline = load_pipeline(config.MODEL_NAME)
+            y_pred = instrumentation.pipeline_predict(classification_pipeline, X)
+        finally:
+            instrumentation.disable()
+        assert np.array_equal(y_pred, classification_pipeline.predict(X)), "Step by step predictions differ"
+        stages = instrumentation.summary()
+        for name in ("load_dataset", "pipeline.preprocessor.transform", "pipeline.model.predict"):
+            assert name in stages, f"Stage {name} not recorded: {list(stages)}"
+        assert stages["load_dataset"]["rows"] == len(X) and stages["load_dataset"]["rows_per_s"] > 0, "Rows not counted"
+        text = instrumentation.prometheus_text()
+        assert 'loan_model_stage_duration_seconds_bucket{stage="load_dataset",le="+Inf"} 1' in text, "Histogram not exported"
+        with open(instrumentation.write_summary("test", str(tmp_path))) as f:
+            assert json.load(f)["stages"] == json.loads(json.dumps(stages)), "JSON summary differs"
+        instrumentation.reset()
+    except CustomException:
+        pytest.fail("CustomException raised: Instrumentation failed")
+    except Exception as e:
+        pytest.fail(f"Unexpected error: {e}")
+
+
+def test_synthetic_data_matches_source_marginals(tmp_path):
+    try:
+        profile = fit_profile()
+        # Small chunks so the file is written in several appends
+        file_path = write_synthetic_dataset(str(tmp_path / "synthetic.csv"), 20_000, profile, seed=7, chunk_size=6_000)
+        with open(file_path) as f, open(os.path.join(config.DATASET_DIR, config.DATA_FILE_NAME)) as source:
+            assert f.readline() == source.readline(), "Synthetic file does not use the raw header"
+        synthetic = load_dataset(file_path)
+        real = load_dataset(config.DATA_FILE_NAME)
+        assert len(synthetic) == 20_000 and synthetic["loan_id"].is_unique, "Unexpected synthetic rows"
+        assert (synthetic.dtypes == real.dtypes).all(), "Synthetic data does not load with the dataset schema"
+        for col in config.CATEGORICAL_FEATURES_TO_ENCODE + [config.TARGET]:
+            difference = synthetic[col].value_counts(normalize=True) - real[col].value_counts(normalize=True)
+            assert difference.abs().max() < 0.02, f"Category frequencies of {col} differ"
+        for col in ["income_annum", "loan_amount", "cibil_score", "bank_asset_value"]:
+            assert synthetic[col].between(real[col].min(), real[col].max()).all(), f"{col} outside the source range"
+            assert abs(synthetic[col].median() - real[col].median()) <= 0.05 * real[col].std(), f"Median of {col} differs"
+        # Ensure the same seed reproduces the same rows
+        again = write_synthetic_dataset(str(tmp_path / "again.csv"), 20_000, profile, seed=7, chunk_size=6_000)
+        assert load_dataset(again).equals(synthetic), "Synthetic data is not reproducible"
+    except CustomException:
+        pytest.fail("CustomException raised: Synthetic data generation failed")
+    except Exception as e:
+        pytest.fail(f"Unexpected error: {e}")
+
+def test_validation_reports_invalid_rows_and_scores_the_rest():
+    try:
+        X, _ = separate_data(load_dataset(config.DATA_FILE_NAME))
+        records = X.head(6).to_dict('records')
+        records[1]['cibil_score'] = -5
+        records[2]['education'] = ' Graduat'
+        del records[3]['bank_asset_value']
+        records[4]['loan_term'] = "twelve"
+        records[5]['education'] = ' Not Graduate' # raw value with its leading space is valid
+        validation = validate_batch(records)
+        assert validation.valid.tolist() == [True, False, False, False, False, True], "Unexpected validation mask"
+        assert validation.reasons(3) == ["bank_asset_value: missing"], "Missing field not reported"
+        assert validation.reasons(1)[0].startswith("cibil_score: out of range"), "Out of range value not reported"
+        # Ensure the valid rows are scored as predict_batch scores them
+        y_pred, y_proba, _ = predict_valid(records)
+        expected_pred, expected_proba = predict_batch([records[0], records[5]], return_proba=True)
+        assert y_pred.tolist() == expected_pred.tolist() and np.allclose(y_proba, expected_proba), "Valid rows scored differently"
+        # Ensure the whole dataset passes and a malformed row does not fail a served batch
+        assert validate_batch(X).valid.all(), "Valid dataset rejected"
+        response = create_app().test_client().post("/predict/batch", json=records).get_json()
+        assert response["predictions"][1] is None and response["predictions"][0] == expected_pred[0], "Batch not partially scored"
+        assert [error["index"] for error in response["errors"]] == [1, 2, 3, 4], "Unexpected row errors"
+    except CustomException:
+        pytest.fail("CustomException raised: Validation failed")
+    except Exception as e:
+        pytest.fail(f"Unexpected error: {e}")
+
+def test_predict_with_reasons_decomposes_log_odds():
+    try:
+        X, _ = separate_data(load_dataset(config.DATA_FILE_NAME))
+        records = X.head(200)
+        # Ensure the contributions of every field add up to the log-odds of the saved model
+        y_pred, y_proba, codes, contributions, fields = predict_with_reasons(records, top_k=10)
+        expected_pred, expected_proba = predict_batch(records, return_proba=True)
+        intercept = CompiledScorer.from_saved_model().intercept
+        assert y_pred.tolist() == expected_pred.tolist() and np.allclose(y_proba, expected_proba), "Predictions differ from predict_batch"
+        assert np.allclose(contributions.sum(axis=1) + intercept, np.log(y_proba / (1 - y_proba))), "Contributions do not add up"
+        # A model with a one-hot, a raw and a merged field, rejecting the application below
+        model_parameters = {'columns': [('education', 'Not Graduate'), ('cibil_score', None), (config.CUSTOM_COLUMN_NAME, None)],
+                            'coef': np.array([-2.0, 0.5, -0.3]), 'intercept': -1.0, 'classes': np.array([0, 1])}
+        application = {'education': ' Not Graduate', 'cibil_score': 600, 'residential_assets_value': 100,
+                       'commercial_assets_value': 0, 'luxury_assets_value': 0, 'bank_asset_value': 0}
+        y_pred, _, codes, contributions, fields = predict_with_reasons([application], top_k=3, model_parameters=model_parameters)
+        assert y_pred[0] == 0, "Application not rejected"
+        reasons = [fields[code] if code >= 0 else None for code in codes[0]]
+        assert reasons == ['education', config.CUSTOM_COLUMN_NAME, None], "Unexpected reasons"
+        assert np.allclose(contributions[0], [-2.0, -0.3 * np.log1p(100), 0.5 * np.log1p(600)]), "Unexpected contributions"
+    except CustomException:
+        pytest.fail("CustomException raised: Reason codes failed")
+    except Exception as e:
+        pytest.fail(f"Unexpected error: {e}")
+
+def test_what_if_closed_form_matches_grid_scoring():
+    try:
+        X, _ = separate_data(load_dataset(config.DATA_FILE_NAME))
+        records = X.head(50)
+        # A model where larger loans lower the approval odds through log1p(loan_amount)
+        model_parameters = {'columns': [('loan_amount', None), ('cibil_score', None)],
+                            'coef': np.array([-1.0, 3.0]), 'intercept': 0.0, 'classes': np.array([0, 1])}
+        limits = max_approvable(records, 'loan_amount', 0.7, model_parameters)
+        assert np.isfinite(limits).all() and (limits > 0).all(), "Unexpected approvable amounts"
+        # Ensure the closed form sits exactly on the threshold of the grid scores around it
+        probabilities = score_grid(records, {'loan_amount': limits}, model_parameters)
+        assert probabilities.shape == (50, 50), "Unexpected grid shape"
+        assert np.allclose(np.diagonal(probabilities), 0.7), "Closed form is not on the threshold"
+        grid = score_grid(records, {'loan_amount': [1e5, 1e7], 'cibil_score': [300, 600, 900]}, model_parameters)
+        changed = records.assign(loan_amount=1e7, cibil_score=600)
+        assert np.allclose(grid[:, 1, 1], predict_batch(changed, True, model_parameters)[1]), "Grid differs from predict_batch"
+        # loan_amount has no weight in the saved model, it cannot change any prediction
+        lower, upper = approval_range(records, 'loan_amount')
+        approved = predict_batch(records) == 1
+        assert np.isinf(upper[approved]).all() and np.isnan(upper[~approved]).all(), "Unused field not reported as unbounded"
+    except CustomException:
+        pytest.fail("CustomException raised: What-if scoring failed")
+    except Exception as e:
+        pytest.fail(f"Unexpected error: {e}")
+
+def test_portfolio_rescoring_only_rescores_changed_loans(tmp_path):
+    try:
+        book = pd.read_csv(os.path.join(config.DATASET_DIR, config.TEST_FILE_NAME)).drop(columns=[config.TARGET])
+        book.to_csv(tmp_path / "book.csv", index=False)
+        index_dir = str(tmp_path / "index")
+        first = rescore_portfolio(str(tmp_path / "book.csv"), str(tmp_path / "scores1.csv"), index_dir, chunk_size=300)
+        assert first["rescored"] == len(book) and first["full_rescore"], "First run did not score every loan"
+        # Change two loans, remove one and add a new one
+        book.loc[[3, 10], "loan_term"] += 2
+        new_loan = book.iloc[[0]].assign(loan_id=book["loan_id"].max() + 1)
+        book = pd.concat([book.drop(index=5), new_loan], ignore_index=True)
+        book.to_csv(tmp_path / "book.csv", index=False)
+        second = rescore_portfolio(str(tmp_path / "book.csv"), str(tmp_path / "scores2.csv"), index_dir, chunk_size=300)
+        assert (second["new"], second["changed"], second["removed"]) == (1, 2, 1), "Changes not detected"
+        assert second["unchanged"] == len(book) - 3 and not second["full_rescore"], "Unchanged loans were rescored"
+        # Ensure the score table is complete and matches scoring everything again
+        scores = pd.read_csv(tmp_path / "scores2.csv")
+        assert scores["loan_id"].tolist() == book["loan_id"].tolist(), "Score table is incomplete"
+        assert np.allclose(scores["probability"], predict_batch(book, return_proba=True)[1]), "Stale scores in the table"
+        # Another model version rescores every loan
+        meta_path = os.path.join(index_dir, "meta.json")
+        with open(meta_path) as f:
+            meta = json.load(f)
+        with open(meta_path, "w") as f:
+            json.dump({**meta, "model_version": "0.0.0+old"}, f)
+        third = rescore_portfolio(str(tmp_path / "book.csv"), str(tmp_path / "scores3.csv"), index_dir, chunk_size=300)
+        assert third["full_rescore"] and third["rescored"] == len(book), "Model version change did not rescore every loan"
+        # Ensure a book with duplicate or non integer ids fails before the previous score table is replaced
+        previous_scores = (tmp_path / "scores3.csv").read_bytes()
+        for name, bad_book in (("duplicates.csv", pd.concat([book, book.iloc[[7]]], ignore_index=True)),
+                               ("string_ids.csv", book.assign(loan_id="L" + book["loan_id"].astype(str)))):
+            bad_book.to_csv(tmp_path / name, index=False)
+            with pytest.raises(CustomException):
+                rescore_portfolio(str(tmp_path / name), str(tmp_path / "scores3.csv"), index_dir, chunk_size=300)
+        assert (tmp_path / "scores3.csv").read_bytes() == previous_scores, "Failed run replaced the score table"
+        assert sorted(os.listdir(tmp_path)) == sorted(["book.csv", "duplicates.csv", "string_ids.csv", "index",
+                                                       "scores1.csv", "scores2.csv", "scores3.csv"]), "Temporary score table left behind"
+    except CustomException:
+        pytest.fail("CustomException raised: Portfolio rescoring failed")
+    except Exception as e:
+        pytest.fail(f"Unexpected error: {e}")
+
+def test_drift_monitor_flags_shifted_features():
+    try:
+        X_train, X_test, _, _, _ = load_cached_splits(config.DATA_FILE_NAME)
+        profile = build_reference_profile(X_train, predict_batch(X_train, return_proba=True)[1])
+        assert load_reference_profile() is not None, "Shipped model has no reference profile"
+        # Ensure the held out split of the same data shows no drift
+        monitor = DriftMonitor(profile, "test")
+        for start in range(0, len(X_test), 64):
+            batch = X_test.iloc[start:start + 64].to_dict("records")
+            monitor.observe(batch, predict_batch(batch, return_proba=True)[1])
+        report = monitor.report()
+        assert report["rows"] == len(X_test) and report["drifted"] == [], f"Drift found in the test split: {report['drifted']}"
+        assert report["features"]["education"]["psi"] < config.DRIFT_PSI_ALERT, "Category shares not compared"
+        # Ensure a shifted feature is flagged, counted on the background thread
+        shifted = X_test.assign(cibil_score=X_test["cibil_score"] * 0.7)
+        monitor.set_reference(profile, "shifted")
+        monitor.submit(shifted, predict_batch(shifted, return_proba=True)[1])
+        monitor.close()
+        report = monitor.report()
+        assert report["drifted"] == ["cibil_score"], f"Shift not flagged: {report['drifted']}"
+        assert report["features"]["cibil_score"]["quantiles"]["p50"] < np.median(X_train["cibil_score"]), "Quantiles not shifted"
+        # Ensure a report stays consistent when the reference is replaced right after the counts were copied
+        snapshot = monitor.snapshot
+        def snapshot_then_reload():
+            taken = snapshot()
+            monitor.set_reference(build_reference_profile(X_train, predict_batch(X_train, return_proba=True)[1], bins=5), "reloaded")
+            return taken
+        monitor.snapshot = snapshot_then_reload
+        assert monitor.report()["drifted"] == ["cibil_score"], "Report mixed counts and bins of two profiles"
+    except CustomException:
+        pytest.fail("CustomException raised: Drift monitoring failed")
+    except Exception as e:
+        pytest.fail(f"Unexpected error: {e}")